@@ -0,0 +1,139 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from app.utils import connect_sqlite
+
+
+class AnswerCache:
+    """
+    Two-tier cache for generated answers.
+
+    An in-process LRU sits in front of a SQLite table in WAL mode, which is
+    safe for several Streamlit sessions and worker processes at once. Entries
+    expire after `ttl` seconds and only match while the corpus version they
+    were produced for is current; entries for other corpus versions are left
+    for the sessions that still use them and age out through LRU eviction.
+    """
+
+    def __init__(self, path="data/answer_cache.db", max_entries=10_000, memory_entries=512, ttl=7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.ttl = ttl
+        self._memory = OrderedDict()  # key -> (value, corpus_version, created)
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, corpus_version TEXT NOT NULL,"
+            " created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers(last_used)")
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lookup_seconds = 0.0
+        self._lookups = 0
+
+    @staticmethod
+    def _hash_key(key_dict):
+        raw = json.dumps(key_dict, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _expired(self, created):
+        return self.ttl is not None and time.time() - created >= self.ttl
+
+    def get(self, key_dict, corpus_version=""):
+        start = time.perf_counter()
+        key = self._hash_key(key_dict)
+        try:
+            with self._lock:
+                entry = self._memory.get(key)
+                if entry is not None:
+                    value, version, created = entry
+                    if self._expired(created):
+                        del self._memory[key]
+                    elif version == corpus_version:
+                        self._memory.move_to_end(key)
+                        self.memory_hits += 1
+                        return value
+
+                row = self._conn.execute(
+                    "SELECT value, corpus_version, created FROM answers WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value, version, created = row
+                    if self._expired(created):
+                        self._conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+                    elif version == corpus_version:
+                        self._conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (time.time(), key))
+                        self._remember(key, value, version, created)
+                        self.disk_hits += 1
+                        return value
+                self.misses += 1
+                return None
+        finally:
+            self._lookup_seconds += time.perf_counter() - start
+            self._lookups += 1
+
+    def set(self, key_dict, value, corpus_version=""):
+        key = self._hash_key(key_dict)
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, corpus_version, now)
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?)",
+                                   (key, value, corpus_version, now, now))
+                self._evict()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _remember(self, key, value, version, created):
+        self._memory[key] = (value, version, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        if self.ttl is not None:
+            self._conn.execute("DELETE FROM answers WHERE created < ?", (time.time() - self.ttl,))
+        count = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        if count > self.max_entries:
+            excess = count - int(self.max_entries * 0.9)
+            self._conn.execute(
+                "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._conn.execute("DELETE FROM answers")
+
+    def stats(self):
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / total, 3) if total else 0.0,
+            "avg_lookup_ms": round(1000 * self._lookup_seconds / self._lookups, 3) if self._lookups else 0.0,
+        }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_answer_cache(path="data/answer_cache.db", **kwargs):
+    """One AnswerCache per path and process, shared by every RAGPipeline."""
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = AnswerCache(path, **kwargs)
+        return _caches[path]
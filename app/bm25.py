@@ -0,0 +1,363 @@
+import json
+import os
+import re
+import unicodedata
+from collections import Counter
+import numpy as np
+from app.utils import atomic_write, file_lock
+
+BM25_DIR = "bm25"
+FORMAT = 2
+LOCK_FILE = ".lock"
+# Delta files a save() may stack on the base before it rewrites everything
+MAX_DELTA_FILES = 32
+
+_TOKEN_RE = re.compile(r"\w+")
+# Dotted/dotless i: casefold() maps "İ" to "i" + combining dot and keeps "ı",
+# so "İstanbul", "ISTANBUL" and "ıstanbul" would be three different terms.
+_TURKISH_I = str.maketrans({"İ": "i", "I": "i", "ı": "i"})
+
+
+def tokenize(text):
+    """
+    Unicode-aware tokenizer for German/Turkish/English text: NFKC, Turkish i
+    folding, casefold (so "Straße" matches "STRASSE"), then word characters.
+    """
+    text = unicodedata.normalize("NFKC", text).translate(_TURKISH_I).casefold()
+    return _TOKEN_RE.findall(text)
+
+
+class _Postings:
+    """One term-major CSR block: postings of term t are rows/tfs[indptr[t]:indptr[t+1]]."""
+
+    def __init__(self, indptr, rows, tfs):
+        self.indptr = indptr
+        self.rows = rows
+        self.tfs = tfs
+
+    @classmethod
+    def build(cls, term_ids, rows, tfs, vocab_size):
+        order = np.argsort(term_ids, kind="stable")
+        counts = np.bincount(term_ids, minlength=vocab_size)
+        indptr = np.zeros(vocab_size + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return cls(indptr, rows[order], tfs[order])
+
+    def term(self, term_id):
+        if term_id + 1 >= len(self.indptr):
+            # Term added to the vocabulary after this block was built
+            return self.rows[:0], self.tfs[:0]
+        start, end = self.indptr[term_id], self.indptr[term_id + 1]
+        return self.rows[start:end], self.tfs[start:end]
+
+    def live_df(self, live, vocab_size):
+        """Number of live rows per term, vectorized over all postings."""
+        counts = np.zeros(len(self.rows) + 1, dtype=np.int64)
+        np.cumsum(live[self.rows], out=counts[1:])
+        df = counts[self.indptr[1:]] - counts[self.indptr[:-1]]
+        return np.pad(df, (0, vocab_size - len(df)))
+
+    def term_ids(self):
+        return np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int64), np.diff(self.indptr))
+
+
+def _pack_terms(terms):
+    # Tokens are \w+ runs, so they never contain a newline
+    return np.frombuffer("\n".join(terms).encode("utf-8"), dtype=np.uint8)
+
+
+def _unpack_terms(data):
+    text = data.tobytes().decode("utf-8")
+    return text.split("\n") if text else []
+
+
+class BM25Index:
+    """
+    Okapi BM25 over an inverted index owned by us instead of rank_bm25.
+
+    - The vocabulary (term -> id) persists and only grows.
+    - Postings are term-major CSR blocks; new chunks go into a small extra
+      block that is merged into the main one once it grows past
+      `merge_ratio` of it, so an upload does not rebuild the whole index.
+    - Deletes are a row mask; merging drops dead rows.
+    - Scoring is one np.bincount over the query terms' postings and top-k
+      uses argpartition.
+
+    Rows are kept in sync with a ChunkStore through its chunk ids (`sync`).
+    IDF is the non-negative Lucene variant, log(1 + (N - df + 0.5) / (df + 0.5)).
+
+    save() writes only what changed since the previous save as a delta file
+    next to the base file; the base is rewritten once the deltas outgrow
+    `merge_ratio` of it (or after an in-memory merge renumbered the rows).
+    """
+
+    def __init__(self, k1=1.5, b=0.75, merge_ratio=0.1):
+        self.k1 = k1
+        self.b = b
+        self.merge_ratio = merge_ratio
+        self.vocab = {}
+        self._blocks = []
+        self.ids = np.zeros(0, dtype=np.int64)  # row -> chunk id, increasing
+        self.doc_len = np.zeros(0, dtype=np.int32)
+        self.live = np.zeros(0, dtype=bool)
+        self._df = np.zeros(0, dtype=np.int64)
+        # meta.json of the last save()/load() and the state it covers;
+        # None means the next save() rewrites the base
+        self._saved = None
+        self._saved_blocks = 0
+        self._saved_terms = 0
+        self._saved_live = np.zeros(0, dtype=bool)
+
+    def __len__(self):
+        return int(self.live.sum())
+
+    @property
+    def num_postings(self):
+        return sum(len(block.rows) for block in self._blocks)
+
+    # ------------------------------------------------------------------ #
+    # Updates
+    # ------------------------------------------------------------------ #
+    def add(self, chunk_ids, texts):
+        """Index new chunks; ids must be larger than every id already indexed."""
+        chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+        if not len(chunk_ids):
+            return
+        if len(self.ids) and chunk_ids[0] <= self.ids[-1]:
+            raise ValueError("chunk ids must be increasing")
+        first_row = len(self.ids)
+        term_ids, rows, tfs, lengths = [], [], [], []
+        vocab = self.vocab
+        for offset, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                term_id = vocab.get(term)
+                if term_id is None:
+                    term_id = vocab[term] = len(vocab)
+                term_ids.append(term_id)
+                rows.append(first_row + offset)
+                tfs.append(tf)
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        block = _Postings.build(term_ids, np.asarray(rows, dtype=np.int32),
+                                np.asarray(tfs, dtype=np.int32), len(vocab))
+        self._blocks.append(block)
+        self.ids = np.concatenate([self.ids, chunk_ids])
+        self.doc_len = np.concatenate([self.doc_len, np.asarray(lengths, dtype=np.int32)])
+        self.live = np.concatenate([self.live, np.ones(len(chunk_ids), dtype=bool)])
+        self._df = np.pad(self._df, (0, len(vocab) - len(self._df)))
+        self._df += np.bincount(term_ids, minlength=len(vocab))
+        if len(self._blocks) > 1 and len(block.rows) > self.merge_ratio * len(self._blocks[0].rows):
+            self._merge()
+
+    def delete(self, chunk_ids):
+        chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+        rows = np.searchsorted(self.ids, chunk_ids)
+        found = rows < len(self.ids)
+        found[found] = self.ids[rows[found]] == chunk_ids[found]
+        rows = rows[found]
+        rows = rows[self.live[rows]]
+        if not len(rows):
+            return
+        self.live[rows] = False
+        if (~self.live).sum() > 0.3 * len(self.live):
+            self._merge()
+        else:
+            self._df = sum(block.live_df(self.live, len(self.vocab)) for block in self._blocks)
+
+    def sync(self, chunks):
+        """
+        Bring the index in line with a ChunkStore: delete rows whose chunk is
+        gone, add chunks that are new. Returns True if anything changed.
+        """
+        store_ids = chunks.ids()
+        indexed = self.ids[self.live]
+        removed = np.setdiff1d(indexed, store_ids, assume_unique=True)
+        last = self.ids[-1] if len(self.ids) else -1
+        added = store_ids[store_ids > last]
+        if len(removed):
+            self.delete(removed)
+        if len(added):
+            self.add(added, [chunks.text(int(i)) for i in added])
+        return bool(len(removed) or len(added))
+
+    def _merge(self):
+        """Fold every block into one and drop deleted rows (renumbering rows)."""
+        vocab_size = len(self.vocab)
+        blocks = self._blocks or [_Postings(np.zeros(1, np.int64), np.zeros(0, np.int32), np.zeros(0, np.int32))]
+        term_ids = np.concatenate([block.term_ids() for block in blocks])
+        rows = np.concatenate([block.rows for block in blocks])
+        tfs = np.concatenate([block.tfs for block in blocks])
+        keep = self.live[rows]
+        new_row = (np.cumsum(self.live) - 1).astype(np.int32)
+        merged = _Postings.build(term_ids[keep], new_row[rows[keep]], tfs[keep], vocab_size)
+        self._blocks = [merged]
+        self.ids = self.ids[self.live]
+        self.doc_len = self.doc_len[self.live]
+        self.live = np.ones(len(self.ids), dtype=bool)
+        self._df = np.bincount(term_ids[keep], minlength=vocab_size)
+        self._saved = None  # rows were renumbered; saved deltas no longer apply
+
+    # ------------------------------------------------------------------ #
+    # Search
+    # ------------------------------------------------------------------ #
+    def get_scores(self, query):
+        """BM25 score of every row (deleted rows score 0)."""
+        n_live = len(self)
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        if not n_live:
+            return scores
+        avgdl = self.doc_len[self.live].mean() or 1.0
+        term_ids = [self.vocab[t] for t in set(tokenize(query)) if t in self.vocab]
+        all_rows, all_weights = [], []
+        for term_id in term_ids:
+            df = self._df[term_id]
+            if not df:
+                continue
+            idf = np.log1p((n_live - df + 0.5) / (df + 0.5))
+            for block in self._blocks:
+                rows, tfs = block.term(term_id)
+                if not len(rows):
+                    continue
+                tfs = tfs.astype(np.float32)
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[rows] / avgdl)
+                all_rows.append(rows)
+                all_weights.append(idf * tfs * (self.k1 + 1) / (tfs + norm))
+        if all_rows:
+            scores = np.bincount(np.concatenate(all_rows), weights=np.concatenate(all_weights),
+                                 minlength=len(self.ids)).astype(np.float32)
+            scores[~self.live] = 0
+        return scores
+
+    def top_k(self, query, k):
+        """(chunk ids, scores) of the k best matching live chunks, best first."""
+        scores = self.get_scores(query)
+        matched = np.flatnonzero(scores > 0)
+        if not len(matched):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        if len(matched) > k:
+            matched = matched[np.argpartition(scores[matched], -k)[-k:]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return self.ids[matched], scores[matched]
+
+    # ------------------------------------------------------------------ #
+    # Persistence
+    # ------------------------------------------------------------------ #
+    def save(self, path, fingerprint=""):
+        """
+        Persist the index under `path`, recording the ChunkStore fingerprint
+        it was built from. Usually only the rows, terms and deletes since the
+        previous save are written (a delta file); meta.json is replaced last
+        and lists the base and delta files that make up the index.
+        """
+        os.makedirs(path, exist_ok=True)
+        with file_lock(os.path.join(path, LOCK_FILE)):
+            on_disk = _read_meta(path)
+            deltas = self._blocks[self._saved_blocks:] if self._saved is not None else None
+            delta_postings = sum(len(block.rows) for block in deltas or [])
+            if (deltas is None or on_disk != self._saved  # another writer saved since
+                    or len(on_disk["deltas"]) >= MAX_DELTA_FILES
+                    or on_disk["delta_postings"] + delta_postings > self.merge_ratio * on_disk["base_postings"]):
+                meta = self._save_base(path, on_disk)
+            else:
+                meta = self._save_delta(path, on_disk, deltas, delta_postings)
+            meta["fingerprint"] = fingerprint
+            atomic_write(os.path.join(path, "meta.json"), lambda f: json.dump(meta, f), mode="w")
+            keep = {meta["base"], *meta["deltas"]}
+            for name in os.listdir(path):
+                if name.endswith(".npz") and name not in keep:
+                    os.remove(os.path.join(path, name))
+        self._mark_saved(meta)
+
+    def _save_base(self, path, on_disk):
+        if len(self._blocks) != 1 or not self.live.all():
+            self._merge()
+        block = self._blocks[0]
+        seq = (on_disk or {}).get("seq", 0) + 1
+        name = f"base-{seq:06d}.npz"
+        terms = sorted(self.vocab, key=self.vocab.get)
+        atomic_write(os.path.join(path, name), lambda f: np.savez(
+            f, indptr=block.indptr, rows=block.rows, tfs=block.tfs, ids=self.ids,
+            doc_len=self.doc_len, terms=_pack_terms(terms)))
+        return {"format": FORMAT, "seq": seq, "base": name, "deltas": [],
+                "base_postings": len(block.rows), "delta_postings": 0,
+                "rows": len(self.ids), "terms": len(terms), "k1": self.k1, "b": self.b}
+
+    def _save_delta(self, path, on_disk, deltas, delta_postings):
+        saved_rows = len(self._saved_live)
+        was_live = np.concatenate([self._saved_live, np.ones(len(self.ids) - saved_rows, dtype=bool)])
+        dead = np.flatnonzero(was_live & ~self.live)
+        if not deltas and not len(dead) and len(self.vocab) == self._saved_terms:
+            return dict(on_disk)
+        seq = on_disk["seq"] + 1
+        name = f"delta-{seq:06d}.npz"
+        terms = sorted(self.vocab, key=self.vocab.get)[self._saved_terms:]
+
+        def concat(parts, dtype):
+            return np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+
+        atomic_write(os.path.join(path, name), lambda f: np.savez(
+            f, term_ids=concat([block.term_ids() for block in deltas], np.int64),
+            rows=concat([block.rows for block in deltas], np.int32),
+            tfs=concat([block.tfs for block in deltas], np.int32),
+            ids=self.ids[saved_rows:], doc_len=self.doc_len[saved_rows:],
+            terms=_pack_terms(terms), dead=dead))
+        return {**on_disk, "seq": seq, "deltas": on_disk["deltas"] + [name],
+                "delta_postings": on_disk["delta_postings"] + delta_postings,
+                "rows": len(self.ids), "terms": len(self.vocab)}
+
+    def _mark_saved(self, meta):
+        self._saved = meta
+        self._saved_blocks = len(self._blocks)
+        self._saved_terms = len(self.vocab)
+        self._saved_live = self.live.copy()
+
+    @classmethod
+    def load(cls, path, fingerprint=None, **kwargs):
+        """The saved index, or None if missing, unreadable or built for another fingerprint."""
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            return None
+        try:
+            with file_lock(os.path.join(path, LOCK_FILE), shared=True):
+                meta = _read_meta(path)
+                if meta.get("format") != FORMAT:
+                    return None
+                if fingerprint is not None and meta.get("fingerprint") != fingerprint:
+                    return None
+                index = cls(k1=meta["k1"], b=meta["b"], **kwargs)
+                index._load_files(path, meta)
+            if len(index.vocab) != meta["terms"] or len(index.ids) != meta["rows"]:
+                return None
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[BM25] Ignoring saved index in {path}: {e}")
+            return None
+        index._mark_saved(meta)
+        return index
+
+    def _load_files(self, path, meta):
+        data = np.load(os.path.join(path, meta["base"]))
+        terms = _unpack_terms(data["terms"])
+        self._blocks = [_Postings(data["indptr"], data["rows"], data["tfs"])]
+        ids, doc_len, dead = [data["ids"]], [data["doc_len"]], []
+        for name in meta["deltas"]:
+            data = np.load(os.path.join(path, name))
+            terms += _unpack_terms(data["terms"])
+            self._blocks.append(_Postings.build(data["term_ids"], data["rows"], data["tfs"], len(terms)))
+            ids.append(data["ids"])
+            doc_len.append(data["doc_len"])
+            dead.append(data["dead"])
+        self.vocab = {term: i for i, term in enumerate(terms)}
+        self.ids = np.concatenate(ids)
+        self.doc_len = np.concatenate(doc_len)
+        self.live = np.ones(len(self.ids), dtype=bool)
+        if dead:
+            self.live[np.concatenate(dead)] = False
+        self._df = sum(block.live_df(self.live, len(terms)) for block in self._blocks)
+
+
+def _read_meta(path):
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        return json.load(f)
@@ -0,0 +1,413 @@
+import bisect
+import hashlib
+import json
+import os
+import shutil
+from array import array
+import numpy as np
+from app.utils import atomic_write
+
+# One fixed-width row per chunk: stable chunk id, end offsets into the text /
+# meta blobs and the interned doc name id (-1 when the chunk has no doc_name).
+INDEX_DTYPE = np.dtype([("id", "<i8"), ("text_end", "<i8"), ("meta_end", "<i8"), ("doc", "<i4")])
+
+
+def chunk_digest(chunk_id, doc_name, text_bytes):
+    """128-bit hash of one chunk; doc_fingerprint() adds these up over live chunks."""
+    h = hashlib.sha256(f"{chunk_id}\0{doc_name}\0".encode("utf-8"))
+    h.update(text_bytes)
+    return int.from_bytes(h.digest()[:16], "little")
+
+
+def chunk_dir(generation):
+    return f"chunks-{generation:06d}"
+
+
+def docs_file(version):
+    # Doc names + content hashes, one file per write so the manifest that
+    # references it always pairs it with the matching chunk rows
+    return f"docs-{version:06d}.json"
+
+
+def _map(path, dtype, count):
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+
+
+class ChunkStore:
+    """
+    Columnar, append-only storage for chunk texts and metadata.
+
+    Texts live in one UTF-8 blob and any metadata besides doc_name in a second
+    blob of compact JSON, both addressed through a fixed-width offsets array.
+    Doc names are interned. Persisted rows are memory-mapped, so several
+    processes reading the same store share the page cache and no Python
+    object is created per chunk until it is looked up.
+
+    Every chunk gets a stable integer id (also used as the FAISS id). Deleting
+    records a tombstone; the rows are physically dropped by compact().
+    store[chunk_id] returns the {"id", "text", "meta"} dict the rest of the
+    code works with, built on access; iteration yields live chunks in
+    insertion order.
+    """
+
+    def __init__(self):
+        self._doc_names = []
+        self._doc_lookup = {}
+        self._content_hashes = {}
+        self.generation = 0
+        self.docs_version = 0
+        self._next_id = 0
+        # Committed rows (memory-mapped once opened from disk)
+        self._text_blob = np.zeros(0, dtype=np.uint8)
+        self._meta_blob = np.zeros(0, dtype=np.uint8)
+        self._index = np.zeros(0, dtype=INDEX_DTYPE)
+        # Rows appended since the store was opened or last written
+        self._tail_ids = array("q")
+        self._tail_text = bytearray()
+        self._tail_meta = bytearray()
+        self._tail_text_end = array("q")
+        self._tail_meta_end = array("q")
+        self._tail_doc = array("i")
+        # Deleted chunk ids, in deletion order; the first _committed_tombstones are on disk
+        self._tombstones = array("q")
+        self._committed_tombstones = 0
+        self._deleted = set()
+        # Sum of chunk_digest() over live chunks (mod 2**128); None until computed after open()
+        self._digest_sum = 0
+
+    # ------------------------------------------------------------------ #
+    # Opening / persisting
+    # ------------------------------------------------------------------ #
+    @classmethod
+    def open(cls, path, state):
+        """Map the committed rows described by a manifest `state` dict."""
+        store = cls()
+        count = state.get("chunk_count", 0)
+        generation = state["chunk_generation"]
+        base = os.path.join(path, chunk_dir(generation))
+        store.generation = generation
+        store.docs_version = state["docs_version"]
+        with open(os.path.join(base, docs_file(store.docs_version)), "r", encoding="utf-8") as f:
+            docs = json.load(f)
+        store._doc_names = docs["names"]
+        store._content_hashes = docs["content_hash"]
+        store._doc_lookup = {name: i for i, name in enumerate(store._doc_names)}
+        store._next_id = state.get("next_id", 0)
+        store._index = _map(os.path.join(base, "index.bin"), INDEX_DTYPE, count)
+        if count:
+            last = store._index[count - 1]
+            store._text_blob = _map(os.path.join(base, "text.bin"), np.uint8, int(last["text_end"]))
+            store._meta_blob = _map(os.path.join(base, "meta.bin"), np.uint8, int(last["meta_end"]))
+        n_tomb = state.get("tombstone_count", 0)
+        if n_tomb:
+            store._tombstones = array("q", np.fromfile(os.path.join(base, "tombstones.bin"),
+                                                       dtype="<i8", count=n_tomb).tolist())
+        store._committed_tombstones = n_tomb
+        store._deleted = set(store._tombstones)
+        store._digest_sum = None
+        return store
+
+    @classmethod
+    def from_records(cls, records):
+        """Build an unsaved store from {"text", "meta"[, "id"]} dicts."""
+        store = cls()
+        for rec in records:
+            store.append(rec.get("text", ""), rec.get("meta", {}), chunk_id=rec.get("id"))
+        return store
+
+    def state(self):
+        """Manifest fields describing this store once written."""
+        return {"chunk_count": self.num_rows, "chunk_generation": self.generation,
+                "docs_version": self.docs_version, "tombstone_count": len(self._tombstones),
+                "next_id": self._next_id}
+
+    def _write_docs(self, base):
+        # A new file each time: the committed one stays valid until the manifest moves on
+        self.docs_version += 1
+        docs = json.dumps({"names": self._doc_names, "content_hash": self._content_hashes},
+                          ensure_ascii=False).encode("utf-8")
+        atomic_write(os.path.join(base, docs_file(self.docs_version)), lambda f: f.write(docs))
+
+    def write(self, path):
+        """
+        Persist rows and tombstones added since open() to `path`, dropping
+        anything on disk past the last committed row (left over from an
+        interrupted write). The caller commits state() in its manifest; until
+        then readers ignore the new rows.
+        """
+        base = os.path.join(path, chunk_dir(self.generation))
+        os.makedirs(base, exist_ok=True)
+        self._write_docs(base)
+
+        committed = len(self._index)
+        text_base = int(self._index[-1]["text_end"]) if committed else 0
+        meta_base = int(self._index[-1]["meta_end"]) if committed else 0
+        rows = np.zeros(len(self._tail_ids), dtype=INDEX_DTYPE)
+        rows["id"] = np.array(self._tail_ids, dtype=np.int64)
+        rows["text_end"] = text_base + np.array(self._tail_text_end, dtype=np.int64)
+        rows["meta_end"] = meta_base + np.array(self._tail_meta_end, dtype=np.int64)
+        rows["doc"] = np.array(self._tail_doc, dtype=np.int32)
+        tombstones = np.array(self._tombstones[self._committed_tombstones:], dtype="<i8")
+
+        for name, offset, data in (("text.bin", text_base, self._tail_text),
+                                   ("meta.bin", meta_base, self._tail_meta),
+                                   ("index.bin", committed * INDEX_DTYPE.itemsize, rows.tobytes()),
+                                   ("tombstones.bin", self._committed_tombstones * 8, tombstones.tobytes())):
+            file_path = os.path.join(base, name)
+            with open(file_path, "r+b" if os.path.exists(file_path) else "w+b") as f:
+                f.truncate(offset)
+                f.seek(offset)
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+
+        # Re-map so the freshly written rows are served from disk as well
+        reopened = ChunkStore.open(path, self.state())
+        reopened._digest_sum = self._digest_sum
+        self.__dict__.update(reopened.__dict__)
+
+    def live_rows(self):
+        """Boolean mask over all rows (committed + unsaved) of non-deleted chunks."""
+        ids = self.row_ids()
+        if not self._deleted:
+            return np.ones(len(ids), dtype=bool)
+        return ~np.isin(ids, np.fromiter(self._deleted, dtype=np.int64))
+
+    def compact(self, path):
+        """
+        Rewrite the live rows into a new generation directory, dropping
+        deleted chunks. Ids are kept. The caller commits state() and then
+        removes the previous generation.
+        """
+        live = self.live_rows()
+        self.generation += 1
+        base = os.path.join(path, chunk_dir(self.generation))
+        if os.path.isdir(base):
+            shutil.rmtree(base)
+        os.makedirs(base)
+        self._write_docs(base)
+        rows = np.zeros(int(live.sum()), dtype=INDEX_DTYPE)
+        text_end = meta_end = 0
+        with open(os.path.join(base, "text.bin"), "wb") as text_f, \
+                open(os.path.join(base, "meta.bin"), "wb") as meta_f:
+            for k, row in enumerate(np.flatnonzero(live)):
+                t0, t1, tblob = self._bounds(row, "text")
+                m0, m1, mblob = self._bounds(row, "meta")
+                text_f.write(bytes(tblob[t0:t1]))
+                meta_f.write(bytes(mblob[m0:m1]))
+                text_end += t1 - t0
+                meta_end += m1 - m0
+                rows[k] = (self._row_id(row), text_end, meta_end, self._row_doc(row))
+            for f in (text_f, meta_f):
+                f.flush()
+                os.fsync(f.fileno())
+        atomic_write(os.path.join(base, "index.bin"), lambda f: f.write(rows.tobytes()))
+        atomic_write(os.path.join(base, "tombstones.bin"), lambda f: None)
+        state = {**self.state(), "chunk_count": len(rows), "tombstone_count": 0}
+        reopened = ChunkStore.open(path, state)
+        reopened._digest_sum = self._digest_sum
+        self.__dict__.update(reopened.__dict__)
+
+    # ------------------------------------------------------------------ #
+    # Row access
+    # ------------------------------------------------------------------ #
+    @property
+    def num_rows(self):
+        """Rows including deleted chunks that have not been compacted away yet."""
+        return len(self._index) + len(self._tail_ids)
+
+    def row_ids(self):
+        """Ids of every row, including deleted chunks not yet compacted away."""
+        return np.concatenate([np.asarray(self._index["id"], dtype=np.int64),
+                               np.array(self._tail_ids, dtype=np.int64)])
+
+    def _row_id(self, row):
+        committed = len(self._index)
+        return int(self._index[row]["id"]) if row < committed else self._tail_ids[row - committed]
+
+    def _row_doc(self, row):
+        committed = len(self._index)
+        return int(self._index[row]["doc"]) if row < committed else self._tail_doc[row - committed]
+
+    def _row_of(self, chunk_id):
+        """Row holding `chunk_id`, or None. Ids increase with the row number."""
+        if chunk_id in self._deleted:
+            return None
+        committed = len(self._index)
+        if committed and chunk_id <= int(self._index[-1]["id"]):
+            row = int(np.searchsorted(self._index["id"], chunk_id))
+            if row < committed and int(self._index[row]["id"]) == chunk_id:
+                return row
+            return None
+        j = bisect.bisect_left(self._tail_ids, chunk_id)
+        if j < len(self._tail_ids) and self._tail_ids[j] == chunk_id:
+            return committed + j
+        return None
+
+    def _bounds(self, row, column):
+        """(start, end, blob) of `row` within the text or meta column."""
+        committed = len(self._index)
+        end_field = "text_end" if column == "text" else "meta_end"
+        if row < committed:
+            start = int(self._index[row - 1][end_field]) if row else 0
+            blob = self._text_blob if column == "text" else self._meta_blob
+            return start, int(self._index[row][end_field]), blob
+        j = row - committed
+        ends = self._tail_text_end if column == "text" else self._tail_meta_end
+        blob = self._tail_text if column == "text" else self._tail_meta
+        return (ends[j - 1] if j else 0), ends[j], blob
+
+    def _row_text(self, row):
+        start, end, blob = self._bounds(row, "text")
+        return bytes(blob[start:end]).decode("utf-8")
+
+    def _row_digest(self, row):
+        start, end, blob = self._bounds(row, "text")
+        doc = self._row_doc(row)
+        return chunk_digest(self._row_id(row), self._doc_names[doc] if doc >= 0 else None, bytes(blob[start:end]))
+
+    def _row_meta(self, row):
+        start, end, blob = self._bounds(row, "meta")
+        meta = json.loads(bytes(blob[start:end])) if end > start else {}
+        doc = self._row_doc(row)
+        if doc >= 0:
+            meta = {"doc_name": self._doc_names[doc], **meta}
+        return meta
+
+    def _live_row_numbers(self):
+        if not self._deleted:
+            return range(self.num_rows)
+        return np.flatnonzero(self.live_rows()).tolist()
+
+    # ------------------------------------------------------------------ #
+    # Public lookup API (by chunk id)
+    # ------------------------------------------------------------------ #
+    def __len__(self):
+        return self.num_rows - len(self._deleted)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __contains__(self, chunk_id):
+        return self._row_of(int(chunk_id)) is not None
+
+    def __getitem__(self, chunk_id):
+        row = self._row_of(int(chunk_id))
+        if row is None:
+            raise KeyError(chunk_id)
+        return {"id": int(chunk_id), "text": self._row_text(row), "meta": self._row_meta(row)}
+
+    def get(self, chunk_id, default=None):
+        try:
+            return self[chunk_id]
+        except KeyError:
+            return default
+
+    def __iter__(self):
+        for row in self._live_row_numbers():
+            yield {"id": self._row_id(row), "text": self._row_text(row), "meta": self._row_meta(row)}
+
+    def text(self, chunk_id):
+        return self[chunk_id]["text"]
+
+    def iter_texts(self):
+        for row in self._live_row_numbers():
+            yield self._row_text(row)
+
+    def ids(self):
+        """Live chunk ids in insertion order (aligned with iter_texts())."""
+        ids = self.row_ids()
+        return ids[self.live_rows()] if self._deleted else ids
+
+    # ------------------------------------------------------------------ #
+    # Documents
+    # ------------------------------------------------------------------ #
+    def _doc_column(self):
+        return np.concatenate([np.asarray(self._index["doc"], dtype=np.int32),
+                               np.array(self._tail_doc, dtype=np.int32)])
+
+    def documents(self):
+        """Names of documents that still have live chunks."""
+        docs = self._doc_column()
+        if self._deleted:
+            docs = docs[self.live_rows()]
+        return [self._doc_names[d] for d in np.unique(docs) if d >= 0]
+
+    def doc_chunk_ids(self, doc_name):
+        doc = self._doc_lookup.get(doc_name)
+        if doc is None:
+            return np.zeros(0, dtype=np.int64)
+        mask = self._doc_column() == doc
+        if self._deleted:
+            mask &= self.live_rows()
+        return self.row_ids()[mask]
+
+    def content_hash(self, doc_name):
+        return self._content_hashes.get(doc_name)
+
+    def set_content_hash(self, doc_name, content_hash):
+        if content_hash is None:
+            self._content_hashes.pop(doc_name, None)
+        else:
+            self._content_hashes[doc_name] = content_hash
+
+    def doc_fingerprint(self):
+        """
+        Hash of the live (id, doc name, text) chunks and the document content
+        hashes. Independent of row layout, so compaction and write() keep it;
+        kept up to date by append() and delete() after a first full pass.
+        """
+        if self._digest_sum is None:
+            self._digest_sum = sum(self._row_digest(row) for row in self._live_row_numbers()) % 2**128
+        h = hashlib.sha256()
+        h.update(f"{len(self)}:{self._digest_sum:032x}".encode("utf-8"))
+        h.update(json.dumps(self._content_hashes, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        return h.hexdigest()
+
+    # ------------------------------------------------------------------ #
+    # Mutation
+    # ------------------------------------------------------------------ #
+    def _intern(self, name):
+        if name is None:
+            return -1
+        doc = self._doc_lookup.get(name)
+        if doc is None:
+            doc = len(self._doc_names)
+            self._doc_names.append(name)
+            self._doc_lookup[name] = doc
+        return doc
+
+    def append(self, text, meta=None, chunk_id=None):
+        """Add one chunk and return its id."""
+        if chunk_id is None:
+            chunk_id = self._next_id
+        elif self.num_rows and chunk_id <= self._row_id(self.num_rows - 1):
+            raise ValueError("chunk ids must be increasing")
+        self._next_id = max(self._next_id, chunk_id + 1)
+        meta = dict(meta or {})
+        doc = self._intern(meta.pop("doc_name", None))
+        self._tail_ids.append(chunk_id)
+        self._tail_text += text.encode("utf-8")
+        if meta:
+            self._tail_meta += json.dumps(meta, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self._tail_text_end.append(len(self._tail_text))
+        self._tail_meta_end.append(len(self._tail_meta))
+        self._tail_doc.append(doc)
+        if self._digest_sum is not None:
+            self._digest_sum = (self._digest_sum + self._row_digest(self.num_rows - 1)) % 2**128
+        return chunk_id
+
+    def extend(self, texts, metadata_list):
+        return [self.append(text, meta) for text, meta in zip(texts, metadata_list)]
+
+    def delete(self, chunk_ids):
+        for chunk_id in chunk_ids:
+            chunk_id = int(chunk_id)
+            row = self._row_of(chunk_id)
+            if row is not None:
+                if self._digest_sum is not None:
+                    self._digest_sum = (self._digest_sum - self._row_digest(row)) % 2**128
+                self._deleted.add(chunk_id)
+                self._tombstones.append(chunk_id)
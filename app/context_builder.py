@@ -0,0 +1,135 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def format_doc(doc):
+    if "meta" not in doc:
+        return doc["text"]
+    return f"[{doc['meta'].get('doc_name', 'unknown')}] {doc['text']}"
+
+
+def _overlap(left, right, max_overlap=200):
+    """Length of the longest suffix of `left` that is a prefix of `right`."""
+    for size in range(min(max_overlap, len(left), len(right)), 0, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+class ContextBuilder:
+    """
+    Pack retrieved chunks into the generator's input budget.
+
+    Token counts are computed once per chunk text (batched through the
+    tokenizer) and kept in an LRU. Chunks that are neighbours in the same
+    document and overlap (the chunker emits overlapping windows) are merged
+    first, by their char_start/char_end offsets when they have them; then
+    chunks are added greedily in rank order while they fit in what the
+    prompt template leaves of `max_tokens`. If not even the best
+    chunk fits, it is truncated to the budget rather than dropped.
+    """
+
+    def __init__(self, tokenizer, max_tokens=512, cache_size=50_000):
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.cache_size = cache_size
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count_tokens(self, texts):
+        keys = [hashlib.sha1(text.encode("utf-8")).digest() for text in texts]
+        counts = [None] * len(texts)
+        with self._lock:
+            for i, key in enumerate(keys):
+                count = self._counts.get(key)
+                if count is not None:
+                    self._counts.move_to_end(key)
+                    counts[i] = count
+        missing = [i for i, count in enumerate(counts) if count is None]
+        if missing:
+            encoded = self.tokenizer([texts[i] for i in missing], add_special_tokens=False)["input_ids"]
+            with self._lock:
+                for i, ids in zip(missing, encoded):
+                    counts[i] = len(ids)
+                    self._counts[keys[i]] = counts[i]
+                while len(self._counts) > self.cache_size:
+                    self._counts.popitem(last=False)
+        return counts
+
+    def merge_adjacent(self, docs):
+        """
+        Merge chunks that directly follow each other in the same document and
+        page (consecutive ids from the same source) and share an overlap.
+        A merged chunk takes the place of its best-ranked part.
+        """
+        merged, starts, ends = [], {}, {}
+        for doc in docs:
+            meta = doc.get("meta", {})
+            chunk_id = doc.get("id")
+            key = (doc.get("source"), meta.get("doc_name"), meta.get("page"))
+            if chunk_id is not None:
+                slot = ends.pop((key, chunk_id - 1), None)
+                if slot is not None:
+                    if self._join(merged[slot], doc, append=True):
+                        ends[(key, chunk_id)] = slot
+                        continue
+                    ends[(key, chunk_id - 1)] = slot
+                slot = starts.pop((key, chunk_id + 1), None)
+                if slot is not None:
+                    if self._join(merged[slot], doc, append=False):
+                        starts[(key, chunk_id)] = slot
+                        continue
+                    starts[(key, chunk_id + 1)] = slot
+                starts[(key, chunk_id)] = ends[(key, chunk_id)] = len(merged)
+            merged.append({**doc, "merged_ids": [chunk_id]})
+        return merged
+
+    @staticmethod
+    def _join(target, doc, append):
+        first, second = (target, doc) if append else (doc, target)
+        left, right = first["text"], second["text"]
+        a, b = first.get("meta", {}), second.get("meta", {})
+        if "char_end" in a and "char_start" in b:
+            # Both are slices of the same page text, so the offsets give the overlap exactly
+            size = a["char_end"] - b["char_start"]
+            if not 0 < size <= len(right):
+                return False
+            target["meta"] = {**target["meta"], "char_start": a["char_start"], "char_end": b["char_end"]}
+        else:
+            size = _overlap(left, right)
+            if not size:
+                return False
+        target["text"] = left + right[size:]
+        target["merged_ids"] = target["merged_ids"] + [doc["id"]] if append else [doc["id"]] + target["merged_ids"]
+        return True
+
+    def build(self, docs, prompt_fn, query):
+        """
+        Returns (context, stats). `prompt_fn(context, query)` renders the full
+        prompt; stats has tokens used, the budget, chunks used and dropped.
+        """
+        template_tokens = len(self.tokenizer(prompt_fn("", query))["input_ids"])
+        budget = self.max_tokens - template_tokens
+        pieces = self.merge_adjacent(docs)
+        formatted = [format_doc(doc) for doc in pieces]
+        counts = self.count_tokens(formatted)
+
+        used, chosen = 0, []
+        for text, count in zip(formatted, counts):
+            cost = count + (1 if chosen else 0)  # separator
+            if used + cost <= budget:
+                chosen.append(text)
+                used += cost
+
+        truncated = False
+        if not chosen and formatted and budget > 0:
+            ids = self.tokenizer(formatted[0], add_special_tokens=False)["input_ids"][:budget]
+            chosen = [self.tokenizer.decode(ids, skip_special_tokens=True)]
+            used = len(ids)
+            truncated = True
+
+        stats = {"tokens": used + template_tokens, "budget": self.max_tokens, "context_tokens": used,
+                 "chunks": len(chosen), "candidates": len(docs), "merged": len(docs) - len(pieces),
+                 "dropped": len(pieces) - len(chosen), "truncated": truncated}
+        return "\n\n".join(chosen), stats
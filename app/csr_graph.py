@@ -0,0 +1,196 @@
+"""
+Array-backed undirected graph for large knowledge graphs (GRAPH_BACKEND=csr).
+
+Entity names are interned to int ids after normalization (casefold, runs of
+whitespace collapsed), so "New  York" and "new york" are one node. Edges
+live in CSR arrays (indptr / indices plus per-edge chunk count and relation
+id), a few bytes per edge instead of networkx's dict-of-dicts. Updates to
+existing edges are applied in place; new edges wait in a small dict and
+removed ones stay as zero-count entries until the next query compacts the
+arrays. k-hop expansion is a vectorized BFS over the CSR rows.
+"""
+import numpy as np
+
+
+def normalize_entity(name):
+    return " ".join(name.split()).casefold()
+
+
+class CSRGraph:
+    def __init__(self):
+        self.ids = {}            # normalized name -> node id
+        self.keys = []           # node id -> normalized name
+        self.names = []          # node id -> first spelling seen
+        self.node_count = np.zeros(0, dtype=np.int64)
+        self.relation_ids = {}
+        self.relations = []
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int32)
+        self.edge_count = np.zeros(0, dtype=np.int32)
+        self.edge_relation = np.zeros(0, dtype=np.int32)
+        self._pending = {}       # (a, b), a < b -> [count, relation id] for edges not in the arrays
+        self._dirty = False      # the arrays hold edges whose count dropped to 0
+
+    # ------------------------------------------------------------------ #
+    # Interning
+    # ------------------------------------------------------------------ #
+    def node_id(self, name):
+        return self.ids.get(normalize_entity(name))
+
+    def _intern(self, name):
+        key = normalize_entity(name)
+        i = self.ids.get(key)
+        if i is None:
+            i = len(self.keys)
+            self.ids[key] = i
+            self.keys.append(key)
+            self.names.append(name)
+            if i >= len(self.node_count):
+                grown = np.zeros(max(16, 2 * len(self.node_count)), dtype=np.int64)
+                grown[:len(self.node_count)] = self.node_count
+                self.node_count = grown
+        return i
+
+    def _relation(self, relation):
+        r = self.relation_ids.get(relation)
+        if r is None:
+            r = self.relation_ids[relation] = len(self.relations)
+            self.relations.append(relation)
+        return r
+
+    # ------------------------------------------------------------------ #
+    # Updates
+    # ------------------------------------------------------------------ #
+    def bump_node(self, name, delta):
+        i = self._intern(name)  # may grow node_count, so intern before indexing
+        self.node_count[i] += delta
+
+    def _find(self, a, b):
+        """Position of edge a -> b in the arrays, or None."""
+        if a >= len(self.indptr) - 1:
+            return None
+        start, end = self.indptr[a], self.indptr[a + 1]
+        j = start + np.searchsorted(self.indices[start:end], b)
+        return int(j) if j < end and self.indices[j] == b else None
+
+    def bump_edge(self, u, v, relation, delta):
+        """Change the chunk count of edge u-v by `delta`; the edge goes away at 0."""
+        a, b = self._intern(u), self._intern(v)
+        if a == b:
+            return  # self-loops never change who is reachable
+        a, b = min(a, b), max(a, b)
+        forward = self._find(a, b)
+        if forward is not None:
+            backward = self._find(b, a)
+            self.edge_count[[forward, backward]] += delta
+            if delta > 0:
+                self.edge_relation[[forward, backward]] = self._relation(relation)
+            if self.edge_count[forward] <= 0:
+                self._dirty = True
+            return
+        entry = self._pending.setdefault((a, b), [0, 0])
+        entry[0] += delta
+        if delta > 0:
+            entry[1] = self._relation(relation)
+        if entry[0] <= 0:
+            del self._pending[(a, b)]
+
+    def compact(self):
+        """Fold pending edges into the arrays and drop zero-count edges."""
+        n = len(self.keys)
+        if not self._pending and not self._dirty and len(self.indptr) - 1 == n:
+            return
+        rows = len(self.indptr) - 1
+        src = np.repeat(np.arange(rows, dtype=np.int32), np.diff(self.indptr))
+        keep = (self.edge_count > 0) & (src < self.indices)
+        src, dst = src[keep], self.indices[keep]
+        count, relation = self.edge_count[keep], self.edge_relation[keep]
+        if self._pending:
+            pairs = np.array(list(self._pending), dtype=np.int32).reshape(-1, 2)
+            values = np.array(list(self._pending.values()), dtype=np.int32).reshape(-1, 2)
+            src = np.concatenate([src, pairs[:, 0]])
+            dst = np.concatenate([dst, pairs[:, 1]])
+            count = np.concatenate([count, values[:, 0]])
+            relation = np.concatenate([relation, values[:, 1]])
+        # Both directions, rows sorted by source then target
+        s, d = np.concatenate([src, dst]), np.concatenate([dst, src])
+        order = np.lexsort((d, s))
+        self.indices = d[order].astype(np.int32)
+        self.edge_count = np.concatenate([count, count])[order].astype(np.int32)
+        self.edge_relation = np.concatenate([relation, relation])[order].astype(np.int32)
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(s, minlength=n), out=self.indptr[1:])
+        self._pending = {}
+        self._dirty = False
+
+    # ------------------------------------------------------------------ #
+    # Queries
+    # ------------------------------------------------------------------ #
+    def __contains__(self, name):
+        i = self.node_id(name)
+        return i is not None and self.node_count[i] > 0
+
+    def __len__(self):
+        return int(np.count_nonzero(self.node_count[:len(self.keys)] > 0))
+
+    def number_of_edges(self):
+        self.compact()
+        return len(self.indices) // 2
+
+    def k_hop(self, seeds, depth):
+        """(node ids, hop counts) of every node within `depth` hops of the seed ids."""
+        self.compact()
+        frontier = np.unique(np.asarray(seeds, dtype=np.int32))
+        frontier = frontier[self.node_count[frontier] > 0]
+        dist = np.full(len(self.keys), -1, dtype=np.int32)
+        dist[frontier] = 0
+        found, hops = [frontier], [np.zeros(len(frontier), dtype=np.int32)]
+        for d in range(1, depth + 1):
+            starts = self.indptr[frontier]
+            lengths = self.indptr[frontier + 1] - starts
+            total = int(lengths.sum())
+            if total == 0:
+                break
+            # Concatenate the CSR rows of the whole frontier in one gather
+            offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+            neighbors = self.indices[offsets]
+            frontier = np.unique(neighbors[dist[neighbors] < 0])
+            if not len(frontier):
+                break
+            dist[frontier] = d
+            found.append(frontier)
+            hops.append(np.full(len(frontier), d, dtype=np.int32))
+        return np.concatenate(found), np.concatenate(hops)
+
+    def neighborhood(self, names, depth):
+        """{normalized name: hops} for everything within `depth` hops of `names`."""
+        seeds = [i for i in (self.node_id(name) for name in names) if i is not None]
+        if not seeds:
+            return {}
+        nodes, hops = self.k_hop(seeds, depth)
+        return {self.keys[i]: int(h) for i, h in zip(nodes.tolist(), hops.tolist())}
+
+    # ------------------------------------------------------------------ #
+    # Persistence
+    # ------------------------------------------------------------------ #
+    def to_data(self):
+        self.compact()
+        live = np.flatnonzero(self.node_count[:len(self.keys)] > 0)
+        src = np.repeat(np.arange(len(self.keys)), np.diff(self.indptr))
+        upper = np.flatnonzero(src < self.indices)
+        return {
+            "backend": "csr",
+            "nodes": [[self.names[i], int(self.node_count[i])] for i in live.tolist()],
+            "edges": [[self.names[src[j]], self.names[self.indices[j]],
+                       self.relations[self.edge_relation[j]], int(self.edge_count[j])] for j in upper.tolist()],
+        }
+
+    @classmethod
+    def from_data(cls, data):
+        graph = cls()
+        for name, count in data["nodes"]:
+            graph.bump_node(name, count)
+        for u, v, relation, count in data["edges"]:
+            graph.bump_edge(u, v, relation, count)
+        graph.compact()
+        return graph
@@ -0,0 +1,104 @@
+import hashlib
+import threading
+import time
+import unicodedata
+import numpy as np
+from app.utils import connect_sqlite
+
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed cache of chunk embeddings.
+
+    Keys are sha256(model name + normalized text); values are the normalized
+    vectors stored as float16 (default) or float32. The table is capped at
+    `max_entries`; least recently used rows are evicted in batches.
+    """
+
+    def __init__(self, path="data/embedding_cache.db", max_entries=500_000, dtype="float16"):
+        self.path = path
+        self.max_entries = max_entries
+        self.dtype = np.dtype(dtype)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key BLOB PRIMARY KEY, dtype TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+
+    @staticmethod
+    def key(model_name, text):
+        normalized = " ".join(unicodedata.normalize("NFC", text).split())
+        return hashlib.sha256(f"{model_name}\0{normalized}".encode("utf-8")).digest()
+
+    def get_many(self, model_name, texts):
+        """List aligned with `texts`: float32 vector, or None on a miss."""
+        keys = [self.key(model_name, t) for t in texts]
+        found = {}
+        with self._lock:
+            # Stay below SQLite's bound-parameter limit
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, dtype, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for key, dtype, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=dtype).astype(np.float32)
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                       [(now, k) for k in found])
+            hits = sum(1 for k in keys if k in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return [found.get(k) for k in keys]
+
+    def put_many(self, model_name, texts, vectors):
+        now = time.time()
+        rows = [(self.key(model_name, t), self.dtype.name, np.asarray(v, dtype=self.dtype).tobytes(), now)
+                for t, v in zip(texts, vectors)]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+                self._evict()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        # Evict down to 90% so we do not pay for an eviction on every insert
+        excess = count - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+        )
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0}
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(path="data/embedding_cache.db", **kwargs):
+    """One EmbeddingCache per path and process, shared by every VectorStore."""
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = EmbeddingCache(path, **kwargs)
+        return _caches[path]
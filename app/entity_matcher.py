@@ -0,0 +1,98 @@
+"""
+Multi-pattern entity matching (Aho–Corasick): find every known entity name
+in a text in one pass, whatever the number of names.
+
+Uses pyahocorasick when it is installed and a pure-Python automaton
+otherwise. Matching is case-insensitive and only whole words count, so
+"Ankara" matches "ankara's" but "Ana" does not match "Ankara".
+"""
+from collections import deque
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+MIN_LENGTH = 2
+
+
+def _is_boundary(text, i):
+    return i < 0 or i >= len(text) or not text[i].isalnum()
+
+
+class _Automaton:
+    """Plain Aho–Corasick: goto trie, failure links, merged outputs."""
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        for pattern, value in patterns.items():
+            state = 0
+            for ch in pattern:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                state = nxt
+            self.out[state].append((len(pattern), value))
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def iter(self, text):
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            for length, value in self.out[state]:
+                yield i, length, value
+
+
+class EntityMatcher:
+    def __init__(self, names=()):
+        patterns = {}
+        for name in names:
+            key = name.casefold().strip()
+            if len(key) >= MIN_LENGTH:
+                patterns.setdefault(key, name)
+        self.size = len(patterns)
+        if not patterns:
+            self._automaton = None
+        elif ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for key, name in patterns.items():
+                self._automaton.add_word(key, (len(key), name))
+            self._automaton.make_automaton()
+        else:
+            self._automaton = _Automaton(patterns)
+
+    def _iter(self, text):
+        if ahocorasick is not None:
+            for end, (length, name) in self._automaton.iter(text):
+                yield end, length, name
+        else:
+            yield from self._automaton.iter(text)
+
+    def find(self, text):
+        """The set of known names occurring in `text` as whole words."""
+        if self._automaton is None or not text:
+            return set()
+        folded = text.casefold()
+        found = set()
+        for end, length, name in self._iter(folded):
+            start = end - length + 1
+            if _is_boundary(folded, start - 1) and _is_boundary(folded, end + 1):
+                found.add(name)
+        return found
@@ -1,41 +1,99 @@
-import os, tempfile
+import hashlib, io, time
+from functools import lru_cache
+from itertools import islice
 from PyPDF2 import PdfReader
 import docx
-from app.utils import chunk_text, clean_text
+from app.utils import chunk_spans_batch, clean_text
 
-def process_file(uploaded_file, vectorstore, rag_pipeline=None, persist=True):
-    with tempfile.NamedTemporaryFile(delete=False) as tmp:
-        tmp.write(uploaded_file.read())
-        file_path = tmp.name
+# DOCX has no real pages; paragraphs are grouped into blocks of roughly this many characters
+DOCX_BLOCK_CHARS = 3000
+# Pages chunked (and tokenized) together
+CHUNK_BATCH_PAGES = 16
+# Chunks handed on together by iter_chunk_batches()
+CHUNK_BATCH_SIZE = 256
 
-    text = ""
-    if uploaded_file.name.lower().endswith(".pdf"):
-        reader = PdfReader(file_path)
-        for page in reader.pages:
+@lru_cache(maxsize=4)
+def chunk_tokenizer(model_name):
+    """Fast tokenizer used to size chunks in tokens; loaded once per (worker) process."""
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(model_name, use_fast=True)
+
+def hash_stream(stream, block_size=1 << 20):
+    """sha256 of a file-like object, read in blocks; rewinds it afterwards."""
+    h = hashlib.sha256()
+    stream.seek(0)
+    for block in iter(lambda: stream.read(block_size), b""):
+        h.update(block)
+    stream.seek(0)
+    return h.hexdigest()
+
+def iter_pages(filename, source):
+    """
+    Yield (page_number, text) from PDF/DOCX bytes or a file-like object,
+    one page at a time and without touching the filesystem.
+    """
+    stream = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+    if filename.lower().endswith(".pdf"):
+        reader = PdfReader(stream)
+        for number, page in enumerate(reader.pages, start=1):
             page_text = page.extract_text()
             if page_text:
-                text += page_text + "\n"
-    elif uploaded_file.name.lower().endswith(".docx"):
-        doc = docx.Document(file_path)
+                yield number, page_text
+    elif filename.lower().endswith(".docx"):
+        doc = docx.Document(stream)
+        block, size, number = [], 0, 1
         for para in doc.paragraphs:
-            if para.text.strip():
-                text += para.text + "\n"
+            if not para.text.strip():
+                continue
+            block.append(para.text)
+            size += len(para.text)
+            if size >= DOCX_BLOCK_CHARS:
+                yield number, "\n".join(block)
+                block, size, number = [], 0, number + 1
+        if block:
+            yield number, "\n".join(block)
     else:
-        os.remove(file_path)
         raise ValueError("Only PDF or DOCX supported")
 
-    os.remove(file_path)
-    text = clean_text(text)
-    if not text.strip():
-        return "⚠️ No text could be extracted"
-
-    chunks = chunk_text(text, chunk_size=500, overlap=50)
-    metadata_list = [{"doc_name": uploaded_file.name} for _ in chunks]
-    vectorstore.add_texts(chunks, metadata_list=metadata_list)
-
-    if persist and hasattr(vectorstore, "save"):
-        vectorstore.save()
-    if rag_pipeline is not None:
-        rag_pipeline.refresh_bm25()
+def iter_chunks(filename, source, chunk_size=500, overlap=50, stats=None, tokenizer_name=None):
+    """
+    Yield (chunk, metadata) a few pages at a time so only that much text is
+    held at once. Chunks never span pages; metadata records the page number
+    and char_start/char_end, the chunk's offsets in clean_text(page text).
+    With `tokenizer_name`, chunk_size and overlap count that tokenizer's tokens.
+    """
+    tokenizer = chunk_tokenizer(tokenizer_name) if tokenizer_name else None
+    pages = iter_pages(filename, source)
+    while True:
+        start = time.perf_counter()
+        batch = list(islice(pages, CHUNK_BATCH_PAGES))
+        if not batch:
+            return
+        extracted = time.perf_counter()
+        texts = [clean_text(page_text) for _, page_text in batch]
+        spans = chunk_spans_batch(texts, chunk_size, overlap, tokenizer)
+        if stats is not None:
+            stats["pages"] += len(batch)
+            stats["extract_seconds"] += extracted - start
+            stats["chunk_seconds"] += time.perf_counter() - extracted
+        for (number, _), text, page_spans in zip(batch, texts, spans):
+            for char_start, char_end in page_spans:
+                yield text[char_start:char_end], {"doc_name": filename, "page": number,
+                                                  "char_start": char_start, "char_end": char_end}
 
-    return f"✅ {uploaded_file.name} processed, {len(chunks)} chunks added"
+def iter_chunk_batches(filename, source, chunk_size=500, overlap=50, stats=None, tokenizer_name=None,
+                       batch_size=CHUNK_BATCH_SIZE):
+    """
+    iter_chunks() as (chunks, metadata) lists of up to `batch_size` chunks,
+    so a caller (or an ingest worker) never holds more than one batch of a
+    document. Free of model state so it can run in a worker process.
+    """
+    chunks, metadata = [], []
+    for chunk, meta in iter_chunks(filename, source, chunk_size, overlap, stats=stats, tokenizer_name=tokenizer_name):
+        chunks.append(chunk)
+        metadata.append(meta)
+        if len(chunks) >= batch_size:
+            yield chunks, metadata
+            chunks, metadata = [], []
+    if chunks:
+        yield chunks, metadata
@@ -0,0 +1,69 @@
+import threading
+import time
+from app.metrics import count
+
+
+def generation_kwargs(max_new_tokens, temperature=0.0, do_sample=False):
+    kwargs = {"max_new_tokens": max_new_tokens, "do_sample": do_sample}
+    if do_sample and temperature > 0:
+        kwargs["temperature"] = temperature
+    return kwargs
+
+
+def stream_generate(generator, prompt, max_new_tokens=200, temperature=0.0, do_sample=False, stats=None):
+    """
+    Yield decoded text pieces as the model produces them.
+
+    `generator` is a transformers text2text pipeline; generate() runs in a
+    background thread and feeds a TextIteratorStreamer. If `stats` is a
+    dict it receives ttft_s (time to first token), tokens, tokens_per_s and
+    total_s once the stream is exhausted.
+    """
+    from transformers import TextIteratorStreamer
+
+    class CountingStreamer(TextIteratorStreamer):
+        tokens = 0
+
+        def put(self, value):
+            # The first put is the decoder start token, not generated output
+            if not self.next_tokens_are_prompt:
+                self.tokens += value.numel()
+            super().put(value)
+
+    tokenizer, model = generator.tokenizer, generator.model
+    inputs = tokenizer(prompt, return_tensors="pt", truncation=True).to(model.device)
+    streamer = CountingStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    errors = []
+
+    def run():
+        try:
+            model.generate(**inputs, streamer=streamer,
+                           **generation_kwargs(max_new_tokens, temperature, do_sample))
+        except Exception as e:
+            errors.append(e)
+            streamer.end()
+
+    start = time.perf_counter()
+    first = None
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    for piece in streamer:
+        if not piece:
+            continue
+        if first is None:
+            first = time.perf_counter()
+        yield piece
+    thread.join()
+    if errors:
+        raise errors[0]
+
+    total = time.perf_counter() - start
+    count("rag_generated_tokens_total", streamer.tokens)
+    if stats is not None:
+        decode = total - (first - start) if first else 0.0
+        stats.update({
+            "ttft_s": (first - start) if first else total,
+            "tokens": streamer.tokens,
+            "tokens_per_s": streamer.tokens / decode if decode > 0 else 0.0,
+            "total_s": total,
+        })
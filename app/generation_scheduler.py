@@ -0,0 +1,248 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from app.generation import generation_kwargs
+from app.metrics import count
+from app.model_registry import acquire_generator, default_device, GENERATOR_MODEL
+
+_DONE = object()
+
+
+class _Request:
+    def __init__(self, prompt, max_new_tokens, temperature, do_sample, stream):
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.sampling = (do_sample, temperature if do_sample else 0.0)
+        self.future = Future()
+        self.queue = queue.Queue() if stream else None
+        self.tokens = []
+        self.printed = 0
+        self.done = False
+        self.submitted = time.perf_counter()
+        self.first_token = None
+        self.finished = None
+        self.batch_size = 0
+
+    def add_token(self, token, tokenizer):
+        if self.done:
+            return
+        if token == tokenizer.eos_token_id:
+            self.finish(tokenizer)
+            return
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+        self.tokens.append(token)
+        if self.queue is not None:
+            # Like TextStreamer: only emit up to the last space so words are not split
+            text = tokenizer.decode(self.tokens, skip_special_tokens=True)
+            end = len(text) if text.endswith("\n") else text.rfind(" ") + 1
+            if end > self.printed:
+                self.queue.put(text[self.printed:end])
+                self.printed = end
+        if len(self.tokens) >= self.max_new_tokens:
+            self.finish(tokenizer)
+
+    def finish(self, tokenizer):
+        if self.done:
+            return
+        self.done = True
+        self.finished = time.perf_counter()
+        count("rag_generated_tokens_total", len(self.tokens))
+        text = tokenizer.decode(self.tokens, skip_special_tokens=True)
+        if self.queue is not None:
+            if len(text) > self.printed:
+                self.queue.put(text[self.printed:])
+            self.queue.put(_DONE)
+        self.future.set_result(text.strip())
+
+    def fail(self, error):
+        if self.done:
+            return
+        self.done = True
+        self.finished = time.perf_counter()
+        if self.queue is not None:
+            self.queue.put(error)
+        self.future.set_exception(error)
+
+    def stats(self):
+        first = self.first_token or self.finished
+        decode = self.finished - first if first else 0.0
+        return {"ttft_s": first - self.submitted if first else 0.0, "tokens": len(self.tokens),
+                "tokens_per_s": len(self.tokens) / decode if decode > 0 else 0.0,
+                "total_s": self.finished - self.submitted, "batch_size": self.batch_size}
+
+
+class GenerationScheduler:
+    """
+    One generation worker per process, shared by every Streamlit session.
+
+    Prompts are queued; the worker takes the first waiting request, keeps
+    collecting for up to `max_wait_ms` (or until `max_batch_size`), and runs
+    the batch through a single model.generate call. Requests with different
+    sampling settings run in separate batches; different max_new_tokens are
+    fine, each request stops at its own limit.
+
+    generate() blocks for the text; submit() returns a Future; stream()
+    yields text as it is produced.
+    """
+
+    def __init__(self, model_name=GENERATOR_MODEL, device=None, max_batch_size=8, max_wait_ms=20):
+        self.model_name = model_name
+        self._device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._generator = None
+        self._load_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.largest_batch = 0
+
+    @property
+    def device(self):
+        if self._device is None:
+            self._device = default_device()
+        return self._device
+
+    @property
+    def generator(self):
+        # Loaded on first use and held for the life of the process
+        with self._load_lock:
+            if self._generator is None:
+                self._generator = acquire_generator(self.model_name, self.device)
+            return self._generator
+
+    def _ensure_worker(self):
+        with self._start_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._loop, name="generation-scheduler", daemon=True)
+                self._worker.start()
+
+    def _submit(self, prompt, max_new_tokens, temperature, do_sample, stream):
+        request = _Request(prompt, max_new_tokens, temperature, do_sample, stream)
+        self._ensure_worker()
+        self._queue.put(request)
+        return request
+
+    def submit(self, prompt, max_new_tokens=200, temperature=0.0, do_sample=False):
+        return self._submit(prompt, max_new_tokens, temperature, do_sample, stream=False).future
+
+    def generate(self, prompt, max_new_tokens=200, temperature=0.0, do_sample=False):
+        return self.submit(prompt, max_new_tokens, temperature, do_sample).result()
+
+    def stream(self, prompt, max_new_tokens=200, temperature=0.0, do_sample=False, stats=None):
+        """
+        Queue the prompt now and return an iterator over text pieces. `stats`
+        (a dict) gets ttft_s, tokens, tokens_per_s, total_s and batch_size.
+        """
+        request = self._submit(prompt, max_new_tokens, temperature, do_sample, stream=True)
+
+        def pieces():
+            try:
+                while True:
+                    item = request.queue.get()
+                    if item is _DONE:
+                        break
+                    if isinstance(item, BaseException):
+                        raise item
+                    yield item
+            finally:
+                # Failed requests report their timings too; one abandoned mid-stream has none yet
+                if stats is not None and request.done:
+                    stats.update(request.stats())
+
+        return pieces()
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            groups = {}
+            for request in batch:
+                groups.setdefault(request.sampling, []).append(request)
+            for (do_sample, temperature), group in groups.items():
+                self._run(group, do_sample, temperature)
+
+    def _run(self, group, do_sample, temperature):
+        self.requests += len(group)
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, len(group))
+        for request in group:
+            request.batch_size = len(group)
+        try:
+            # The model loads here on first use; a failed load must fail the batch, not the worker
+            self._generate(group, do_sample, temperature)
+        except Exception as e:
+            print(f"[Scheduler] Batch of {len(group)} failed: {e}")
+            for request in group:
+                request.fail(e)
+
+    def _generate(self, group, do_sample, temperature):
+        import torch
+        from transformers import StoppingCriteria, StoppingCriteriaList
+        from transformers.generation.streamers import BaseStreamer
+
+        tokenizer, model = self.generator.tokenizer, self.generator.model
+
+        class BatchStreamer(BaseStreamer):
+            """Routes each generated token to its request; the first put is the decoder start."""
+            started = False
+
+            def put(self, value):
+                if not self.started:
+                    self.started = True
+                    return
+                for request, token in zip(group, value.reshape(-1).tolist()):
+                    request.add_token(token, tokenizer)
+
+            def end(self):
+                for request in group:
+                    request.finish(tokenizer)
+
+        class AllFinished(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                done = all(request.done for request in group)
+                return torch.full((input_ids.shape[0],), done, dtype=torch.bool, device=input_ids.device)
+
+        inputs = tokenizer([r.prompt for r in group], return_tensors="pt", padding=True,
+                           truncation=True).to(model.device)
+        kwargs = generation_kwargs(max(r.max_new_tokens for r in group), temperature, do_sample)
+        with torch.no_grad():
+            model.generate(**inputs, streamer=BatchStreamer(),
+                           stopping_criteria=StoppingCriteriaList([AllFinished()]), **kwargs)
+
+    def stats(self):
+        return {"requests": self.requests, "batches": self.batches,
+                "avg_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+                "largest_batch": self.largest_batch, "queued": self._queue.qsize()}
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_generation_scheduler(model_name=GENERATOR_MODEL, device=None, **kwargs):
+    """
+    The process-wide scheduler for a model and device (default: mps if
+    available, else cpu). Nothing is loaded until the first prompt. Batch
+    settings default to GEN_MAX_BATCH / GEN_MAX_WAIT_MS.
+    """
+    with _schedulers_lock:
+        key = (model_name, device)
+        if key not in _schedulers:
+            kwargs.setdefault("max_batch_size", int(os.getenv("GEN_MAX_BATCH", "8")))
+            kwargs.setdefault("max_wait_ms", float(os.getenv("GEN_MAX_WAIT_MS", "20")))
+            _schedulers[key] = GenerationScheduler(model_name, device, **kwargs)
+        return _schedulers[key]
@@ -1,18 +1,95 @@
-import spacy
+import heapq
+import json
+import os
+import threading
+import zlib
+from collections import Counter, OrderedDict, defaultdict
 import networkx as nx
+from app.csr_graph import CSRGraph, normalize_entity
+from app.entity_matcher import EntityMatcher
+from app.utils import atomic_write
+
+GRAPH_DIR = "data/graph"
+FORMAT = 2
+GRAPH_BACKENDS = ("networkx", "csr")
+# Components extract_entities_relations reads (ents, dep_, pos_, lemma_); anything else is disabled
+USED_PIPES = ("tok2vec", "tagger", "morphologizer", "parser", "attribute_ruler", "lemmatizer", "ner")
+
+
+def text_hash(text):
+    return format(zlib.crc32(text.encode("utf-8")), "08x")
+
 
 class GraphBuilder:
-    def __init__(self, model_name="en_core_web_sm"):
-        try:
-            self.nlp = spacy.load(model_name)
-        except:
-            import os
-            os.system(f"python -m spacy download {model_name}")
-            self.nlp = spacy.load(model_name)
-        self.graph = nx.Graph()
+    """
+    Entity/relation graph over the chunks of the vector stores.
 
-    def extract_entities_relations(self, text):
-        doc = self.nlp(text)
+    Chunks are keyed "<store>:<chunk id>" (e.g. "user:12"); `chunk_entities`
+    maps each key to the entities and relations spaCy found in it, and node /
+    edge counts record how many chunks contribute them, so chunks can be
+    added and removed without re-parsing the rest. Parsing goes through
+    nlp.pipe in batches (optionally with several processes). The graph and
+    the mapping are saved under `path` and shared by every session.
+
+    `postings` is the inverted entity -> chunk keys index used at query
+    time. Besides the entities spaCy tagged in a chunk, new chunks are
+    linked (Aho–Corasick, see app/entity_matcher.py) to every already known
+    entity they mention, which NER often misses. Postings are keyed by the
+    normalized entity name (see normalize_entity). `version` changes with
+    every update and keys the neighbourhood cache.
+
+    backend="csr" keeps the graph in a CSRGraph (app/csr_graph.py) instead
+    of networkx: interned, normalized node ids and array-backed adjacency,
+    for graphs too large for networkx's memory overhead.
+    """
+
+    def __init__(self, model_name="en_core_web_sm", path=GRAPH_DIR, batch_size=64, n_process=1,
+                 backend="networkx", neighborhood_cache_size=1024):
+        if backend not in GRAPH_BACKENDS:
+            raise ValueError(f"Graph backend must be one of {GRAPH_BACKENDS}, got '{backend}'")
+        self.model_name = model_name
+        self._nlp = None
+        self._nlp_lock = threading.Lock()
+        self.path = path
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.backend = backend
+        self.graph = self._new_graph()
+        self.chunk_entities = {}
+        self.postings = {}
+        self.version = 0
+        self._matcher = None
+        self._matcher_version = -1
+        self._spellings = {}
+        self._spellings_version = -1
+        self._hops_cache = OrderedDict()
+        self._hops_cache_size = neighborhood_cache_size
+        self._hops_version = -1
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.lock = threading.RLock()
+        self._save_lock = threading.Lock()
+        if path:
+            self.load()
+
+    @property
+    def nlp(self):
+        """The spaCy pipeline, loaded on first use rather than when the saved graph is loaded."""
+        with self._nlp_lock:
+            if self._nlp is None:
+                import spacy
+                try:
+                    nlp = spacy.load(self.model_name)
+                except OSError as e:
+                    raise OSError(f"spaCy model '{self.model_name}' is not installed; "
+                                  f"run `python -m spacy download {self.model_name}`") from e
+                for name in nlp.pipe_names:
+                    if name not in USED_PIPES:
+                        nlp.disable_pipe(name)
+                self._nlp = nlp
+            return self._nlp
+
+    def _extract(self, doc):
         entities = [ent.text for ent in doc.ents]
         relations = []
         for token in doc:
@@ -24,18 +101,313 @@ class GraphBuilder:
                     relations.append((subj, rel, obj))
         return entities, relations
 
+    def extract_entities_relations(self, text):
+        return self._extract(self.nlp(text))
+
+    def extract_entities(self, text):
+        """Entities only; skips the parser, which NER does not need."""
+        skip = [name for name in ("parser", "lemmatizer") if name in self.nlp.pipe_names]
+        return [ent.text for ent in self.nlp(text, disable=skip).ents]
+
+    # ------------------------------------------------------------------ #
+    # Incremental updates
+    # ------------------------------------------------------------------ #
+    def _new_graph(self):
+        return CSRGraph() if self.backend == "csr" else nx.Graph()
+
+    def _bump_node(self, node, delta):
+        if self.backend == "csr":
+            self.graph.bump_node(node, delta)
+        elif node in self.graph:
+            self.graph.nodes[node]["count"] += delta
+            if self.graph.nodes[node]["count"] <= 0:
+                self.graph.remove_node(node)
+        elif delta > 0:
+            self.graph.add_node(node, count=delta)
+
+    def _bump_edge(self, subj, obj, rel, delta):
+        if self.backend == "csr":
+            self.graph.bump_edge(subj, obj, rel, delta)
+        elif self.graph.has_edge(subj, obj):
+            edge = self.graph[subj][obj]
+            edge["count"] += delta
+            if delta > 0:
+                edge["relation"] = rel
+            if edge["count"] <= 0:
+                self.graph.remove_edge(subj, obj)
+        elif delta > 0:
+            self.graph.add_edge(subj, obj, relation=rel, count=delta)
+
+    @staticmethod
+    def _entry_nodes(entry):
+        nodes = Counter(entry["entities"])
+        for subj, rel, obj in entry["relations"]:
+            nodes.update((subj, obj))
+        return nodes
+
+    @staticmethod
+    def _entry_names(entry):
+        return {normalize_entity(e) for e in entry["entities"]} | set(entry.get("mentions", ()))
+
+    def _add_entry(self, key, entry):
+        self.chunk_entities[key] = entry
+        for node, count in self._entry_nodes(entry).items():
+            self._bump_node(node, count)
+        for subj, rel, obj in entry["relations"]:
+            self._bump_edge(subj, obj, rel, 1)
+        for name in self._entry_names(entry):
+            self.postings.setdefault(name, set()).add(key)
+        self.version += 1
+
+    def _remove_entry(self, key):
+        entry = self.chunk_entities.pop(key, None)
+        if entry is None:
+            return
+        for subj, rel, obj in entry["relations"]:
+            self._bump_edge(subj, obj, rel, -1)
+        for node, count in self._entry_nodes(entry).items():
+            self._bump_node(node, -count)
+        for name in self._entry_names(entry):
+            keys = self.postings.get(name)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.postings[name]
+        self.version += 1
+
+    def add_chunks(self, items):
+        """Parse (key, text) pairs with nlp.pipe and add them to the graph. Returns the count."""
+        added = 0
+        pairs = ((text, key) for key, text in items)
+        for doc, key in self.nlp.pipe(pairs, as_tuples=True, batch_size=self.batch_size,
+                                      n_process=self.n_process):
+            entities, relations = self._extract(doc)
+            with self.lock:
+                self._remove_entry(key)
+                self._add_entry(key, {"h": text_hash(doc.text), "entities": entities,
+                                      "relations": [list(r) for r in relations]})
+            added += 1
+        return added
+
+    def matcher(self):
+        """Aho–Corasick matcher over every known entity, rebuilt when the graph changed."""
+        with self.lock:
+            if self._matcher_version != self.version:
+                self._matcher = EntityMatcher(list(self.postings))
+                self._matcher_version = self.version
+            return self._matcher
+
+    def link_chunks(self, items):
+        """Add the known entities each (key, text) mentions to its postings."""
+        matcher = self.matcher()
+        with self.lock:
+            for key, text in items:
+                entry = self.chunk_entities.get(key)
+                if entry is None:
+                    continue
+                own = self._entry_names(entry)
+                mentions = sorted(matcher.find(text) - own)
+                if mentions:
+                    self.chunk_entities[key] = dict(entry, mentions=mentions)
+                    for name in mentions:
+                        self.postings.setdefault(name, set()).add(key)
+                    self.version += 1
+
+    def remove_chunks(self, keys):
+        with self.lock:
+            for key in keys:
+                self._remove_entry(key)
+
+    def sync(self, name, chunk_store, verify=False):
+        """
+        Bring the chunks of one store (keys "<name>:<id>") in line with
+        `chunk_store`: drop chunks that are gone, parse the new ones. With
+        `verify`, chunks that kept their id but changed text (e.g. after the
+        store was recreated) are re-parsed too. Returns (added, removed).
+        """
+        prefix = f"{name}:"
+        live = {int(i) for i in chunk_store.ids()} if chunk_store else set()
+        with self.lock:
+            known = {int(key[len(prefix):]) for key in self.chunk_entities if key.startswith(prefix)}
+            stale = known - live
+            if verify:
+                stale |= {i for i in known & live
+                          if self.chunk_entities[f"{prefix}{i}"]["h"] != text_hash(chunk_store.text(i))}
+            self.remove_chunks(f"{prefix}{i}" for i in stale)
+        new = sorted((live - known) | (stale & live))
+        added = self.add_chunks((f"{prefix}{i}", chunk_store.text(i)) for i in new)
+        if added:
+            # Second pass so new chunks also link to entities first seen in this batch
+            self.link_chunks((f"{prefix}{i}", chunk_store.text(i)) for i in new)
+        return added, len(stale)
+
     def build_graph(self, documents):
-        for doc in documents:
-            text = doc.get("text", "")
-            entities, relations = self.extract_entities_relations(text)
-            for ent in entities:
-                self.graph.add_node(ent)
-            for subj, rel, obj in relations:
-                self.graph.add_edge(subj, obj, relation=rel)
+        """Rebuild from scratch from an iterable of {"id"?, "text"} dicts."""
+        with self.lock:
+            self.graph = self._new_graph()
+            self.chunk_entities = {}
+            self.postings = {}
+            self.version += 1
+        items = [(str(doc.get("id", i)), doc.get("text", "")) for i, doc in enumerate(documents)]
+        self.add_chunks(items)
+        self.link_chunks(items)
         return self.graph
 
+    # ------------------------------------------------------------------ #
+    # Persistence
+    # ------------------------------------------------------------------ #
+    def save(self):
+        """graph.json and chunks.json first, meta.json last (it validates the other two)."""
+        if not self.path:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        with self.lock:
+            graph = self.graph.to_data() if self.backend == "csr" else nx.node_link_data(self.graph)
+            chunks = dict(self.chunk_entities)
+        # networkx >= 3.4 names the edge list "edges", older versions "links"
+        edges = graph.get("edges", graph.get("links", []))
+        meta = {"format": FORMAT, "backend": self.backend, "chunks": len(chunks),
+                "nodes": len(graph["nodes"]), "edges": len(edges)}
+        with self._save_lock:
+            atomic_write(os.path.join(self.path, "graph.json"),
+                         lambda f: json.dump(graph, f, ensure_ascii=False), mode="w")
+            atomic_write(os.path.join(self.path, "chunks.json"),
+                         lambda f: json.dump(chunks, f, ensure_ascii=False), mode="w")
+            atomic_write(os.path.join(self.path, "meta.json"), lambda f: json.dump(meta, f), mode="w")
+        print(f"[GraphBuilder] Saved graph ({meta['nodes']} nodes, {meta['chunks']} chunks) to {self.path}")
+
+    def load(self):
+        """
+        Load the saved graph; False if missing or inconsistent (a save was
+        interrupted). A graph saved by the other backend is rebuilt from the
+        chunk map, without re-parsing.
+        """
+        meta_path = os.path.join(self.path, "meta.json")
+        if not os.path.exists(meta_path):
+            return False
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get("format") != FORMAT:
+                return False
+            with open(os.path.join(self.path, "graph.json"), encoding="utf-8") as f:
+                data = json.load(f)
+            with open(os.path.join(self.path, "chunks.json"), encoding="utf-8") as f:
+                chunks = json.load(f)
+            edges = data.get("edges", data.get("links", []))
+            if (len(chunks), len(data["nodes"]), len(edges)) != (meta["chunks"], meta["nodes"], meta["edges"]):
+                print(f"[GraphBuilder] Ignoring saved graph in {self.path}: files do not match")
+                return False
+            graph = None
+            if meta.get("backend", "networkx") == self.backend:
+                graph = CSRGraph.from_data(data) if self.backend == "csr" else nx.node_link_graph(data)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[GraphBuilder] Ignoring saved graph in {self.path}: {e}")
+            return False
+        with self.lock:
+            self.graph = self._new_graph()
+            self.chunk_entities = {}
+            self.postings = {}
+            if graph is None:
+                for key, entry in chunks.items():
+                    self._add_entry(key, entry)
+            else:
+                self.graph = graph
+                self.chunk_entities = chunks
+                for key, entry in chunks.items():
+                    for name in self._entry_names(entry):
+                        self.postings.setdefault(name, set()).add(key)
+            self.version += 1
+        print(f"[GraphBuilder] Loaded graph ({len(self.graph)} nodes, {len(chunks)} chunks) from {self.path}")
+        return True
+
+    def _node_spellings(self):
+        """normalized name -> networkx node, so normalized query entities find their node."""
+        if self._spellings_version != self.version:
+            self._spellings = {normalize_entity(node): node for node in self.graph}
+            self._spellings_version = self.version
+        return self._spellings
+
+    def _neighborhood(self, entities, depth):
+        """{normalized entity: hops} within `depth` hops of `entities`, cached per graph version."""
+        if self._hops_version != self.version:
+            self._hops_cache.clear()
+            self._hops_version = self.version
+        key = (frozenset(entities), depth)
+        hops = self._hops_cache.get(key)
+        if hops is not None:
+            self._hops_cache.move_to_end(key)
+            self.cache_hits += 1
+            return hops
+        self.cache_misses += 1
+        if self.backend == "csr":
+            hops = self.graph.neighborhood(entities, depth)
+        else:
+            hops = {}
+            for entity in entities:
+                if entity not in self.graph:
+                    entity = self._node_spellings().get(normalize_entity(entity))
+                    if entity is None:
+                        continue
+                for node, d in nx.single_source_shortest_path_length(self.graph, entity, cutoff=depth).items():
+                    node = normalize_entity(node)
+                    if d < hops.get(node, depth + 1):
+                        hops[node] = d
+        self._hops_cache[key] = hops
+        if len(self._hops_cache) > self._hops_cache_size:
+            self._hops_cache.popitem(last=False)
+        return hops
+
     def query_related_entities(self, entity, depth=1):
-        if entity not in self.graph:
-            return []
-        neighbors = list(nx.single_source_shortest_path_length(self.graph, entity, cutoff=depth).keys())
+        with self.lock:
+            if self.backend == "csr":
+                return list(self._neighborhood([entity], depth))
+            if entity not in self.graph:
+                return []
+            neighbors = list(nx.single_source_shortest_path_length(self.graph, entity, cutoff=depth).keys())
         return neighbors
+
+    def link_query(self, text):
+        """Known entities in a query: spaCy's entities plus every graph entity it mentions."""
+        return set(self.extract_entities(text)) | self.matcher().find(text)
+
+    def rank_chunks(self, entities, depth=2, top_k=3, prefixes=None):
+        """
+        Chunk keys ranked by the entities they share with the query's
+        neighbourhood: each entity within `depth` hops adds 1 / (1 + hops),
+        so direct mentions outweigh related ones. Returns [(key, score)].
+        """
+        with self.lock:
+            distance = dict(self._neighborhood(entities, depth))
+            for entity in entities:
+                # Entities that only occur as mentions have no node in the graph
+                distance.setdefault(normalize_entity(entity), 0)
+            scores = defaultdict(float)
+            for node, d in distance.items():
+                for key in self.postings.get(node, ()):
+                    scores[key] += 1.0 / (1 + d)
+        if prefixes is not None:
+            prefixes = tuple(f"{p}:" for p in prefixes)
+            scores = {key: score for key, score in scores.items() if key.startswith(prefixes)}
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+    def cache_stats(self):
+        lookups = self.cache_hits + self.cache_misses
+        return {"hits": self.cache_hits, "misses": self.cache_misses,
+                "hit_rate": self.cache_hits / lookups if lookups else 0.0, "entries": len(self._hops_cache)}
+
+
+_builder = None
+_builder_lock = threading.Lock()
+
+
+def get_graph_builder(**kwargs):
+    """The process-wide GraphBuilder (spaCy model and graph shared by every session)."""
+    global _builder
+    with _builder_lock:
+        if _builder is None:
+            kwargs.setdefault("batch_size", int(os.getenv("GRAPH_BATCH_SIZE", "64")))
+            kwargs.setdefault("n_process", int(os.getenv("GRAPH_N_PROCESS", "1")))
+            kwargs.setdefault("backend", os.getenv("GRAPH_BACKEND", "networkx"))
+            _builder = GraphBuilder(**kwargs)
+        return _builder
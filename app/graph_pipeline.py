@@ -1,40 +1,96 @@
-from app.graph_builder import GraphBuilder
+import time
+from app.graph_builder import get_graph_builder
+from app.metrics import span, count
 
 class GraphRAGPipeline:
-    def __init__(self, rag_pipeline):
+    def __init__(self, rag_pipeline, graph_builder=None):
         self.rag_pipeline = rag_pipeline
-        self.graph_builder = GraphBuilder()
-        self.graph = None
+        # Shared by every session; a graph saved by an earlier run is loaded here
+        self.graph_builder = graph_builder or get_graph_builder()
+        self._sources = {}  # which store each "<name>:" key prefix was last synced with
+        self.graph = self.graph_builder.graph if self.graph_builder.chunk_entities else None
+        self.last_timings = {}
+        self.last_entities = []
+        self.last_trace = None
 
     def build_knowledge_graph(self):
-        print("[GraphRAG] Building knowledge graph...")
-        all_docs = []
-        if self.rag_pipeline.user_vectorstore:
-            all_docs.extend(self.rag_pipeline.user_vectorstore.texts)
-        if self.rag_pipeline.db_vectorstore:
-            all_docs.extend(self.rag_pipeline.db_vectorstore.texts)
-        self.graph = self.graph_builder.build_graph(all_docs)
-        print(f"[GraphRAG] Graph built with {len(self.graph.nodes())} nodes.")
+        """Parse only the chunks added since the last build; drop chunks that were removed."""
+        print("[GraphRAG] Updating knowledge graph...")
+        start = time.perf_counter()
+        added = removed = 0
+        with span("graph_build") as trace:
+            for name, store in (("user", self.rag_pipeline.user_vectorstore), ("db", self.rag_pipeline.db_vectorstore)):
+                # A store we have not synced with in this session may reuse ids for different text
+                verify = self._sources.get(name) is not store
+                with span("extract", source=name) as s:
+                    a, r = self.graph_builder.sync(name, store.texts if store else None, verify=verify)
+                    s.attrs.update(added=a, removed=r)
+                self._sources[name] = store
+                added, removed = added + a, removed + r
+            if added or removed or self.graph is None:
+                with span("persist"):
+                    self.graph_builder.save()
+            trace.attrs.update(added=added, removed=removed)
+        self.graph = self.graph_builder.graph
+        print(f"[GraphRAG] Graph has {len(self.graph)} nodes "
+              f"(+{added} / -{removed} chunks in {time.perf_counter() - start:.1f}s).")
+        return added, removed
 
-    def query(self, query, top_k=3, max_length=200):
+    def update_knowledge_graph(self):
+        """Keep an already built graph in step with the stores (no-op before the first build)."""
+        if self.graph is not None:
+            return self.build_knowledge_graph()
+        return 0, 0
+
+    def retrieve(self, query, top_k=3, depth=2, sources=None):
+        """
+        Chunks linked to the query's entities through the graph, ranked by
+        entity overlap and path distance, from every store in `sources`
+        (None: both; an empty list selects none, as in RAG mode). Stage timings (seconds) go to `last_timings`.
+        """
+        timings = {}
+        stores = {"user": self.rag_pipeline.user_vectorstore, "db": self.rag_pipeline.db_vectorstore}
+        names = [name for name in (stores if sources is None else sources) if stores.get(name)]
+        with span("retrieve", mode="graph") as total:
+            with span("entity_link") as s:
+                entities = self.graph_builder.link_query(query)
+            timings["entities"] = s.duration
+            with span("graph_search", entities=len(entities)) as s:
+                ranked = self.graph_builder.rank_chunks(entities, depth=depth, top_k=top_k, prefixes=names) if entities else []
+            timings["rank"] = s.duration
+            with span("fetch") as s:
+                docs = []
+                for key, score in ranked:
+                    name, chunk_id = key.split(":", 1)
+                    doc = stores[name].texts.get(int(chunk_id))
+                    if doc is not None:
+                        docs.append(dict(doc, source=name, score=score))
+            timings["fetch"] = s.duration
+        timings["total"] = total.duration
+        self.last_entities = sorted(entities)
+        self.last_timings = timings
+        return docs
+
+    def query(self, query, top_k=3, max_length=200, sources=None):
+        return "".join(self.stream_query(query, top_k=top_k, max_length=max_length, sources=sources)).strip()
+
+    def stream_query(self, query, top_k=3, max_length=200, sources=None):
+        with span("query", method="graph", top_k=top_k) as trace:
+            self.last_trace = trace
+            count("rag_queries_total", method="graph")
+            yield from self._stream_query(query, top_k, max_length, sources)
+
+    def _stream_query(self, query, top_k, max_length, sources):
         if self.graph is None:
-            return "Graph not built yet. Please build it first."
-        # Sorgudan entity’leri çıkar
-        entities, _ = self.graph_builder.extract_entities_relations(query)
-        if not entities:
-            return self.rag_pipeline.answer(query, top_k=top_k, max_length=max_length)
-        related_nodes = set()
-        for ent in entities:
-            related_nodes.update(self.graph_builder.query_related_entities(ent, depth=2))
-        # Graph node’larına göre belge bul
-        related_texts = []
-        for doc in self.rag_pipeline.user_vectorstore.texts:
-            if any(node in doc["text"] for node in related_nodes):
-                related_texts.append(doc)
-        if not related_texts:
-            return self.rag_pipeline.answer(query, top_k=top_k, max_length=max_length)
+            yield "Graph not built yet. Please build it first."
+            return
+        # Sorgudaki entity’lerle graph üzerinden ilgili chunk’ları bul
+        docs = self.retrieve(query, top_k=top_k, sources=sources)
+        if not docs:
+            yield from self.rag_pipeline.stream_answer(query, top_k=top_k, max_length=max_length,
+                                                     sources=["user", "db"] if sources is None else sources)
+            return
         # RAG pipeline üzerinden yanıt oluştur
-        context = "\n\n".join([d["text"] for d in related_texts[:3]])
+        context = self.rag_pipeline.build_context(docs, query)
         prompt = self.rag_pipeline.build_prompt(context, query)
-        output = self.rag_pipeline.generator(prompt, max_new_tokens=max_length)
-        return output[0]["generated_text"]
+        yield from self.rag_pipeline.generate_stream(prompt, max_length)
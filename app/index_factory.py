@@ -0,0 +1,64 @@
+import math
+import faiss
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+
+def default_nlist(num_vectors):
+    # Rule of thumb from the FAISS wiki: ~4*sqrt(N) lists, and at least
+    # 39 training points per list so k-means does not warn/underfit.
+    return max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // 39))
+
+
+def build_index(index_type, dimension, nlist=None, num_vectors=None, pq_m=16, pq_bits=8,
+                nprobe=16, hnsw_m=32, ef_construction=200, ef_search=64):
+    """
+    Create an empty inner-product FAISS index.
+
+    `nlist` defaults to a value derived from `num_vectors` (the expected training
+    set size) for the IVF variants. IVF indexes must be trained before use;
+    flat and HNSW indexes are ready immediately.
+    """
+    if index_type == "flat":
+        return faiss.IndexFlatIP(dimension)
+    if index_type in ("ivf_flat", "ivf_pq"):
+        if nlist is None:
+            nlist = default_nlist(num_vectors or 0)
+        if index_type == "ivf_flat":
+            spec = f"IVF{nlist},Flat"
+        else:
+            spec = f"IVF{nlist},PQ{pq_m}x{pq_bits}"
+        index = faiss.index_factory(dimension, spec, faiss.METRIC_INNER_PRODUCT)
+        index.nprobe = min(nprobe, nlist)
+        return index
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+        index.hnsw.efSearch = ef_search
+        return index
+    raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+
+
+def index_type_of(index):
+    """Best-effort reverse lookup of the INDEX_TYPES name for a built index."""
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        ivf = None
+    if ivf is not None:
+        # extract_index_ivf() returns the IndexIVF base class
+        return "ivf_pq" if isinstance(faiss.downcast_index(ivf), faiss.IndexIVFPQ) else "ivf_flat"
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def search_params(index_type, nprobe=None, ef_search=None):
+    """Per-query search parameters; None means use the index defaults."""
+    if index_type in ("ivf_flat", "ivf_pq") and nprobe is not None:
+        return faiss.SearchParametersIVF(nprobe=int(nprobe))
+    if index_type == "hnsw" and ef_search is not None:
+        return faiss.SearchParametersHNSW(efSearch=int(ef_search))
+    return None
@@ -0,0 +1,143 @@
+"""
+Opt-in CPU inference backends for the generator, embedder and reranker.
+
+    RAG_INFERENCE_BACKEND=torch   fp32 PyTorch (default)
+    RAG_INFERENCE_BACKEND=int8    PyTorch with int8 dynamic quantization of Linear layers
+    RAG_INFERENCE_BACKEND=onnx    ONNX Runtime exports (needs optimum[onnxruntime])
+    RAG_INTRA_OP_THREADS=N        intra-op threads for PyTorch / ONNX Runtime
+    RAG_ONNX_CACHE=dir            where ONNX exports are kept (default data/onnx)
+
+Models are exported to ONNX once and loaded from RAG_ONNX_CACHE after that.
+A backend that cannot be used (missing package, non-CPU device, failed export)
+falls back to torch with a log line instead of failing the app.
+"""
+import os
+import shutil
+import threading
+
+BACKENDS = ("torch", "int8", "onnx")
+ONNX_CACHE_DIR = os.getenv("RAG_ONNX_CACHE", "data/onnx")
+
+_threads_lock = threading.Lock()
+_threads_configured = False
+
+
+def inference_backend():
+    backend = os.getenv("RAG_INFERENCE_BACKEND", "torch").lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"RAG_INFERENCE_BACKEND must be one of {BACKENDS}, got '{backend}'")
+    return backend
+
+
+def intra_op_threads():
+    value = os.getenv("RAG_INTRA_OP_THREADS")
+    return int(value) if value else None
+
+
+def configure_threads():
+    """Apply RAG_INTRA_OP_THREADS to PyTorch once per process."""
+    global _threads_configured
+    with _threads_lock:
+        if _threads_configured:
+            return
+        _threads_configured = True
+        threads = intra_op_threads()
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+            print(f"[Inference] torch intra-op threads: {threads}")
+
+
+def _session_options():
+    import onnxruntime
+    options = onnxruntime.SessionOptions()
+    threads = intra_op_threads()
+    if threads:
+        options.intra_op_num_threads = threads
+    return options
+
+
+def _quantize(module):
+    import torch
+    return torch.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _fallback(what, backend, error):
+    print(f"[Inference] {backend} backend unavailable for {what} ({error}); using torch")
+
+
+def _load_onnx(kind, model_name, load):
+    """
+    `load(source)` builds an ONNX Runtime model from a hub name (exporting it)
+    or from a saved export. The export is saved under ONNX_CACHE_DIR the first
+    time, so later processes skip it.
+    """
+    path = os.path.join(ONNX_CACHE_DIR, kind, model_name.replace("/", "--"))
+    if os.path.isdir(path):
+        return load(path)
+    model = load(model_name)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        model.save_pretrained(tmp_path)
+        # Another process may have saved the same export first; either copy will do
+        os.replace(tmp_path, path)
+        print(f"[Inference] Saved ONNX export of {model_name} to {path}")
+    except OSError as e:
+        print(f"[Inference] Could not save ONNX export of {model_name}: {e}")
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return model
+
+
+def load_embedder(model_name, backend):
+    from sentence_transformers import SentenceTransformer
+    configure_threads()
+    if backend == "onnx":
+        try:
+            return _load_onnx("embedder", model_name, lambda source: SentenceTransformer(
+                source, device="cpu", backend="onnx", model_kwargs={"session_options": _session_options()}))
+        except Exception as e:
+            _fallback(model_name, backend, e)
+    model = SentenceTransformer(model_name, device="cpu" if backend != "torch" else None)
+    if backend == "int8":
+        model = _quantize(model)
+    return model
+
+
+def load_generator(model_name, device, backend):
+    from transformers import pipeline
+    configure_threads()
+    if backend != "torch" and device != "cpu":
+        _fallback(model_name, backend, f"device {device}")
+        backend = "torch"
+    if backend == "onnx":
+        try:
+            from optimum.onnxruntime import ORTModelForSeq2SeqLM
+            from transformers import AutoTokenizer
+            model = _load_onnx("generator", model_name, lambda source: ORTModelForSeq2SeqLM.from_pretrained(
+                source, export=source == model_name, session_options=_session_options()))
+            return pipeline("text2text-generation", model=model,
+                            tokenizer=AutoTokenizer.from_pretrained(model_name))
+        except Exception as e:
+            _fallback(model_name, backend, e)
+    generator = pipeline("text2text-generation", model=model_name, device=0 if device == "mps" else -1)
+    if backend == "int8":
+        generator.model = _quantize(generator.model)
+    return generator
+
+
+def load_reranker(model_name, max_length, backend):
+    from sentence_transformers import CrossEncoder
+    configure_threads()
+    if backend == "onnx":
+        try:
+            return _load_onnx("reranker", model_name, lambda source: CrossEncoder(
+                source, device="cpu", max_length=max_length, backend="onnx",
+                model_kwargs={"session_options": _session_options()}))
+        except Exception as e:
+            _fallback(model_name, backend, e)
+    model = CrossEncoder(model_name, device="cpu", max_length=max_length)
+    if backend == "int8":
+        model.model = _quantize(model.model)
+    return model
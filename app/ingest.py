@@ -0,0 +1,257 @@
+import logging
+import multiprocessing
+import os
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
+from app.file_processor import hash_stream, iter_chunk_batches
+from app.metrics import span, add_span, count
+
+logger = logging.getLogger(__name__)
+
+
+class IngestReport(dict):
+    """Per-upload counters and per-stage throughput, as a plain dict."""
+
+    def summary(self):
+        return (f"{self['files']} files ({self['skipped']} unchanged, {self['failed']} failed), "
+                f"{self['pages']} pages @ {self['pages_per_s']:.1f}/s, "
+                f"{self['chunks']} chunks @ {self['chunks_per_s']:.1f}/s, "
+                f"{self['embeddings']} embeddings @ {self['embeddings_per_s']:.1f}/s "
+                f"({self['embedding_cache_hits']} cached), "
+                f"commit {self['commit_seconds']:.2f}s")
+
+
+def _rate(count, seconds):
+    return count / seconds if seconds > 0 else 0.0
+
+
+def ingest_files(uploaded_files, vectorstore, rag_pipeline=None, persist=True, workers=None,
+                 embed_batch=512, encode_batch_size=64, chunk_size=500, overlap=50, tokenizer_name=None):
+    """
+    Ingest a batch of uploads in one pass:
+
+    - unchanged files (same content hash) are skipped before extraction,
+    - extraction + chunking runs across worker processes (chunk_size / overlap
+      in characters, or in tokens of `tokenizer_name` when given),
+    - chunks are embedded in batches of about `embed_batch` across files,
+    - the store is saved and BM25 refreshed once for the whole batch.
+
+    Returns an IngestReport with counts and pages/s, chunks/s, embeddings/s.
+    The stages are also traced as an "ingest" span (see app.metrics).
+    """
+    with span("ingest", files=len(uploaded_files)) as trace:
+        report = _ingest_files(uploaded_files, vectorstore, rag_pipeline, persist, workers,
+                               embed_batch, encode_batch_size, chunk_size, overlap, tokenizer_name)
+        trace.attrs.update(skipped=report["skipped"], failed=report["failed"], chunks=report["chunks"])
+    count("rag_ingested_files_total", report["files"] - report["skipped"] - report["failed"])
+    count("rag_ingested_chunks_total", report["chunks"])
+    return report
+
+
+def _ingest_files(uploaded_files, vectorstore, rag_pipeline, persist, workers,
+                  embed_batch, encode_batch_size, chunk_size, overlap, tokenizer_name):
+    report = IngestReport(files=len(uploaded_files), skipped=0, failed=0, errors={},
+                          pages=0, chunks=0, embeddings=0, embedding_cache_hits=0,
+                          extract_seconds=0.0, chunk_seconds=0.0, embed_seconds=0.0, commit_seconds=0.0)
+    start = time.perf_counter()
+
+    jobs = []
+    for uploaded_file in uploaded_files:
+        content_hash = hash_stream(uploaded_file)
+        if hasattr(vectorstore, "is_unchanged") and vectorstore.is_unchanged(uploaded_file.name, content_hash):
+            report["skipped"] += 1
+            continue
+        jobs.append((uploaded_file.name, uploaded_file, content_hash))
+
+    # Documents are streamed in batches; batches of several files are embedded together
+    pending = []  # ("add", name, chunks, metadata) / ("done", name, content_hash) / ("fail", name)
+    started = set()  # documents whose previous version has been replaced
+    received = {}  # chunks seen per document
+    incremental = hasattr(vectorstore, "upsert_document")
+
+    def flush():
+        texts = [chunk for entry in pending if entry[0] == "add" for chunk in entry[2]]
+        if texts:
+            t0 = time.perf_counter()
+            cache = getattr(vectorstore, "embedding_cache", None)
+            hits_before, misses_before = (cache.hits, cache.misses) if cache else (0, 0)
+            with span("embed", texts=len(texts)):
+                embeddings = vectorstore.embed(texts, batch_size=encode_batch_size)
+            report["embedding_cache_hits"] += (cache.hits if cache else 0) - hits_before
+            if cache:
+                count("rag_cache_lookups_total", cache.hits - hits_before, cache="embedding", result="hit")
+                count("rag_cache_lookups_total", cache.misses - misses_before, cache="embedding", result="miss")
+            report["embed_seconds"] += time.perf_counter() - t0
+            report["embeddings"] += len(texts)
+        pos = 0
+        entries = pending[:]
+        pending.clear()
+        for kind, name, *payload in entries:
+            if kind == "add":
+                chunks, metadata = payload
+                vectors = embeddings[pos:pos + len(chunks)]
+                pos += len(chunks)
+                if incremental and name not in started:
+                    # The first batch replaces the stored version, as upsert_document() does
+                    vectorstore.delete_document(name)
+                    started.add(name)
+                vectorstore.add_texts(chunks, [{**m, "doc_name": name} for m in metadata], embeddings=vectors)
+            elif kind == "done" and incremental:
+                # Only a complete document is recorded as unchanged for the next upload
+                vectorstore.set_content_hash(name, payload[0])
+            elif kind == "fail" and name in started:
+                vectorstore.delete_document(name)
+
+    def on_batch(name, chunks, metadata):
+        report["chunks"] += len(chunks)
+        received[name] = received.get(name, 0) + len(chunks)
+        pending.append(("add", name, chunks, metadata))
+        if sum(len(entry[2]) for entry in pending if entry[0] == "add") >= embed_batch:
+            flush()
+
+    def on_done(name, content_hash, stats):
+        report["pages"] += stats["pages"]
+        report["extract_seconds"] += stats["extract_seconds"]
+        report["chunk_seconds"] += stats["chunk_seconds"]
+        # Timed inside the worker; recorded here so they land in this trace
+        add_span("extract", stats["extract_seconds"], file=name, pages=stats["pages"])
+        add_span("chunk", stats["chunk_seconds"], file=name, chunks=received.get(name, 0))
+        if not received.get(name):
+            on_fail(name, "No text could be extracted")
+            return
+        pending.append(("done", name, content_hash))
+
+    def on_fail(name, error):
+        # A partly added document is removed again rather than kept half-indexed
+        report["failed"] += 1
+        report["errors"][name] = error
+        pending.append(("fail", name))
+
+    workers = workers or min(len(jobs), os.cpu_count() or 1)
+    if workers <= 1:
+        for name, stream, content_hash in jobs:
+            stats = _new_stats()
+            # In-process: read pages straight from the upload buffer
+            batches = iter_chunk_batches(name, stream, chunk_size, overlap, stats=stats, tokenizer_name=tokenizer_name)
+            while True:
+                try:
+                    chunks, metadata = next(batches)
+                except StopIteration:
+                    on_done(name, content_hash, stats)
+                    break
+                except Exception as e:
+                    on_fail(name, str(e))
+                    break
+                on_batch(name, chunks, metadata)
+    elif jobs:
+        _extract_in_workers(jobs, workers, chunk_size, overlap, tokenizer_name, on_batch, on_done, on_fail)
+    flush()
+
+    t0 = time.perf_counter()
+    if jobs:
+        with span("persist"):
+            if persist and hasattr(vectorstore, "save"):
+                vectorstore.save()
+            if rag_pipeline is not None:
+                rag_pipeline.refresh_bm25()
+    report["commit_seconds"] = time.perf_counter() - t0
+    report["total_seconds"] = time.perf_counter() - start
+
+    # Extraction/chunking time is summed over workers, so divide by the worker count
+    parallel = max(1, workers)
+    report["pages_per_s"] = _rate(report["pages"], report["extract_seconds"] / parallel)
+    report["chunks_per_s"] = _rate(report["chunks"], report["chunk_seconds"] / parallel)
+    report["embeddings_per_s"] = _rate(report["embeddings"], report["embed_seconds"])
+    logger.debug("Ingest: %s", report.summary())
+    return report
+
+
+def _new_stats():
+    return {"pages": 0, "extract_seconds": 0.0, "chunk_seconds": 0.0}
+
+
+# Worker process side: batches go back through a queue handed over at start-up
+_batches = None
+
+
+def _init_worker(batches):
+    global _batches
+    _batches = batches
+
+
+def _extract_batches(key, name, data, chunk_size, overlap, tokenizer_name):
+    """Send ("batch", key, chunks, metadata) per batch, then ("done", key, stats) or ("error", key, message)."""
+    stats = _new_stats()
+    try:
+        for chunks, metadata in iter_chunk_batches(name, data, chunk_size, overlap, stats=stats,
+                                                   tokenizer_name=tokenizer_name):
+            _batches.put(("batch", key, chunks, metadata))
+    except Exception as e:
+        _batches.put(("error", key, str(e)))
+    else:
+        _batches.put(("done", key, stats))
+
+
+def _extract_in_workers(jobs, workers, chunk_size, overlap, tokenizer_name, on_batch, on_done, on_fail):
+    """
+    Extract `jobs` in a spawn-context process pool (forking a process that
+    runs torch threads can deadlock), handing each batch to on_batch as it
+    arrives. The bounded queue stops workers from running far ahead of
+    embedding; at most `workers` files are read into memory at once.
+    """
+    context = multiprocessing.get_context("spawn")
+
+    def new_pool():
+        batches = context.Queue(maxsize=2 * workers)
+        pool = ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(batches,))
+        return pool, batches
+
+    pool, batches = new_pool()
+    todo, running = enumerate(jobs), {}  # key -> (name, content_hash, future, pool)
+
+    def submit():
+        for key, (name, stream, content_hash) in todo:
+            # Workers need the raw bytes (file objects cannot be pickled); read per job
+            future = pool.submit(_extract_batches, key, name, stream.read(), chunk_size, overlap, tokenizer_name)
+            running[key] = (name, content_hash, future, pool)
+            return True
+        return False
+
+    try:
+        for _ in range(workers):
+            submit()
+        while running:
+            try:
+                kind, key, *payload = batches.get(timeout=0.1)
+            except queue.Empty:
+                broken = next((entry[3] for entry in running.values()
+                               if entry[2].done() and entry[2].exception() is not None), None)
+                if broken is None:
+                    continue
+                # A worker died (e.g. out of memory) and took the pool's other jobs with
+                # it; the files not submitted yet get a new pool (and queue)
+                for key, (name, _, future, future_pool) in list(running.items()):
+                    if future_pool is broken:
+                        del running[key]
+                        on_fail(name, str(future.exception() or "Extraction worker failed"))
+                if broken is pool:
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool, batches = new_pool()
+                while len(running) < workers and submit():
+                    pass
+                continue
+            if key not in running:
+                continue  # left over from a job that already failed
+            name, content_hash = running[key][:2]
+            if kind == "batch":
+                on_batch(name, *payload)
+                continue
+            del running[key]
+            if kind == "done":
+                on_done(name, content_hash, payload[0])
+            else:
+                on_fail(name, payload[0])
+            submit()
+    finally:
+        pool.shutdown(cancel_futures=True)
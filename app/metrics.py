@@ -0,0 +1,268 @@
+"""
+In-process metrics and tracing for the query and ingestion pipelines.
+
+    with span("rerank", candidates=len(docs)):   # timed stage, nested under the open span
+        ...
+    add_span("search", seconds, source="user")   # stage timed elsewhere (thread pool, worker process)
+    count("rag_cache_lookups_total", cache="answer", result="hit")
+    observe("rag_generation_ttft_seconds", 0.42)
+
+Every finished span is observed in the rag_stage_seconds{stage=...}
+histogram. When a root span (one with no open parent in its thread) ends,
+its tree becomes the thread's last_trace() and, if RAG_TRACE_FILE is set,
+is appended to that file as one JSON line.
+
+render_prometheus() returns every counter and histogram in the Prometheus
+text format; with RAG_METRICS_PORT set, main.py serves it on /metrics.
+"""
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+HELP = {
+    "rag_stage_seconds": "Duration of pipeline stages",
+    "rag_queries_total": "Questions answered, by method",
+    "rag_cache_lookups_total": "Cache lookups, by cache and result",
+    "rag_generated_tokens_total": "Tokens generated",
+    "rag_generation_ttft_seconds": "Time to first generated token",
+    "rag_ingested_files_total": "Uploaded files indexed",
+    "rag_ingested_chunks_total": "Chunks indexed",
+}
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> _Histogram
+
+    def count(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def render_prometheus(self):
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            lines, typed = [], set()
+
+            def header(name, kind):
+                if name not in typed:
+                    typed.add(name)
+                    if name in HELP:
+                        lines.append(f"# HELP {name} {HELP[name]}")
+                    lines.append(f"# TYPE {name} {kind}")
+
+            for (name, labels), value in counters:
+                header(name, "counter")
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+            for (name, labels), histogram in histograms:
+                header(name, "histogram")
+                cumulative = 0
+                for bound, n in zip(list(histogram.buckets) + [math.inf], histogram.counts):
+                    cumulative += n
+                    le = "+Inf" if bound == math.inf else repr(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+count = metrics.count
+observe = metrics.observe
+render_prometheus = metrics.render_prometheus
+
+
+# ---------------------------------------------------------------------- #
+# Spans
+# ---------------------------------------------------------------------- #
+class Span:
+    def __init__(self, name, attrs, parent=None, start=None):
+        self.name = name
+        self.attrs = attrs
+        self.parent = parent
+        self.children = []
+        now = time.perf_counter()
+        self.start = now if start is None else start
+        self.wall_start = time.time() - (now - self.start)
+        self.duration = None
+
+    def finish(self, end=None):
+        self.duration = (time.perf_counter() if end is None else end) - self.start
+
+    def walk(self, depth=0):
+        """(depth, span) for this span and every descendant, depth first."""
+        yield depth, self
+        for child in self.children:
+            yield from child.walk(depth + 1)
+
+    def to_dict(self):
+        return {"name": self.name, "start": round(self.wall_start, 6),
+                "duration_ms": round((self.duration or 0.0) * 1000, 3), "attrs": self.attrs,
+                "children": [child.to_dict() for child in self.children]}
+
+
+_local = threading.local()
+_trace_lock = threading.Lock()
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def current_span():
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+def _finish(s):
+    observe("rag_stage_seconds", s.duration, stage=s.name)
+    if s.parent is None:
+        _local.last_trace = s
+        _write_trace(s)
+
+
+def _write_trace(root):
+    path = os.getenv("RAG_TRACE_FILE")
+    if not path:
+        return
+    record = dict(root.to_dict(), trace_id=uuid.uuid4().hex)
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with _trace_lock, open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+    except OSError as e:
+        print(f"[Metrics] Could not write trace to {path}: {e}")
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time a stage; nested spans become its children. Yields the Span (attrs can be added)."""
+    stack = _stack()
+    s = Span(name, attrs, parent=stack[-1] if stack else None)
+    if s.parent is not None:
+        s.parent.children.append(s)
+    stack.append(s)
+    try:
+        yield s
+    except BaseException as e:
+        if not isinstance(e, GeneratorExit):
+            s.attrs["error"] = repr(e)
+        raise
+    finally:
+        s.finish()
+        # A generator closed late may finish its span out of order
+        if stack and stack[-1] is s:
+            stack.pop()
+        elif s in stack:
+            stack.remove(s)
+        _finish(s)
+
+
+def add_span(name, seconds, **attrs):
+    """Record a stage that was timed elsewhere as a finished child of the open span."""
+    end = time.perf_counter()
+    s = Span(name, attrs, parent=current_span(), start=end - seconds)
+    s.finish(end)
+    if s.parent is not None:
+        s.parent.children.append(s)
+    _finish(s)
+    return s
+
+
+def last_trace():
+    """The last finished root span of this thread, or None."""
+    return getattr(_local, "last_trace", None)
+
+
+# ---------------------------------------------------------------------- #
+# /metrics endpoint
+# ---------------------------------------------------------------------- #
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_http_server(port, addr="0.0.0.0"):
+    """Serve render_prometheus() on http://addr:port/metrics from a daemon thread (once per process)."""
+    global _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((addr, int(port)), Handler)
+            except OSError as e:
+                print(f"[Metrics] Could not serve /metrics on port {port}: {e}")
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+            print(f"[Metrics] Serving /metrics on port {port}")
+        return _server
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+from app.inference_backends import inference_backend, load_embedder, load_generator, load_reranker
+
+EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+GENERATOR_MODEL = "google/flan-t5-base"
+RERANKER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+
+def current_rss():
+    """Resident set size of this process in bytes (0 if it cannot be read)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+        return rss if os.uname().sysname == "Darwin" else rss * 1024
+    except (ImportError, OSError):
+        return 0
+
+
+class _Entry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.model = None
+        self.refcount = 0
+        self.load_seconds = 0.0
+        self.rss_delta = 0
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded models.
+
+    Models are loaded lazily on the first acquire() of a key and shared by every
+    caller after that. Each acquire() must be paired with a release(); when the
+    reference count drops to zero the model is dropped unless it is pinned.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._pinned = set()
+
+    def acquire(self, key, loader):
+        with self._lock:
+            entry = self._entries.setdefault(key, _Entry())
+            entry.refcount += 1
+        # Per-key lock so loading one model does not block lookups of another
+        with entry.lock:
+            if entry.model is None:
+                try:
+                    rss_before = current_rss()
+                    start = time.perf_counter()
+                    entry.model = loader()
+                    entry.load_seconds = time.perf_counter() - start
+                    entry.rss_delta = max(0, current_rss() - rss_before)
+                except Exception:
+                    with self._lock:
+                        entry.refcount -= 1
+                        # Nothing loaded: forget the key unless another caller is waiting on it
+                        if entry.refcount == 0 and self._entries.get(key) is entry:
+                            del self._entries[key]
+                    raise
+                print(f"[ModelRegistry] Loaded {key} in {entry.load_seconds:.2f}s "
+                      f"(+{entry.rss_delta / 2**20:.0f} MiB RSS)")
+            return entry.model
+
+    def release(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.refcount == 0:
+                return
+            entry.refcount -= 1
+            if entry.refcount == 0 and key not in self._pinned:
+                del self._entries[key]
+                print(f"[ModelRegistry] Released {key}")
+
+    def pin(self, key):
+        """Keep a model loaded even when nothing references it."""
+        with self._lock:
+            self._pinned.add(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                key: {
+                    "loaded": entry.model is not None,
+                    "refcount": entry.refcount,
+                    "load_seconds": round(entry.load_seconds, 3),
+                    "rss_mib": round(entry.rss_delta / 2**20, 1),
+                }
+                for key, entry in self._entries.items()
+            }
+
+
+registry = ModelRegistry()
+
+
+def default_device():
+    """mps when available, else cpu (imports torch, so call it only when a model is needed)."""
+    import torch
+    return "mps" if torch.backends.mps.is_available() else "cpu"
+
+
+def embedder_key(model_name=EMBEDDING_MODEL, backend=None):
+    return ("embedder", model_name, backend or inference_backend())
+
+
+def generator_key(model_name=GENERATOR_MODEL, device="cpu", backend=None):
+    return ("generator", model_name, device, backend or inference_backend())
+
+
+def tokenizer_key(model_name=GENERATOR_MODEL):
+    return ("tokenizer", model_name)
+
+
+def reranker_key(model_name=RERANKER_MODEL, max_length=None, backend=None):
+    return ("reranker", model_name, max_length, backend or inference_backend())
+
+
+# Loaders honour RAG_INFERENCE_BACKEND (torch / int8 / onnx), see app/inference_backends.py
+
+def acquire_embedder(model_name=EMBEDDING_MODEL):
+    key = embedder_key(model_name)
+    return registry.acquire(key, lambda: load_embedder(model_name, key[-1]))
+
+
+def acquire_generator(model_name=GENERATOR_MODEL, device="cpu"):
+    key = generator_key(model_name, device)
+    return registry.acquire(key, lambda: load_generator(model_name, device, key[-1]))
+
+
+def acquire_tokenizer(model_name=GENERATOR_MODEL):
+    def load():
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(model_name)
+    return registry.acquire(tokenizer_key(model_name), load)
+
+
+def acquire_reranker(model_name=RERANKER_MODEL, max_length=None):
+    key = reranker_key(model_name, max_length)
+    return registry.acquire(key, lambda: load_reranker(model_name, max_length, key[-1]))
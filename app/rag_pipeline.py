@@ -1,58 +1,227 @@
-import torch
-from transformers import pipeline, AutoTokenizer
-from rank_bm25 import BM25Okapi
-from sentence_transformers import CrossEncoder
-import shelve, hashlib, os
-
-class ShelveCache:
-    def __init__(self, filename="cache.db"):
-        self.filename = filename
-
-    def _hash_key(self, key):
-        return hashlib.sha256(key.encode("utf-8")).hexdigest()
-
-    def get(self, key_dict):
-        raw_key = str(key_dict)
-        hashed_key = self._hash_key(raw_key)
-        with shelve.open(self.filename) as db:
-            return db.get(hashed_key)
-
-    def set(self, key_dict, value):
-        raw_key = str(key_dict)
-        hashed_key = self._hash_key(raw_key)
-        with shelve.open(self.filename) as db:
-            db[hashed_key] = value
+import hashlib, logging, os, threading
+from contextlib import contextmanager
+from app.model_registry import (registry, acquire_generator, acquire_tokenizer, default_device,
+                                generator_key, tokenizer_key, GENERATOR_MODEL)
+from app.answer_cache import get_answer_cache
+from app.bm25 import BM25Index, BM25_DIR
+from app.retriever import HybridRetriever
+from app.reranker import Reranker
+from app.context_builder import ContextBuilder
+from app.generation import generation_kwargs, stream_generate
+from app.metrics import span, add_span, count, observe
+
+# Per-query details; the same numbers are in the spans and the last_* stats
+logger = logging.getLogger(__name__)
 
 class RAGPipeline:
     def __init__(self, user_vectorstore, db_vectorstore=None, cache_enabled=True, use_bm25=False,
-                 reranker_model=None, chunk_size=400, max_model_tokens=512):
+                 reranker_model=None, chunk_size=400, max_model_tokens=512, cache=None,
+                 semantic_cache=None, semantic_threshold=None, fusion="rrf", reranker_options=None,
+                 scheduler=None):
+        # Lazy members are created under this lock; compare mode answers from two threads at once
+        self._lock = threading.RLock()
+        self._local = threading.local()  # results of the answer call running in this thread
         self.user_vectorstore = user_vectorstore
         self.db_vectorstore = db_vectorstore
-        self.cache = ShelveCache()
+        self.cache = cache if cache is not None else get_answer_cache()
         self.cache_enabled = cache_enabled
-        self.use_bm25 = use_bm25
+        self.semantic_cache = semantic_cache
+        self.semantic_threshold = semantic_threshold  # None: the cache's own threshold
+        self.use_bm25 = use_bm25  # hybrid BM25 + dense retrieval
+        self.retriever = HybridRetriever(fusion=fusion)
+        self.last_retrieval_timings = {}
         self.chunk_size = chunk_size
         self.max_model_tokens = max_model_tokens
 
         self.bm25_user = None
         self.bm25_db = None
+        self._bm25_sources = {}  # which store each index was built from
         if use_bm25:
             self.refresh_bm25()
 
-        self.reranker = CrossEncoder(reranker_model, device="cpu") if reranker_model else None
-
-        self.device = "mps" if torch.backends.mps.is_available() else "cpu"
-        device_id = 0 if self.device == "mps" else -1
-        self.generator = pipeline("text2text-generation",
-                                  model="google/flan-t5-base",
-                                  device=device_id)
-        self.tokenizer = AutoTokenizer.from_pretrained("google/flan-t5-base")
+        self.reranker = None
+        self.use_reranker = False
+        self.reranker_options = reranker_options or {}
+        self.set_reranker(reranker_model)
+
+        # With a shared GenerationScheduler all generation goes through its worker.
+        # The generator and tokenizer load on first use (see the properties below).
+        self.scheduler = scheduler
+        self._device = None
+        self._generator = None
+        self._tokenizer = None
+        self._context_builder = None
+        self.last_context_stats = {}
+        self.last_generation_stats = {}
+        self.last_rerank_timings = {}
+        self.last_trace = None  # metrics.Span tree of the last answer
+
+    def set_reranker(self, reranker_model):
+        """
+        Enable (model name) or disable (None) reranking. Disabling keeps the
+        model and its score cache, so toggling it back on costs nothing.
+        """
+        if reranker_model is None:
+            self.use_reranker = False
+            return
+        if self.reranker is None or self.reranker.model_name != reranker_model:
+            if self.reranker is not None:
+                self.reranker.close()
+            self.reranker = Reranker(reranker_model, **self.reranker_options)
+        self.use_reranker = True
+
+    @property
+    def device(self):
+        with self._lock:
+            if self._device is None:
+                self._device = self.scheduler.device if self.scheduler else default_device()
+            return self._device
+
+    @property
+    def generator(self):
+        with self._lock:
+            if self._generator is None:
+                self._generator = self.scheduler.generator if self.scheduler else \
+                    acquire_generator(GENERATOR_MODEL, self.device)
+            return self._generator
+
+    @property
+    def tokenizer(self):
+        with self._lock:
+            if self._tokenizer is None:
+                self._tokenizer = acquire_tokenizer(GENERATOR_MODEL)
+            return self._tokenizer
+
+    @property
+    def context_builder(self):
+        with self._lock:
+            if self._context_builder is None:
+                self._context_builder = ContextBuilder(self.tokenizer, max_tokens=self.max_model_tokens)
+            return self._context_builder
+
+    def close(self):
+        self.use_reranker = False
+        if self.reranker is not None:
+            self.reranker.close()
+            self.reranker = None
+        if self._generator is not None:
+            self._generator = None
+            if self.scheduler is None:
+                registry.release(generator_key(GENERATOR_MODEL, self.device))
+        if self._tokenizer is not None:
+            self._tokenizer = None
+            self._context_builder = None
+            registry.release(tokenizer_key(GENERATOR_MODEL))
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
 
     def refresh_bm25(self):
-        if self.user_vectorstore and self.user_vectorstore.texts:
-            self.bm25_user = BM25Okapi([doc["text"].split() for doc in self.user_vectorstore.texts])
-        if self.db_vectorstore and self.db_vectorstore.texts:
-            self.bm25_db = BM25Okapi([doc["text"].split() for doc in self.db_vectorstore.texts])
+        with self._lock:
+            self.bm25_user = self._sync_bm25("user", self.bm25_user, self.user_vectorstore)
+            self.bm25_db = self._sync_bm25("db", self.bm25_db, self.db_vectorstore)
+
+    def _sync_bm25(self, name, index, store):
+        """
+        Bring a store's BM25 index up to date incrementally. The first call
+        loads the saved index when it matches the store, otherwise builds it.
+        """
+        if self._bm25_sources.get(name) is not store:
+            # The store was replaced (e.g. documents cleared); its ids start over
+            index = None
+            self._bm25_sources[name] = store
+        if not store or not store.texts:
+            return None
+        path = os.path.join(store.persist_path, BM25_DIR) if store.persist_path else None
+        fingerprint = store.texts.doc_fingerprint()
+        if index is None and path:
+            index = BM25Index.load(path, fingerprint)
+            if index is not None:
+                return index
+        changed = True
+        if index is None:
+            index = BM25Index()
+            index.sync(store.texts)
+        else:
+            changed = index.sync(store.texts)
+        if changed and path:
+            index.save(path, fingerprint)
+        return index
+
+    def corpus_version(self):
+        """Changes whenever a document is added, replaced or deleted in either store."""
+        h = hashlib.sha256()
+        for store in (self.user_vectorstore, self.db_vectorstore):
+            h.update((store.texts.doc_fingerprint() if store else "").encode("utf-8"))
+        return h.hexdigest()
+
+    def _query_store(self):
+        # Both stores use the same embedding model; either can embed the query
+        return self.user_vectorstore or self.db_vectorstore
+
+    def _semantic_lookup(self, query, scope):
+        """(answer or None, query embedding) from the semantic cache."""
+        store = self._query_store()
+        if self.semantic_cache is None or store is None:
+            return None, None
+        with span("embed"):
+            query_embedding = store.embed_query(query)
+        hit = self.semantic_cache.get(query_embedding, scope, threshold=self.semantic_threshold)
+        count("rag_cache_lookups_total", cache="semantic", result="miss" if hit is None else "hit")
+        if hit is None:
+            return None, query_embedding
+        answer, similarity, cached_query = hit
+        logger.debug("Semantic cache: reused answer for %r (cosine %.3f)", cached_query, similarity)
+        return answer, query_embedding
+
+    def _record(self, **results):
+        """
+        Keep a stage's results (context_stats=..., ...) for the answer call
+        running in this thread, see _run(). Stages called on their own (e.g.
+        by GraphRAGPipeline) set last_<name> directly.
+        """
+        run = getattr(self._local, "run", None)
+        if run is not None:
+            run.update(results)
+            return
+        for name, value in results.items():
+            setattr(self, "last_" + name, value)
+
+    @contextmanager
+    def _run(self, method, top_k, stats):
+        """
+        One answer call: its root span, and a dict that collects what its
+        stages record. When it ends the results go into `stats` (if given) and
+        together into the last_* attributes, so those always describe one call.
+        """
+        outer = getattr(self._local, "run", None)
+        run = self._local.run = {"trace": None, "generation_stats": {}, "context_stats": {},
+                                 "retrieval_timings": {}, "rerank_timings": {}}
+        try:
+            with span("query", method=method, top_k=top_k) as trace:
+                run["trace"] = trace
+                count("rag_queries_total", method=method)
+                yield
+        finally:
+            self._local.run = outer
+            if stats is not None:
+                stats.update(run)
+            with self._lock:
+                for name, value in run.items():
+                    setattr(self, "last_" + name, value)
+
+    def build_context(self, docs, query):
+        """Pack ranked docs into the generator's token budget; stats are recorded as context_stats."""
+        with span("prompt_build") as s:
+            context, stats = self.context_builder.build(docs, self.build_prompt, query)
+            s.attrs.update(chunks=stats["chunks"], tokens=stats["tokens"])
+        self._record(context_stats=stats)
+        logger.debug("Context: %d/%d chunks, %d/%d tokens (%d merged, %d dropped)", stats["chunks"],
+                     stats["candidates"], stats["tokens"], stats["budget"], stats["merged"], stats["dropped"])
+        return context
 
     def build_prompt(self, context, query):
         return f"""Answer the question using only the following context.
@@ -64,85 +233,147 @@ Context:
 Question: {query}
 Answer:"""
 
-    def retrieve(self, query, top_k, sources):
-        docs = []
-        if "user" in sources and self.user_vectorstore:
-            if self.use_bm25 and self.bm25_user:
-                scores = self.bm25_user.get_scores(query.split())
-                indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_k]
-                docs += [self.user_vectorstore.texts[i] for i in indices]
-            else:
-                docs += self.user_vectorstore.search(query, top_k)
-        if "db" in sources and self.db_vectorstore:
-            if self.use_bm25 and self.bm25_db:
-                scores = self.bm25_db.get_scores(query.split())
-                indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_k]
-                docs += [self.db_vectorstore.texts[i] for i in indices]
-            else:
-                docs += self.db_vectorstore.search(query, top_k)
+    def retrieve(self, query, top_k, sources, query_embedding=None):
+        """One ranked, deduplicated list across sources (dense, or dense + BM25 fused)."""
+        with self._lock:
+            if self.use_bm25 and self.bm25_user is None and self.bm25_db is None:
+                self.refresh_bm25()
+        stores = []
+        if "user" in sources:
+            stores.append(("user", self.user_vectorstore, self.bm25_user if self.use_bm25 else None))
+        if "db" in sources:
+            stores.append(("db", self.db_vectorstore, self.bm25_db if self.use_bm25 else None))
+        with span("retrieve", mode=self.retrieval_mode()):
+            docs, timings = self.retriever.retrieve(query, top_k, stores, query_embedding)
+            # The retriever times its stages on a thread pool; attach them here
+            for stage, seconds in timings.items():
+                kind, _, source = stage.partition(":")
+                if kind != "total":
+                    add_span("search" if kind == "dense" else kind, seconds, **({"source": source} if source else {}))
+        self._record(retrieval_timings=timings)
         return docs
 
+    def retrieval_mode(self):
+        mode = f"hybrid-{self.retriever.fusion}" if self.use_bm25 else "dense"
+        return f"{mode}+{self.reranker.model_name}" if self.use_reranker else mode
+
+    def candidate_count(self, top_k, sources):
+        # The reranker picks top_k from as many candidates as top_k per source used to give it
+        if not self.use_reranker:
+            return top_k
+        return max(top_k, min(top_k * max(1, len(sources)), self.reranker.max_candidates))
+
     def rerank_docs(self, query, docs, top_k):
-        if not self.reranker or not docs:
+        if not self.use_reranker or not docs:
             return docs[:top_k]
-        pairs = [(query, doc["text"]) for doc in docs]
-        scores = self.reranker.predict(pairs)
-        sorted_docs = [doc for _, doc in sorted(zip(scores, docs), reverse=True)]
-        return sorted_docs[:top_k]
-
-    def safe_chunk(self, text):
-        tokens = self.tokenizer.encode(text, truncation=False)
-        chunks = []
-        for i in range(0, len(tokens), self.max_model_tokens):
-            chunk_text = self.tokenizer.decode(tokens[i:i+self.max_model_tokens], skip_special_tokens=True)
-            chunks.append(chunk_text)
-        return chunks
+        timings = {}
+        with span("rerank", candidates=len(docs)):
+            docs = self.reranker.rerank(query, docs, top_k, timings=timings)
+        self._record(rerank_timings=timings)
+        return docs
+
+    def generate(self, prompt, max_length=200, temperature=0.0, do_sample=False):
+        """Blocking generation of one prompt."""
+        with span("generate", streamed=False):
+            if self.scheduler is not None:
+                return self.scheduler.generate(prompt, max_length, temperature, do_sample)
+            output = self.generator(prompt, **generation_kwargs(max_length, temperature, do_sample))
+            return output[0].get("generated_text","").strip()
+
+    def generate_stream(self, prompt, max_length=200, temperature=0.0, do_sample=False):
+        """Stream one prompt; TTFT and tokens/s are recorded as generation_stats."""
+        return self._drain(*self._open_stream(prompt, max_length, temperature, do_sample))
+
+    def _open_stream(self, prompt, max_length, temperature, do_sample):
+        # The scheduler queues the prompt right away; direct streaming starts on first read
+        stats = {}
+        if self.scheduler is not None:
+            pieces = self.scheduler.stream(prompt, max_length, temperature, do_sample, stats=stats)
+        else:
+            pieces = stream_generate(self.generator, prompt, max_length, temperature, do_sample, stats=stats)
+        return pieces, stats
+
+    def _drain(self, pieces, stats):
+        with span("generate", streamed=True) as s:
+            yield from pieces
+            s.attrs.update(tokens=stats.get("tokens", 0), ttft_s=round(stats.get("ttft_s", 0.0), 4))
+        observe("rag_generation_ttft_seconds", stats.get("ttft_s", 0.0))
+        self._record(generation_stats=stats)
+        logger.debug("Generate: TTFT %.2fs, %d tokens @ %.1f tok/s",
+                     stats["ttft_s"], stats["tokens"], stats["tokens_per_s"])
+
+    def _stream_prompts(self, prompts, max_length, temperature, do_sample):
+        # Open every stream first so the scheduler can batch the prompts together
+        streams = [self._open_stream(prompt, max_length, temperature, do_sample) for prompt in prompts]
+        for n, stream in enumerate(streams):
+            if n:
+                yield " "
+            yield from self._drain(*stream)
 
     def answer(self, query, top_k=3, max_length=200, temperature=0.0, do_sample=False,
-               sources=["user","db"], concat_chunks=True):
-        doc_ids = [d["meta"].get("doc_name","") for d in (self.user_vectorstore.texts if self.user_vectorstore else [])]
-        doc_hash = hashlib.sha256("".join(doc_ids).encode()).hexdigest()
+               sources=["user","db"], concat_chunks=True, stats=None):
+        """
+        `stats` (a dict) gets this call's trace, generation_stats,
+        context_stats, retrieval_timings and rerank_timings; use it instead of
+        the last_* attributes when several calls run at once.
+        """
+        return "".join(self.stream_answer(query, top_k, max_length, temperature, do_sample,
+                                          sources, concat_chunks, stats)).strip()
+
+    def stream_answer(self, query, top_k=3, max_length=200, temperature=0.0, do_sample=False,
+                      sources=["user","db"], concat_chunks=True, stats=None):
+        """Like answer(), but yields the answer in pieces as it is generated. Stages go to last_trace."""
+        with self._run("rag", top_k, stats):
+            yield from self._stream_answer(query, top_k, max_length, temperature, do_sample, sources, concat_chunks)
 
+    def _stream_answer(self, query, top_k, max_length, temperature, do_sample, sources, concat_chunks):
         cache_key = {"query": query, "sources": sources, "top_k": top_k, "max_length": max_length,
-                     "temperature": temperature, "do_sample": do_sample, "doc_hash": doc_hash}
+                     "temperature": temperature, "do_sample": do_sample, "concat_chunks": concat_chunks,
+                     "retrieval": self.retrieval_mode()}
 
+        query_embedding = None
         if self.cache_enabled:
-            cached = self.cache.get(cache_key)
+            with span("cache_lookup"):
+                version = self.corpus_version()
+                cached = self.cache.get(cache_key, version)
+                count("rag_cache_lookups_total", cache="answer", result="hit" if cached else "miss")
+                if not cached:
+                    scope = {k: v for k, v in cache_key.items() if k != "query"}
+                    scope["corpus_version"] = version
+                    cached, query_embedding = self._semantic_lookup(query, scope)
+                    if cached:
+                        self.cache.set(cache_key, cached, version)
             if cached:
-                return cached
+                self._record(generation_stats={"cached": True})
+                yield cached
+                return
 
-        retrieved_docs = self.retrieve(query, top_k, sources)
+        retrieved_docs = self.retrieve(query, self.candidate_count(top_k, sources), sources,
+                                       query_embedding=query_embedding)
         retrieved_docs = self.rerank_docs(query, retrieved_docs, max(1, top_k))
 
         if not retrieved_docs:
-            return "No such as information"
-
-        all_chunks = []
-        for doc in retrieved_docs:
-            all_chunks.extend(self.safe_chunk(doc["text"]))
+            yield "No such as information"
+            return
 
         if concat_chunks:
-            context = "\n\n".join(
-                [f"[{doc['meta'].get('doc_name','unknown')}] {doc['text']}" for doc in retrieved_docs[:3]]
-            )
-            prompt = self.build_prompt(context, query)
-            output = self.generator(prompt, max_new_tokens=max_length)
-            combined = output[0].get("generated_text","").strip()
+            prompts = [self.build_prompt(self.build_context(retrieved_docs, query), query)]
         else:
-            combined = ""
-            for doc in retrieved_docs[:3]:
-                context = f"[{doc['meta'].get('doc_name','unknown')}] {doc['text']}"
-                prompt = self.build_prompt(context, query)
-                output = self.generator(prompt, max_new_tokens=max_length)
-                combined += output[0].get("generated_text","").strip() + " "
+            prompts = [self.build_prompt(self.build_context([doc], query), query) for doc in retrieved_docs[:3]]
 
-        if self.cache_enabled:
-            self.cache.set(cache_key, combined)
+        pieces = []
+        for piece in self._stream_prompts(prompts, max_length, temperature, do_sample):
+            pieces.append(piece)
+            yield piece
+        combined = "".join(pieces).strip()
 
-        return combined
+        if self.cache_enabled:
+            self.cache.set(cache_key, combined, version)
+            if query_embedding is not None:
+                self.semantic_cache.add(query_embedding, scope, query, combined)
 
     def hyde_answer(self, query, top_k=3, max_length=200, temperature=0.0, do_sample=False,
-                    sources=["user","db"], pseudo_max_tokens=50):
+                    sources=["user","db"], pseudo_max_tokens=50, stats=None):
         """
         HyDE approach:
         1. Generate hypothetical answer
@@ -152,44 +383,62 @@ Answer:"""
         Parameters:
             pseudo_max_tokens: Max tokens to generate the pseudo-answer
             top_k: Number of documents to retrieve using pseudo-answer
+            stats: Dict for this call's results, as in answer()
         """
+        return "".join(self.stream_hyde_answer(query, top_k, max_length, temperature, do_sample,
+                                               sources, pseudo_max_tokens, stats)).strip()
+
+    def stream_hyde_answer(self, query, top_k=3, max_length=200, temperature=0.0, do_sample=False,
+                           sources=["user","db"], pseudo_max_tokens=50, stats=None):
+        """Like hyde_answer(); the pseudo-answer is generated in full, the final answer is streamed."""
+        with self._run("hyde", top_k, stats):
+            yield from self._stream_hyde_answer(query, top_k, max_length, temperature, do_sample,
+                                                sources, pseudo_max_tokens)
+
+    def _stream_hyde_answer(self, query, top_k, max_length, temperature, do_sample, sources, pseudo_max_tokens):
+        cache_key = {"query": query, "method": "hyde", "sources": sources, "top_k": top_k,
+                     "max_length": max_length, "pseudo_max_tokens": pseudo_max_tokens,
+                     "temperature": temperature, "do_sample": do_sample, "retrieval": self.retrieval_mode()}
+
+        # Check the cache before spending two generations
+        if self.cache_enabled:
+            with span("cache_lookup"):
+                version = self.corpus_version()
+                cached = self.cache.get(cache_key, version)
+                count("rag_cache_lookups_total", cache="answer", result="hit" if cached else "miss")
+            if cached:
+                self._record(generation_stats={"cached": True})
+                yield cached
+                return
+
         # Step 1: Generate hypothetical answer
         hypo_prompt = f"Generate a concise answer for the question, without external context:\nQuestion: {query}\nAnswer:"
-        hypo_output = self.generator(hypo_prompt, max_new_tokens=pseudo_max_tokens)
-        pseudo_answer = hypo_output[0].get("generated_text","").strip()
+        pseudo_answer = self.generate(hypo_prompt, pseudo_max_tokens, temperature, do_sample)
 
         # Step 2: Retrieve documents using pseudo-answer
-        retrieved_docs = self.retrieve(pseudo_answer, top_k, sources)
+        retrieved_docs = self.retrieve(pseudo_answer, self.candidate_count(top_k, sources), sources)
         retrieved_docs = self.rerank_docs(pseudo_answer, retrieved_docs, max(1, top_k))
 
         if not retrieved_docs:
-            return "No such as information"
+            yield "No such as information"
+            return
 
         # Step 3: Generate final answer using retrieved docs
-        context = "\n\n".join(
-            [f"[{doc['meta'].get('doc_name','unknown')}] {doc['text']}" for doc in retrieved_docs[:3]]
-        )
+        context = self.build_context(retrieved_docs, query)
         final_prompt = self.build_prompt(context, query)
-        output = self.generator(final_prompt, max_new_tokens=max_length)
-        final_answer = output[0].get("generated_text","").strip()
-
-        # Cache key
-        doc_ids = [d["meta"].get("doc_name","") for d in (self.user_vectorstore.texts if self.user_vectorstore else [])]
-        doc_hash = hashlib.sha256("".join(doc_ids).encode()).hexdigest()
-        cache_key = {"query": query, "method": "hyde", "sources": sources, "top_k": top_k,
-                     "max_length": max_length, "pseudo_max_tokens": pseudo_max_tokens,
-                     "temperature": temperature, "do_sample": do_sample,
-                     "doc_hash": doc_hash}
+        pieces = []
+        for piece in self.generate_stream(final_prompt, max_length, temperature, do_sample):
+            pieces.append(piece)
+            yield piece
 
         if self.cache_enabled:
-            self.cache.set(cache_key, final_answer)
-
-        return final_answer
+            self.cache.set(cache_key, "".join(pieces).strip(), version)
 
     def clear_cache(self):
-        if os.path.exists(self.cache.filename):
-            try:
-                os.remove(self.cache.filename)
-                print(f"[Cache] {self.cache.filename} deleted.")
-            except Exception as e:
-                print(f"[Cache] Could not clear cache: {e}")
+        try:
+            self.cache.clear()
+            if self.semantic_cache is not None:
+                self.semantic_cache.clear()
+            print(f"[Cache] {self.cache.path} cleared.")
+        except Exception as e:
+            print(f"[Cache] Could not clear cache: {e}")
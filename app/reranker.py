@@ -0,0 +1,132 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from app.model_registry import registry, acquire_reranker, reranker_key, RERANKER_MODEL
+from app.metrics import count
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def lexical_score(query, text):
+    """Share of query words that occur in `text`; a cheap first-stage score."""
+    query_words = set(_WORD_RE.findall(query.casefold()))
+    if not query_words:
+        return 0.0
+    return len(query_words & set(_WORD_RE.findall(text.casefold()))) / len(query_words)
+
+
+class Reranker:
+    """
+    Cross-encoder reranking with a score cache and an optional cascade.
+
+    - At most `max_candidates` docs are considered.
+    - With `cascade_top_m`, candidates are first ordered by a cheap score
+      (the retriever's fused score when present, else lexical overlap) and
+      only the top M go through the cross-encoder; the rest keep their order
+      behind them.
+    - Cross-encoder scores are cached in an LRU keyed by
+      (query hash, source, chunk id), so repeated and HyDE/RAG comparison
+      queries do not rescore the same pairs.
+
+    Stage latencies of the last call are in `last_timings`.
+    """
+
+    def __init__(self, model_name=RERANKER_MODEL, batch_size=32, max_length=256, max_candidates=50,
+                 cascade_top_m=None, cache_size=20_000):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.max_candidates = max_candidates
+        self.cascade_top_m = cascade_top_m
+        self.cache_size = cache_size
+        self._model = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.last_timings = {}
+
+    @property
+    def model(self):
+        # Loaded on the first rerank, not when the checkbox is ticked
+        if self._model is None:
+            self._model = acquire_reranker(self.model_name, self.max_length)
+        return self._model
+
+    def close(self):
+        if self._model is not None:
+            self._model = None
+            registry.release(reranker_key(self.model_name, self.max_length))
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _doc_key(query_hash, doc):
+        if doc.get("id") is None:
+            # Chunks without an id (e.g. graph context) are keyed by content
+            return query_hash, None, hashlib.sha1(doc["text"].encode("utf-8")).hexdigest()
+        return query_hash, doc.get("source"), doc["id"]
+
+    def rerank(self, query, docs, top_k, timings=None):
+        """Top `top_k` of `docs` by cross-encoder score; stage timings also go into `timings` (a dict)."""
+        timings = {} if timings is None else timings
+        docs = docs[:self.max_candidates]
+        if not docs:
+            self.last_timings = timings
+            return []
+
+        t0 = time.perf_counter()
+        if self.cascade_top_m and len(docs) > self.cascade_top_m:
+            if all("score" in doc for doc in docs):
+                cheap = [doc["score"] for doc in docs]
+            else:
+                cheap = [lexical_score(query, doc["text"]) for doc in docs]
+            order = sorted(range(len(docs)), key=lambda i: -cheap[i])
+            head = [docs[i] for i in order[:self.cascade_top_m]]
+            tail = [docs[i] for i in order[self.cascade_top_m:]]
+        else:
+            head, tail = docs, []
+        timings["cheap"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        query_hash = hashlib.sha1(query.encode("utf-8")).hexdigest()
+        keys = [self._doc_key(query_hash, doc) for doc in head]
+        scores = [None] * len(head)
+        with self._lock:
+            for i, key in enumerate(keys):
+                score = self._cache.get(key)
+                if score is not None:
+                    self._cache.move_to_end(key)
+                    scores[i] = score
+        missing = [i for i, score in enumerate(scores) if score is None]
+        timings["cache"] = time.perf_counter() - t0
+        timings["cache_hits"] = len(head) - len(missing)
+        count("rag_cache_lookups_total", timings["cache_hits"], cache="rerank", result="hit")
+        count("rag_cache_lookups_total", len(missing), cache="rerank", result="miss")
+
+        t0 = time.perf_counter()
+        if missing:
+            pairs = [(query, head[i]["text"]) for i in missing]
+            predicted = self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+            with self._lock:
+                for i, score in zip(missing, predicted):
+                    scores[i] = float(score)
+                    self._cache[keys[i]] = scores[i]
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        timings["cross_encoder"] = time.perf_counter() - t0
+        timings["pairs_scored"] = len(missing)
+
+        # Sort on the score alone; ties keep retrieval order
+        order = sorted(range(len(head)), key=lambda i: -scores[i])
+        ranked = [{**head[i], "rerank_score": scores[i]} for i in order] + tail
+        self.last_timings = timings
+        return ranked[:top_k]
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
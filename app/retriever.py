@@ -0,0 +1,129 @@
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# FAISS and the NumPy BM25 scoring release the GIL, so threads overlap them
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="retriever")
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def _shingles(text):
+    return set(_WORD_RE.findall(text.casefold()))
+
+
+class HybridRetriever:
+    """
+    Dense + BM25 retrieval over several stores, fused into one ranked list.
+
+    For every source, dense (FAISS) and BM25 candidates are fetched in
+    parallel, `candidate_factor` x top_k of each. All candidate lists are
+    fused with reciprocal-rank fusion ("rrf") or with min-max normalized,
+    weighted scores ("weighted"). Near-duplicate chunks (the same text in two
+    stores, or chunks mostly covered by a better-ranked one) are dropped.
+
+    retrieve() returns (docs, timings); each doc is the stored chunk plus
+    "source" and "score".
+    """
+
+    def __init__(self, fusion="rrf", rrf_k=60, dense_weight=0.5, bm25_weight=0.5,
+                 candidate_factor=4, dedup_threshold=0.8):
+        if fusion not in ("rrf", "weighted"):
+            raise ValueError(f"Unknown fusion '{fusion}'; expected 'rrf' or 'weighted'")
+        self.fusion = fusion
+        self.rrf_k = rrf_k
+        self.dense_weight = dense_weight
+        self.bm25_weight = bm25_weight
+        self.candidate_factor = candidate_factor
+        self.dedup_threshold = dedup_threshold
+
+    def retrieve(self, query, top_k, stores, query_embedding=None, dense=True):
+        """
+        stores: list of (source name, VectorStore, BM25Index or None).
+        dense=False ranks by BM25 only (where an index exists).
+        """
+        timings = {}
+        start = time.perf_counter()
+        stores = [(name, store, bm25) for name, store, bm25 in stores if store is not None and store.texts]
+        if not stores:
+            return [], timings
+        n_candidates = max(top_k * self.candidate_factor, top_k)
+
+        # Stores without a BM25 index always fall back to dense search
+        use_dense = {name: dense or not bm25 for name, _, bm25 in stores}
+        if any(use_dense.values()) and query_embedding is None:
+            t0 = time.perf_counter()
+            query_embedding = stores[0][1].embed_query(query)
+            timings["embed"] = time.perf_counter() - t0
+
+        def timed(stage, fn, *args):
+            t0 = time.perf_counter()
+            result = fn(*args)
+            return stage, result, time.perf_counter() - t0
+
+        futures = []
+        for name, store, bm25 in stores:
+            if use_dense[name]:
+                futures.append((name, "dense", _executor.submit(
+                    timed, f"dense:{name}", store.search_ids, query, n_candidates, None, None, query_embedding)))
+            if bm25:
+                futures.append((name, "bm25", _executor.submit(
+                    timed, f"bm25:{name}", bm25.top_k, query, n_candidates)))
+
+        ranked_lists = []
+        for name, kind, future in futures:
+            stage, (ids, scores), seconds = future.result()
+            timings[stage] = seconds
+            ranked_lists.append((name, kind, ids, scores))
+
+        t0 = time.perf_counter()
+        fused = self._fuse(ranked_lists)
+        timings["fuse"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        store_by_name = {name: store for name, store, _ in stores}
+        docs = self._dedup(fused, store_by_name, top_k)
+        timings["dedup"] = time.perf_counter() - t0
+        timings["total"] = time.perf_counter() - start
+        return docs, timings
+
+    def _fuse(self, ranked_lists):
+        """[((source, chunk id), fused score)] best first."""
+        fused = {}
+        for name, kind, ids, scores in ranked_lists:
+            if not len(ids):
+                continue
+            if self.fusion == "rrf":
+                contributions = 1.0 / (self.rrf_k + np.arange(1, len(ids) + 1))
+            else:
+                weight = self.dense_weight if kind == "dense" else self.bm25_weight
+                low, high = float(scores.min()), float(scores.max())
+                spread = high - low
+                contributions = weight * ((scores - low) / spread if spread > 0 else np.ones(len(scores)))
+            for chunk_id, contribution in zip(ids.tolist(), contributions.tolist()):
+                key = (name, chunk_id)
+                fused[key] = fused.get(key, 0.0) + contribution
+        # Ties broken by source and chunk id so the order is deterministic
+        return sorted(fused.items(), key=lambda item: (-item[1], item[0]))
+
+    def _dedup(self, fused, store_by_name, top_k):
+        docs, kept = [], []
+        for (name, chunk_id), score in fused:
+            doc = store_by_name[name].texts.get(chunk_id)
+            if doc is None:
+                continue
+            words = _shingles(doc["text"])
+            if any(self._overlaps(words, other) for other in kept):
+                continue
+            kept.append(words)
+            docs.append({**doc, "source": name, "score": score})
+            if len(docs) == top_k:
+                break
+        return docs
+
+    def _overlaps(self, a, b):
+        # Share of the smaller chunk's words found in the other one
+        if not a or not b:
+            return a == b
+        return len(a & b) / min(len(a), len(b)) >= self.dedup_threshold
@@ -0,0 +1,210 @@
+import json
+import os
+import shutil
+import faiss
+import numpy as np
+from app.chunk_store import ChunkStore, chunk_dir, docs_file
+from app.utils import atomic_write, file_lock
+
+MANIFEST = "manifest.json"
+SEGMENT_DIR = "segments"
+LOCK_FILE = ".lock"
+
+
+class SegmentStore:
+    """
+    Append-only on-disk layout used by VectorStore:
+
+        manifest.json       committed state, atomically replaced on every save
+        segments/seg-*.npy  float32 vector blocks, memory-mapped on load
+        chunks-*/           ChunkStore columns, tombstones and docs-*.json,
+                            one row per vector
+        segments/index-*.faiss
+                            optional FAISS snapshot covering the first N vectors
+
+    A save only writes the new vectors, chunk rows and tombstones, then swaps
+    in a new manifest. Anything written after the last manifest (an
+    interrupted save) is ignored on load and overwritten or removed by the
+    next save / compaction. Compaction drops deleted chunks from both the
+    vector segments and the chunk columns.
+
+    Writers hold lock() around reset / append / compact and call refresh()
+    first: append() and compact() refuse to run on a manifest that another
+    writer has replaced since it was read.
+    """
+
+    def __init__(self, path, dimension, max_segments=16, max_deleted_ratio=0.2):
+        self.path = path
+        self.dimension = dimension
+        self.max_segments = max_segments
+        self.max_deleted_ratio = max_deleted_ratio
+        self.manifest = self._read_manifest()
+
+    def _file(self, *parts):
+        return os.path.join(self.path, *parts)
+
+    def _read_manifest(self):
+        manifest_path = self._file(MANIFEST)
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def lock(self, shared=False):
+        """Exclusive (writers) or shared (readers) lock on the store directory."""
+        return file_lock(self._file(LOCK_FILE), shared)
+
+    def refresh(self):
+        """Re-read the manifest; returns True if another writer committed since."""
+        manifest = self._read_manifest()
+        changed = manifest != self.manifest
+        self.manifest = manifest
+        return changed
+
+    def _check_current(self):
+        if self._read_manifest() != self.manifest:
+            raise RuntimeError(f"{self.path} was changed by another writer; refresh() and reload first")
+
+    def _write_manifest(self, manifest):
+        data = json.dumps(manifest, indent=2).encode("utf-8")
+        atomic_write(self._file(MANIFEST), lambda f: f.write(data))
+        self.manifest = manifest
+
+    def _empty_manifest(self):
+        return {"format": 4, "dimension": self.dimension, "count": 0, "segments": [],
+                "snapshot": None, "next_segment": 1, **ChunkStore().state()}
+
+    @property
+    def exists(self):
+        return self.manifest is not None
+
+    @property
+    def count(self):
+        return self.manifest["count"] if self.manifest else 0
+
+    def reset(self):
+        """Forget everything on disk; the next append starts a new store."""
+        manifest_path = self._file(MANIFEST)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        self.manifest = None
+        self._remove_unreferenced()
+
+    def segments(self):
+        """Yield the committed vector segments, memory-mapped, in insertion order."""
+        for seg in (self.manifest or {}).get("segments", []):
+            yield np.load(self._file(SEGMENT_DIR, seg["file"]), mmap_mode="r")
+
+    def chunks(self):
+        """ChunkStore holding the committed chunk rows."""
+        if not self.manifest:
+            return ChunkStore()
+        return ChunkStore.open(self.path, self.manifest)
+
+    def snapshot(self):
+        """(path, vector count) of the persisted FAISS index, or None."""
+        snap = (self.manifest or {}).get("snapshot")
+        if not snap:
+            return None
+        return self._file(SEGMENT_DIR, snap["file"]), snap["count"]
+
+    def append(self, vectors, chunks):
+        """Commit `vectors` (the ones not yet on disk) together with `chunks`."""
+        self._check_current()
+        manifest = dict(self.manifest or self._empty_manifest())
+        manifest["segments"] = list(manifest["segments"])
+        if manifest["count"] + len(vectors) != chunks.num_rows:
+            raise ValueError("vector and chunk counts are out of sync")
+        os.makedirs(self._file(SEGMENT_DIR), exist_ok=True)
+
+        if len(vectors):
+            seq = manifest["next_segment"]
+            name = f"seg-{seq:06d}.npy"
+            block = np.ascontiguousarray(vectors, dtype=np.float32)
+            atomic_write(self._file(SEGMENT_DIR, name), lambda f: np.save(f, block))
+            manifest["segments"].append({"file": name, "count": len(vectors)})
+            manifest["count"] += len(vectors)
+            manifest["next_segment"] = seq + 1
+
+        chunks.write(self.path)
+        manifest.update(chunks.state())
+        self._write_manifest(manifest)
+        self._remove_unreferenced()
+
+    def needs_compaction(self):
+        if not self.manifest:
+            return False
+        deleted = self.manifest.get("tombstone_count", 0)
+        return (len(self.manifest["segments"]) > self.max_segments
+                or deleted > self.max_deleted_ratio * max(1, self.manifest["count"]))
+
+    def compact(self, chunks, index=None):
+        """
+        Merge all segments into one, dropping deleted rows from the vectors and
+        from `chunks` (which must be fully committed). If `index` holds exactly
+        the live vectors it is persisted as the new snapshot.
+        """
+        self._check_current()
+        manifest = dict(self.manifest)
+        seq = manifest["next_segment"]
+        name = f"seg-{seq:06d}.npy"
+        live = chunks.live_rows()
+        total = int(live.sum())
+
+        tmp_path = self._file(SEGMENT_DIR, name + ".tmp")
+        merged = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32,
+                                           shape=(total, self.dimension))
+        row = pos = 0
+        for seg in self.segments():
+            keep = live[row:row + len(seg)]
+            merged[pos:pos + int(keep.sum())] = seg[keep]
+            row += len(seg)
+            pos += int(keep.sum())
+        merged.flush()
+        del merged
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._file(SEGMENT_DIR, name))
+
+        chunks.compact(self.path)
+        manifest.update(chunks.state())
+        manifest["count"] = total
+        manifest["segments"] = [{"file": name, "count": total}] if total else []
+        manifest["next_segment"] = seq + 1
+        # Row positions changed, so an older snapshot no longer lines up
+        manifest["snapshot"] = None
+        if index is not None and index.ntotal == total:
+            snap_name = f"index-{seq:06d}.faiss"
+            snap_tmp = self._file(SEGMENT_DIR, snap_name + ".tmp")
+            faiss.write_index(index, snap_tmp)
+            with open(snap_tmp, "rb") as f:
+                os.fsync(f.fileno())
+            os.replace(snap_tmp, self._file(SEGMENT_DIR, snap_name))
+            manifest["snapshot"] = {"file": snap_name, "count": total}
+        self._write_manifest(manifest)
+        self._remove_unreferenced()
+        print(f"[SegmentStore] Compacted {self.path} into one segment of {total} vectors.")
+
+    def _remove_unreferenced(self):
+        manifest = self.manifest or {}
+        seg_dir = self._file(SEGMENT_DIR)
+        if os.path.isdir(seg_dir):
+            keep = {seg["file"] for seg in manifest.get("segments", [])}
+            snap = manifest.get("snapshot")
+            if snap:
+                keep.add(snap["file"])
+            for name in os.listdir(seg_dir):
+                if name not in keep:
+                    os.remove(os.path.join(seg_dir, name))
+        if not os.path.isdir(self.path):
+            return
+        current = manifest.get("chunk_generation")
+        current_dir = chunk_dir(current) if current is not None else None
+        for name in os.listdir(self.path):
+            if name.startswith("chunks-") and name != current_dir:
+                shutil.rmtree(self._file(name))
+        if current_dir and os.path.isdir(self._file(current_dir)):
+            keep = docs_file(manifest["docs_version"])
+            for name in os.listdir(self._file(current_dir)):
+                if name.startswith("docs-") and name != keep:
+                    os.remove(self._file(current_dir, name))
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+import faiss
+import numpy as np
+
+
+class SemanticCache:
+    """
+    Reuse answers for near-duplicate questions.
+
+    Query embeddings are kept in a small FAISS inner-product index per scope
+    (sources, top_k, generation settings and corpus version), so a lookup only
+    ever compares against questions that were answered under the same
+    conditions. A hit needs cosine similarity >= `threshold`, which callers
+    can override per lookup (the instance is shared across sessions, so it is
+    never changed for one of them); embeddings are expected to be normalized,
+    as produced by VectorStore.embed.
+    """
+
+    def __init__(self, dimension=384, threshold=0.92, max_entries=1000, max_scopes=64):
+        self.dimension = dimension
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_scopes = max_scopes
+        self._scopes = OrderedDict()  # scope hash -> (index, [(query, answer)])
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+
+    @staticmethod
+    def scope(scope_dict):
+        raw = json.dumps(scope_dict, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, embedding, scope_dict, threshold=None):
+        """Return (answer, similarity, cached query) for the closest match, or None."""
+        threshold = self.threshold if threshold is None else threshold
+        scope = self.scope(scope_dict)
+        vector = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        with self._lock:
+            self.lookups += 1
+            entry = self._scopes.get(scope)
+            if entry is None or entry[0].ntotal == 0:
+                return None
+            self._scopes.move_to_end(scope)
+            index, answers = entry
+            scores, positions = index.search(vector, 1)
+            similarity, position = float(scores[0][0]), int(positions[0][0])
+            if position < 0 or similarity < threshold:
+                return None
+            self.hits += 1
+            query, answer = answers[position]
+            return answer, similarity, query
+
+    def add(self, embedding, scope_dict, query, answer):
+        scope = self.scope(scope_dict)
+        vector = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        with self._lock:
+            entry = self._scopes.get(scope)
+            if entry is None:
+                entry = (faiss.IndexFlatIP(self.dimension), [])
+                self._scopes[scope] = entry
+                while len(self._scopes) > self.max_scopes:
+                    self._scopes.popitem(last=False)
+            self._scopes.move_to_end(scope)
+            index, answers = entry
+            if index.ntotal >= self.max_entries:
+                # Keep the newer half; flat indexes are cheap to rebuild at this size
+                keep = self.max_entries // 2
+                vectors = index.reconstruct_n(index.ntotal - keep, keep) if keep else None
+                index.reset()
+                if keep:
+                    index.add(vectors)
+                answers[:] = answers[len(answers) - keep:]
+            index.add(vector)
+            answers.append((query, answer))
+
+    def clear(self):
+        with self._lock:
+            self._scopes.clear()
+
+    def stats(self):
+        return {
+            "lookups": self.lookups,
+            "saved_generations": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+            "entries": sum(index.ntotal for index, _ in self._scopes.values()),
+        }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_semantic_cache(dimension=384, **kwargs):
+    """One SemanticCache per embedding dimension and process."""
+    with _caches_lock:
+        if dimension not in _caches:
+            _caches[dimension] = SemanticCache(dimension, **kwargs)
+        return _caches[dimension]
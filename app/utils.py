@@ -1,18 +1,193 @@
+import os
 import re
+import sqlite3
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 def clean_text(text: str) -> str:
     return " ".join(text.split())
 
-def chunk_text(text: str, chunk_size=300, overlap=50) -> list[str]:
-    sentences = re.split(r'(?<=[.!?])\s+', text.strip())
-    chunks = []
-    current_chunk = ""
-    for sentence in sentences:
-        if len(current_chunk) + len(sentence) <= chunk_size:
-            current_chunk += " " + sentence
+# Code points str.split() treats as whitespace; all of them are below U+3001
+_SPACE = np.array([chr(c).isspace() for c in range(0x3001)])
+_WORD_START = re.compile(r"(?<!\S)\S")
+_WORD_END = re.compile(r"\S(?!\S)")
+
+
+def sentence_bounds(text: str):
+    """
+    (starts, ends) character offsets of the sentences of `text`, found with
+    numpy over the code points in one pass instead of a regex split: a
+    sentence ends after . ! or ? followed by whitespace, and at the end of
+    the text. Returned as sorted lists for bisect.
+    """
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    n = len(codes)
+    space = codes == 32
+    # Only control characters and non-ASCII code points need the full table
+    rare = np.flatnonzero((codes < 32) | (codes > 126))
+    if len(rare):
+        rare_codes = codes[rare]
+        space[rare] = _SPACE[np.minimum(rare_codes, 0x3000)] & (rare_codes <= 0x3000)
+    content = np.flatnonzero(~space)
+    if not len(content):
+        return [], []
+    first, text_end = int(content[0]), int(content[-1]) + 1
+    punct = (codes == 46) | (codes == 33) | (codes == 63)
+    ends = np.flatnonzero(punct[:-1] & space[1:]) + 1
+    # The next sentence starts after the run of whitespace that follows
+    starts = ends + 1
+    pending = np.flatnonzero(starts < n)
+    pending = pending[space[starts[pending]]]
+    while len(pending):
+        starts[pending] += 1
+        pending = pending[starts[pending] < n]
+        pending = pending[space[starts[pending]]]
+    ends = ends[ends < text_end].tolist() + [text_end]
+    return [first] + starts[starts < text_end].tolist(), ends
+
+
+def token_starts(texts, tokenizer):
+    """
+    Character offset at which each token starts, per text, from one batched
+    call of a fast (Rust) Hugging Face tokenizer.
+    """
+    if not texts:
+        return []
+    encoded = tokenizer(list(texts), add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+    starts = []
+    for offsets in encoded["offset_mapping"]:
+        offsets = np.asarray(offsets, dtype=np.int64).reshape(-1, 2)
+        starts.append(np.sort(offsets[offsets[:, 1] > offsets[:, 0], 0]))
+    return starts
+
+
+def chunk_spans(text: str, chunk_size=300, overlap=50, starts=None) -> list[tuple[int, int]]:
+    """
+    (start, end) character offsets of overlapping chunks of `text`; no text
+    is copied. Sizes count characters, or tokens when `starts` holds the
+    token start offsets of `text` (see token_starts()).
+
+    A chunk ends on the last sentence end that fits in chunk_size, else on
+    the last word end; only a single word longer than chunk_size is cut.
+    The next chunk starts on the earliest sentence start, else word start,
+    that keeps its overlap with the previous chunk within `overlap`. If that
+    leaves no room for new text, it starts right after the previous chunk.
+    """
+    if overlap >= chunk_size:
+        raise ValueError("overlap must be smaller than chunk_size")
+    sentence_starts, sentence_ends = sentence_bounds(text)
+    if not sentence_ends:
+        return []
+    n, text_end = len(text), sentence_ends[-1]
+
+    def chunk_end(start):
+        if starts is None:
+            limit = start + chunk_size
         else:
-            chunks.append(current_chunk.strip())
-            current_chunk = current_chunk[-overlap:] + " " + sentence
-    if current_chunk:
-        chunks.append(current_chunk.strip())
-    return chunks
+            i = starts.searchsorted(start) + chunk_size
+            limit = max(int(starts[i]), start + 1) if i < len(starts) else n
+        i = bisect_right(sentence_ends, limit) - 1
+        if i >= 0 and sentence_ends[i] > start:
+            return sentence_ends[i]
+        # No whole sentence fits: end on the last word that does, or cut a too long word
+        end = limit
+        for m in _WORD_END.finditer(text, start, min(limit + 1, n)):
+            if m.end() <= limit:
+                end = m.end()
+        return end
+
+    def next_start(start, end, overlap):
+        if overlap:
+            if starts is None:
+                low = end - overlap
+            else:
+                low = int(starts[max(starts.searchsorted(end) - overlap, 0)])
+            low = max(low, start + 1)
+            i = bisect_left(sentence_starts, low)
+            if i < len(sentence_starts) and sentence_starts[i] < end:
+                return sentence_starts[i]
+            m = _WORD_START.search(text, low, end)
+            if m:
+                return m.start()
+        if not text[end].isspace() and not text[end - 1].isspace():
+            return end  # a too long word was cut here
+        return _WORD_START.search(text, end).start()
+
+    start = sentence_starts[0]
+    end = chunk_end(start)
+    spans = [(start, end)]
+    while end < text_end:
+        start = next_start(start, end, overlap)
+        new_end = chunk_end(start)
+        if new_end <= end:
+            # The overlap left no room for new text
+            start = next_start(start, end, 0)
+            new_end = chunk_end(start)
+        end = new_end
+        spans.append((start, end))
+    return spans
+
+
+def chunk_spans_batch(texts, chunk_size=300, overlap=50, tokenizer=None) -> list[list[tuple[int, int]]]:
+    """chunk_spans() for many texts; with a tokenizer, sizes are tokens and all texts are tokenized in one call."""
+    offsets = token_starts(texts, tokenizer) if tokenizer is not None else [None] * len(texts)
+    return [chunk_spans(text, chunk_size, overlap, starts) for text, starts in zip(texts, offsets)]
+
+
+def atomic_write(path: str, write_fn, mode="wb"):
+    """Write via a temp file + fsync + rename so readers never see a partial file."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, mode) as f:
+        write_fn(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_dir(os.path.dirname(path) or ".")
+
+def fsync_dir(path: str):
+    # Persist the rename itself; not supported on every platform (e.g. Windows)
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+@contextmanager
+def file_lock(path: str, shared=False):
+    """
+    Hold an flock() on `path` (created if missing): exclusive for writers,
+    shared for readers. Each call opens its own file description, so the
+    lock also excludes other threads of this process. No-op without fcntl.
+    """
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)  # releases the lock
+
+def connect_sqlite(path: str) -> sqlite3.Connection:
+    """
+    SQLite connection in WAL mode, so several processes / Streamlit sessions
+    can read while one writes. Autocommit; callers use explicit transactions.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
@@ -1,63 +1,316 @@
 import faiss
-from sentence_transformers import SentenceTransformer
 import numpy as np
 import os
 import json
+from app.model_registry import registry, acquire_embedder, embedder_key, EMBEDDING_MODEL
+from app.inference_backends import inference_backend
+from app.index_factory import build_index, index_type_of, search_params
+from app.segment_store import SegmentStore
+from app.chunk_store import ChunkStore
 
 class VectorStore:
-    def __init__(self, persist_path=None, load=False):
-        self.model = SentenceTransformer("sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+    def __init__(self, persist_path=None, load=False, model_name=EMBEDDING_MODEL,
+                 index_type="flat", promote_threshold=None, train_size=50_000,
+                 embedding_cache=None, **index_params):
+        """
+        index_type: target FAISS index ("flat", "ivf_flat", "ivf_pq" or "hnsw").
+            The store starts as an exact flat index and is promoted to the target
+            once it holds `promote_threshold` vectors (defaults to `train_size`).
+        train_size: number of leading vectors used to train IVF indexes.
+        embedding_cache: optional EmbeddingCache consulted before encoding chunks.
+        index_params: extra build_index() options such as nlist, pq_m or hnsw_m.
+        """
+        self.model_name = model_name
+        self.embedding_cache = embedding_cache
+        self._model = None
         self.dimension = 384
-        self.index = faiss.IndexFlatIP(self.dimension)
-        self.texts = []  # her eleman {"text": ..., "meta": {...}}
+        self.index_type = index_type
+        self.promote_threshold = promote_threshold
+        self.train_size = train_size
+        self.index_params = index_params
+        self.index = self._new_index("flat")
+        self.active_index_type = "flat"
+        self.texts = ChunkStore()  # texts[chunk_id] -> {"id": ..., "text": ..., "meta": {...}}
         self.persist_path = persist_path
+        self._store = None
+        self._pending_vectors = []  # embeddings of rows added since the last save()
+        self._unremoved = set()  # deleted ids the index could not drop (HNSW)
+        # (method name, args) of every change since the last save(), replayed on
+        # top of the store if another writer saved to the same path meanwhile
+        self._ops = []
         if persist_path and load:
             self.load()
 
+    @property
+    def model(self):
+        # Shared across every VectorStore in the process, loaded on first use
+        if self._model is None:
+            self._model = acquire_embedder(self.model_name)
+        return self._model
+
+    def close(self):
+        if self._model is not None:
+            self._model = None
+            registry.release(embedder_key(self.model_name))
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
     def normalize_embeddings(self, embeddings):
         norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
         norms[norms == 0] = 1
         return embeddings / norms
 
-    def add_texts(self, texts, metadata_list=None):
+    def _new_index(self, index_type, **kwargs):
+        # FAISS ids are the stable ChunkStore ids. IVF indexes store ids in their
+        # lists; flat and HNSW need an IndexIDMap. (An IndexIDMap around an IVF
+        # breaks on remove_ids: it compacts id_map while the IVF does not shift.)
+        index = build_index(index_type, self.dimension, **kwargs)
+        if index_type in ("ivf_flat", "ivf_pq"):
+            return index
+        return faiss.IndexIDMap(index)
+
+    def embed(self, texts, batch_size=64):
+        """Normalized float32 embeddings, as stored in the index."""
+        if self.embedding_cache is None:
+            return self._encode(texts, batch_size)
+        cache_name = self.cache_model_name()
+        cached = self.embedding_cache.get_many(cache_name, texts)
+        missing = [i for i, vec in enumerate(cached) if vec is None]
+        embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        if missing:
+            fresh = self._encode([texts[i] for i in missing], batch_size)
+            embeddings[missing] = fresh
+            self.embedding_cache.put_many(cache_name, [texts[i] for i in missing], fresh)
+        hit_rows = [i for i, vec in enumerate(cached) if vec is not None]
+        if hit_rows:
+            # float16 round-trip: renormalize so scores stay comparable
+            embeddings[hit_rows] = self.normalize_embeddings(np.stack([cached[i] for i in hit_rows]))
+        return embeddings
+
+    def cache_model_name(self):
+        # Quantized / ONNX vectors differ slightly from fp32; keep them apart in the cache
+        backend = inference_backend()
+        return self.model_name if backend == "torch" else f"{self.model_name}@{backend}"
+
+    def _encode(self, texts, batch_size):
+        embeddings = self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+        return self.normalize_embeddings(embeddings).astype(np.float32)
+
+    def add_texts(self, texts, metadata_list=None, embeddings=None):
+        """
+        Embed and add chunks; returns their chunk ids. Pass `embeddings`
+        (from embed()) when they were computed in a larger batch elsewhere.
+        """
         if not texts:
-            return
+            return []
         if metadata_list is None:
             metadata_list = [{} for _ in texts]
 
-        embeddings = self.model.encode(texts, convert_to_numpy=True)
-        embeddings = self.normalize_embeddings(embeddings).astype(np.float32)
-        self.index.add(embeddings)
+        if embeddings is None:
+            embeddings = self.embed(texts)
+        ids = self.texts.extend(texts, metadata_list)
+        self.index.add_with_ids(embeddings, np.array(ids, dtype=np.int64))
+        self._pending_vectors.append(embeddings)
+        self._ops.append(("add_texts", (texts, metadata_list, embeddings)))
+        self._maybe_promote()
+        return ids
 
-        for t, m in zip(texts, metadata_list):
-            self.texts.append({"text": t, "meta": m})
+    def delete_document(self, doc_name):
+        """Remove every chunk of `doc_name`; returns how many were removed."""
+        ids = self.texts.doc_chunk_ids(doc_name)
+        self.texts.delete(ids)
+        self.texts.set_content_hash(doc_name, None)
+        self._remove_from_index(ids)
+        self._ops.append(("delete_document", (doc_name,)))
+        return len(ids)
 
-    def search(self, query, top_k=3):
-        if not self.texts:
-            return []
-        query_embedding = self.model.encode([query], convert_to_numpy=True)
-        query_embedding = self.normalize_embeddings(query_embedding).astype(np.float32)
-        distances, indices = self.index.search(query_embedding, top_k)
-        if len(indices) == 0 or len(indices[0]) == 0:
+    def is_unchanged(self, doc_name, content_hash):
+        return (content_hash is not None and self.texts.content_hash(doc_name) == content_hash
+                and len(self.texts.doc_chunk_ids(doc_name)) > 0)
+
+    def upsert_document(self, doc_name, texts, metadata_list=None, content_hash=None, embeddings=None):
+        """
+        Replace the chunks of `doc_name` with `texts`. When `content_hash`
+        matches the stored one the document is left untouched and [] is
+        returned; otherwise the new chunk ids are returned.
+        """
+        if self.is_unchanged(doc_name, content_hash):
             return []
-        return [self.texts[i] for i in indices[0] if i < len(self.texts)]
+        self.delete_document(doc_name)
+        if metadata_list is None:
+            metadata_list = [{} for _ in texts]
+        metadata_list = [{**m, "doc_name": doc_name} for m in metadata_list]
+        ids = self.add_texts(texts, metadata_list, embeddings=embeddings)
+        self.set_content_hash(doc_name, content_hash)
+        return ids
+
+    def set_content_hash(self, doc_name, content_hash):
+        """Record the hash of the file `doc_name` was built from (see is_unchanged)."""
+        self.texts.set_content_hash(doc_name, content_hash)
+        self._ops.append(("set_content_hash", (doc_name, content_hash)))
+
+    def documents(self):
+        return self.texts.documents()
+
+    def _remove_from_index(self, ids):
+        if len(ids) == 0:
+            return
+        try:
+            self.index.remove_ids(np.asarray(ids, dtype=np.int64))
+        except RuntimeError:
+            # HNSW cannot remove vectors; they are filtered out of results instead
+            self._unremoved.update(int(i) for i in ids)
+
+    def _maybe_promote(self):
+        if self.index_type == "flat" or self.active_index_type != "flat":
+            return
+        threshold = self.promote_threshold if self.promote_threshold is not None else self.train_size
+        if self.index.ntotal < threshold:
+            return
+        flat = faiss.downcast_index(self.index.index)
+        vectors = flat.reconstruct_n(0, flat.ntotal)
+        ids = faiss.vector_to_array(self.index.id_map).astype(np.int64)
+        train = vectors[:self.train_size]
+        index = self._new_index(self.index_type, num_vectors=len(train), **self.index_params)
+        if not index.is_trained:
+            index.train(train)
+        index.add_with_ids(vectors, ids)
+        self.index = index
+        self.active_index_type = self.index_type
+        print(f"[VectorStore] Promoted flat index to {self.index_type} at {index.ntotal} vectors.")
+
+    def embed_query(self, query):
+        """Normalized (1, dimension) float32 query vector; queries bypass the embedding cache."""
+        return self._encode([query], batch_size=1)
+
+    def search(self, query, top_k=3, nprobe=None, ef_search=None, query_embedding=None):
+        """
+        nprobe / ef_search override the IVF / HNSW search breadth for this query
+        only; they are ignored while the store still uses a flat index.
+        Pass query_embedding (from embed_query) to skip encoding the query again.
+        """
+        ids, _ = self.search_ids(query, top_k, nprobe, ef_search, query_embedding)
+        docs = (self.texts.get(int(i)) for i in ids)
+        return [d for d in docs if d is not None]
+
+    def search_ids(self, query, top_k=3, nprobe=None, ef_search=None, query_embedding=None):
+        """(chunk ids, cosine scores) of the top_k live chunks, best first."""
+        if not self.texts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        if query_embedding is None:
+            query_embedding = self.embed_query(query)
+        params = search_params(self.active_index_type, nprobe, ef_search)
+        k = top_k + len(self._unremoved)
+        if params is None:
+            distances, indices = self.index.search(query_embedding, k)
+        else:
+            distances, indices = self.index.search(query_embedding, k, params=params)
+        # ANN indexes pad with -1 when fewer than k neighbours are found
+        hits = [(int(i), float(d)) for i, d in zip(indices[0], distances[0])
+                if i >= 0 and int(i) not in self._unremoved and int(i) in self.texts][:top_k]
+        return (np.array([i for i, _ in hits], dtype=np.int64),
+                np.array([d for _, d in hits], dtype=np.float32))
 
     def save(self):
+        """
+        Append everything changed since the last save; cost is O(changes).
+        If another VectorStore (session or process) saved to the same path
+        since this one loaded, its changes are reloaded first and this
+        store's unsaved changes are applied on top of them.
+        """
         if not self.persist_path:
             raise ValueError("persist_path is not set for VectorStore")
         os.makedirs(self.persist_path, exist_ok=True)
-        faiss.write_index(self.index, os.path.join(self.persist_path, "index.faiss"))
-        with open(os.path.join(self.persist_path, "texts.json"), "w", encoding="utf-8") as f:
-            json.dump(self.texts, f, ensure_ascii=False, indent=2)
+        fresh = self._store is None
+        if fresh:
+            self._store = SegmentStore(self.persist_path, self.dimension)
+        with self._store.lock():
+            if fresh:
+                # Not loaded from disk: like the old full rewrite, saving replaces what is there
+                self._store.reset()
+            elif self._store.refresh():
+                self._rebase()
+            if self._pending_vectors:
+                vectors = np.concatenate(self._pending_vectors)
+            else:
+                vectors = np.zeros((0, self.dimension), dtype=np.float32)
+            self._store.append(vectors, self.texts)
+            self._pending_vectors = []
+            self._ops = []
+            if self._store.needs_compaction():
+                self._store.compact(self.texts, self.index)
+            self._remove_legacy_files()
+
+    def _rebase(self):
+        # Reload what the other writer committed, then redo this store's changes
+        ops, self._ops = self._ops, []
+        self.texts = ChunkStore()
+        self.index = self._new_index("flat")
+        self.active_index_type = "flat"
+        self._pending_vectors = []
+        self._unremoved = set()
+        if self._store.exists:
+            self._load_segments()
+        for name, args in ops:
+            getattr(self, name)(*args)
+        print(f"[VectorStore] {self.persist_path} changed on disk; reapplied {len(ops)} unsaved changes.")
 
     def load(self):
         if not self.persist_path:
             raise ValueError("persist_path is not set for VectorStore")
+        self._store = SegmentStore(self.persist_path, self.dimension)
         index_path = os.path.join(self.persist_path, "index.faiss")
         texts_path = os.path.join(self.persist_path, "texts.json")
-        if os.path.exists(index_path) and os.path.exists(texts_path):
-            self.index = faiss.read_index(index_path)
-            with open(texts_path, "r", encoding="utf-8") as f:
-                self.texts = json.load(f)
+        with self._store.lock(shared=True):
+            self._store.refresh()
+            if self._store.exists:
+                self._load_segments()
+            elif os.path.exists(index_path) and os.path.exists(texts_path):
+                self._load_legacy(index_path, texts_path)
+            else:
+                print(f"[VectorStore] No persisted index found at {self.persist_path}. Starting fresh.")
+
+    def _load_segments(self):
+        self.texts = self._store.chunks()
+        row_ids = self.texts.row_ids()
+        live = self.texts.live_rows()
+        snapshot = self._store.snapshot()
+        covered = 0
+        if snapshot:
+            self.index, covered = faiss.read_index(snapshot[0]), snapshot[1]
         else:
-            print(f"[VectorStore] No persisted index found at {self.persist_path}. Starting fresh.")
+            self.index = self._new_index("flat")
+        self.active_index_type = index_type_of(self.index)
+        # Only live vectors appended after the snapshot need to be re-added
+        pos = 0
+        for seg in self._store.segments():
+            lo = max(0, covered - pos)
+            if lo < len(seg):
+                keep = live[pos + lo:pos + len(seg)]
+                self.index.add_with_ids(np.ascontiguousarray(seg[lo:][keep]),
+                                        row_ids[pos + lo:pos + len(seg)][keep])
+            pos += len(seg)
+        self._remove_from_index(row_ids[:covered][~live[:covered]])
+        self._maybe_promote()
+
+    def _load_legacy(self, index_path, texts_path):
+        # Pre-segment format (one index.faiss + texts.json); migrated on the next save()
+        legacy_index = faiss.read_index(index_path)
+        with open(texts_path, "r", encoding="utf-8") as f:
+            self.texts = ChunkStore.from_records(json.load(f))
+        vectors = legacy_index.reconstruct_n(0, legacy_index.ntotal)
+        self.index = self._new_index("flat")
+        self.index.add_with_ids(vectors, self.texts.row_ids())
+        self.active_index_type = "flat"
+        self._pending_vectors = [vectors]
+        self._maybe_promote()
+
+    def _remove_legacy_files(self):
+        for name in ("index.faiss", "texts.json"):
+            path = os.path.join(self.persist_path, name)
+            if os.path.exists(path):
+                os.remove(path)
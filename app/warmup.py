@@ -0,0 +1,120 @@
+"""
+Load and exercise every model once per process, so the first query does
+not pay for imports, weight loading and first-call kernel setup.
+
+    python -m app.warmup                       # all components, timings table
+    python -m app.warmup --components embedder generator --json
+
+With RAG_PRELOAD=1, main.py calls start_preload() on its first run, which
+does the same in a background thread while the login page is shown.
+Models loaded here stay loaded for the life of the process.
+"""
+import argparse
+import json
+import threading
+import time
+
+COMPONENTS = ("imports", "embedder", "tokenizer", "generator", "reranker", "spacy")
+
+_lock = threading.Lock()
+_thread = None
+_timings = {}
+
+
+def _imports():
+    import faiss  # noqa: F401
+    import sentence_transformers  # noqa: F401
+    import torch  # noqa: F401
+    import transformers  # noqa: F401
+
+
+def _pinned(key, acquire):
+    """Load a registry model, pin it so it outlives this call, and drop our reference."""
+    from app.model_registry import registry
+    model = acquire()
+    registry.pin(key)
+    registry.release(key)
+    return model
+
+
+def _embedder():
+    from app.model_registry import acquire_embedder, embedder_key
+    _pinned(embedder_key(), acquire_embedder).encode(["warm-up"])
+
+
+def _tokenizer():
+    from app.model_registry import acquire_tokenizer, tokenizer_key
+    _pinned(tokenizer_key(), acquire_tokenizer)("warm-up")
+
+
+def _generator():
+    from app.generation_scheduler import get_generation_scheduler
+    get_generation_scheduler().generate("Say hello.", max_new_tokens=4)
+
+
+def _reranker():
+    from app.model_registry import acquire_reranker, reranker_key
+    from app.reranker import Reranker
+    reranker = Reranker()
+    key = reranker_key(reranker.model_name, reranker.max_length)
+    model = _pinned(key, lambda: acquire_reranker(reranker.model_name, reranker.max_length))
+    model.predict([("warm-up", "warm-up")], show_progress_bar=False)
+
+
+def _spacy():
+    from app.graph_builder import get_graph_builder
+    get_graph_builder().extract_entities("Berlin is the capital of Germany.")
+
+
+_STEPS = {"imports": _imports, "embedder": _embedder, "tokenizer": _tokenizer,
+          "generator": _generator, "reranker": _reranker, "spacy": _spacy}
+
+
+def preload(components=COMPONENTS):
+    """Run each component's warm-up; returns {component: seconds or error message}."""
+    timings = {}
+    for name in components:
+        start = time.perf_counter()
+        try:
+            _STEPS[name]()
+            timings[name] = round(time.perf_counter() - start, 3)
+            print(f"[Warmup] {name} ready in {timings[name]:.2f}s")
+        except Exception as e:
+            timings[name] = f"failed: {e}"
+            print(f"[Warmup] {name} failed: {e}")
+        _timings[name] = timings[name]
+    return timings
+
+
+def start_preload(components=COMPONENTS):
+    """Start preload() in a background thread, once per process."""
+    global _thread
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=preload, args=(components,), name="warmup", daemon=True)
+            _thread.start()
+        return _thread
+
+
+def preload_timings():
+    """Timings recorded so far by preload() in this process."""
+    return dict(_timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--components", nargs="+", choices=COMPONENTS, default=list(COMPONENTS))
+    parser.add_argument("--json", action="store_true", help="print timings as JSON")
+    args = parser.parse_args()
+    start = time.perf_counter()
+    timings = preload(args.components)
+    timings["total"] = round(time.perf_counter() - start, 3)
+    if args.json:
+        print(json.dumps(timings))
+        return
+    for name, value in timings.items():
+        print(f"{name:<10} {value:>8.2f}s" if isinstance(value, float) else f"{name:<10} {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Recall / latency benchmark for the VectorStore index backends.
+
+Builds every index type on the same synthetic corpus of normalized vectors,
+uses the flat index as ground truth and reports recall@k plus p50/p99
+single-query latency for a sweep of nprobe / efSearch values.
+
+    python benchmarks/bench_ann.py --sizes 100000 1000000 --k 10
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.index_factory import build_index, search_params  # noqa: E402
+
+
+def synthetic_corpus(n, dim, n_clusters, seed):
+    # Clustered data behaves much more like sentence embeddings than uniform noise
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, n_clusters, size=n)
+    data = centers[labels] + 0.35 * rng.standard_normal((n, dim)).astype(np.float32)
+    data /= np.linalg.norm(data, axis=1, keepdims=True)
+    return data
+
+
+def make_queries(data, n_queries, seed):
+    rng = np.random.default_rng(seed + 1)
+    picks = data[rng.integers(0, len(data), size=n_queries)]
+    queries = picks + 0.1 * rng.standard_normal(picks.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return queries
+
+
+def timed_search(index, queries, k, params):
+    latencies = []
+    results = []
+    for q in queries:
+        q = q.reshape(1, -1)
+        start = time.perf_counter()
+        if params is None:
+            _, ids = index.search(q, k)
+        else:
+            _, ids = index.search(q, k, params=params)
+        latencies.append(time.perf_counter() - start)
+        results.append(ids[0])
+    return np.array(results), np.array(latencies) * 1000
+
+
+def recall_at_k(found, truth):
+    hits = sum(len(set(f[f >= 0]) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def run(size, args):
+    data = synthetic_corpus(size, args.dim, args.clusters, args.seed)
+    queries = make_queries(data, args.queries, args.seed)
+    train = data[:min(args.train_size, size)]
+
+    flat = build_index("flat", args.dim)
+    flat.add(data)
+    truth, flat_ms = timed_search(flat, queries, args.k, None)
+    rows = [("flat", "-", 1.0, np.percentile(flat_ms, 50), np.percentile(flat_ms, 99), 0.0)]
+
+    sweeps = {"ivf_flat": args.nprobe, "ivf_pq": args.nprobe, "hnsw": args.ef_search}
+    for index_type, values in sweeps.items():
+        start = time.perf_counter()
+        index = build_index(index_type, args.dim, num_vectors=len(train))
+        if not index.is_trained:
+            index.train(train)
+        index.add(data)
+        build_s = time.perf_counter() - start
+        for value in values:
+            if index_type == "hnsw":
+                params = search_params(index_type, ef_search=value)
+                label = f"efSearch={value}"
+            else:
+                params = search_params(index_type, nprobe=value)
+                label = f"nprobe={value}"
+            found, ms = timed_search(index, queries, args.k, params)
+            rows.append((index_type, label, recall_at_k(found, truth),
+                         np.percentile(ms, 50), np.percentile(ms, 99), build_s))
+
+    print(f"\n== N={size:,} dim={args.dim} k={args.k} queries={args.queries}")
+    print(f"{'index':<10}{'param':<16}{'recall@k':>10}{'p50 ms':>10}{'p99 ms':>10}{'build s':>10}")
+    for index_type, label, recall, p50, p99, build_s in rows:
+        print(f"{index_type:<10}{label:<16}{recall:>10.3f}{p50:>10.3f}{p99:>10.3f}{build_s:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--clusters", type=int, default=256)
+    parser.add_argument("--train-size", type=int, default=50_000)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for size in args.sizes:
+        run(size, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+BM25 benchmark: app.bm25.BM25Index against rank_bm25.BM25Okapi.
+
+Builds both on the same synthetic corpus (Zipf-distributed vocabulary, chunk
+lengths similar to our 500-character chunks) and reports build time, p50/p99
+top-k query latency and the cost of an incremental add.
+
+    python benchmarks/bench_bm25.py --sizes 10000 100000 1000000 --k 10
+
+rank_bm25 comes from benchmarks/requirements.txt. It scores in pure Python
+per query and needs minutes at 1M chunks; pass --skip-rank-bm25 to time only
+our index at that size.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.bm25 import BM25Index, tokenize  # noqa: E402
+
+
+def synthetic_corpus(n, vocab_size, seed):
+    rng = np.random.default_rng(seed)
+    vocab = np.array([f"term{i}" for i in range(vocab_size)])
+    lengths = rng.integers(40, 110, size=n)
+    words = vocab[np.minimum(rng.zipf(1.2, size=int(lengths.sum())) - 1, vocab_size - 1)]
+    ends = np.cumsum(lengths)
+    return [" ".join(words[end - length:end]) for end, length in zip(ends, lengths)]
+
+
+def make_queries(corpus, n_queries, seed):
+    rng = np.random.default_rng(seed + 1)
+    queries = []
+    for i in rng.integers(0, len(corpus), size=n_queries):
+        words = corpus[i].split()
+        queries.append(" ".join(rng.choice(words, size=min(4, len(words)), replace=False)))
+    return queries
+
+
+def latency(fn, queries):
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        times.append(time.perf_counter() - start)
+    times = np.array(times) * 1000
+    return np.percentile(times, 50), np.percentile(times, 99)
+
+
+def bench(n, args):
+    corpus = synthetic_corpus(n, args.vocab, args.seed)
+    queries = make_queries(corpus, args.queries, args.seed)
+    print(f"\n== {n:,} chunks, {len(queries)} queries, k={args.k}")
+
+    start = time.perf_counter()
+    index = BM25Index()
+    index.add(np.arange(n), corpus)
+    build = time.perf_counter() - start
+    p50, p99 = latency(lambda q: index.top_k(q, args.k), queries)
+    print(f"{'BM25Index':<12} build {build:8.2f}s  p50 {p50:8.2f}ms  p99 {p99:8.2f}ms  "
+          f"postings {index.num_postings:,}")
+
+    if not args.skip_rank_bm25:
+        bench_rank_bm25(index, corpus, queries, args)
+
+    extra = synthetic_corpus(args.add, args.vocab, args.seed + 2)
+    start = time.perf_counter()
+    index.add(np.arange(n, n + args.add), extra)
+    print(f"{'':<12} add {args.add} chunks {1000 * (time.perf_counter() - start):.1f}ms")
+
+
+def bench_rank_bm25(index, corpus, queries, args):
+    from rank_bm25 import BM25Okapi
+
+    start = time.perf_counter()
+    okapi = BM25Okapi([tokenize(text) for text in corpus])
+    build = time.perf_counter() - start
+
+    def okapi_top_k(query):
+        scores = okapi.get_scores(tokenize(query))
+        return sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:args.k]
+
+    p50, p99 = latency(okapi_top_k, queries[:args.okapi_queries])
+    print(f"{'rank_bm25':<12} build {build:8.2f}s  p50 {p50:8.2f}ms  p99 {p99:8.2f}ms")
+
+    # rank_bm25 floors negative IDF of very common terms differently, so rankings
+    # differ mostly on queries made of frequent words
+    overlap = []
+    for query in queries[:args.okapi_queries]:
+        ours = set(index.top_k(query, args.k)[0].tolist())
+        theirs = set(okapi_top_k(query))
+        overlap.append(len(ours & theirs) / args.k)
+    print(f"{'':<12} top-{args.k} overlap {np.mean(overlap):.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--okapi-queries", type=int, default=20)
+    parser.add_argument("--vocab", type=int, default=50_000)
+    parser.add_argument("--add", type=int, default=500, help="chunks in the incremental add")
+    parser.add_argument("--skip-rank-bm25", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for n in args.sizes:
+        bench(n, args)
+
+
+if __name__ == "__main__":
+    main()
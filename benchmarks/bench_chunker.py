@@ -0,0 +1,134 @@
+"""
+Chunker benchmark: app.utils.chunk_spans against the previous regex +
+string-concatenation chunk_text, on large synthetic documents.
+
+Reports throughput (MB/s of text), chunk count, the largest chunk, and how
+many chunks start or end inside a word (the old character overlap cut words
+in half). --tokenizer also times token-sized chunking; it needs a fast
+Hugging Face tokenizer, e.g. google/flan-t5-base.
+
+    python benchmarks/bench_chunker.py --mb 1 10 --chunk-size 500 --overlap 50
+    python benchmarks/bench_chunker.py --tokenizer google/flan-t5-base --tokens 128
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.utils import chunk_spans, chunk_spans_batch  # noqa: E402
+
+
+def legacy_chunk_text(text, chunk_size=300, overlap=50):
+    """The chunk_text() that chunk_spans replaced: regex split, += concatenation, character overlap."""
+    sentences = re.split(r'(?<=[.!?])\s+', text.strip())
+    chunks = []
+    current_chunk = ""
+    for sentence in sentences:
+        if len(current_chunk) + len(sentence) <= chunk_size:
+            current_chunk += " " + sentence
+        else:
+            chunks.append(current_chunk.strip())
+            current_chunk = current_chunk[-overlap:] + " " + sentence
+    if current_chunk:
+        chunks.append(current_chunk.strip())
+    return chunks
+
+
+def synthetic_document(n_chars, seed):
+    """Sentences of 4-30 Zipf-distributed words, about n_chars characters."""
+    rng = np.random.default_rng(seed)
+    vocab = np.array([f"w{i}" for i in range(5000)] + ["Motoren", "Türkiye", "capital", "Berlin"])
+    n_words = n_chars // 3
+    words = vocab[np.minimum(rng.zipf(1.3, size=n_words) - 1, len(vocab) - 1)]
+    lengths = rng.integers(4, 31, size=n_words // 4)
+    ends = np.cumsum(lengths)
+    ends = ends[ends < n_words]
+    words[ends] = np.char.add(words[ends], rng.choice([".", ".", ".", "!", "?"], size=len(ends)))
+    text = " ".join(words.tolist())
+    return text[:text.rfind(" ", 0, n_chars)]
+
+
+def mid_word(text, spans):
+    """Chunks whose first or last character is inside a word."""
+    cut = 0
+    for start, end in spans:
+        if (start > 0 and not text[start - 1].isspace()) or (end < len(text) and not text[end].isspace()):
+            cut += 1
+    return cut
+
+
+def legacy_spans(text, chunks):
+    """Locate legacy chunks in the text so mid_word() can check them (overlap breaks exact search)."""
+    spans, pos = [], 0
+    for chunk in chunks:
+        start = text.find(chunk, max(0, pos - len(chunk)))
+        if start < 0:  # the overlap joined pieces that are not adjacent in the text
+            spans.append((0, 0))
+            continue
+        spans.append((start, start + len(chunk)))
+        pos = start + len(chunk)
+    return [span for span in spans if span != (0, 0)]
+
+
+def timed(fn, repeat=3):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def report(name, mb, seconds, sizes, cut):
+    print(f"{name:<22} {mb / seconds:>8.1f} {len(sizes):>8} {max(sizes, default=0):>9} {cut:>9}")
+
+
+def run(mb, args, tokenizer):
+    text = synthetic_document(int(mb * 2**20), args.seed)
+    mb = len(text.encode("utf-8")) / 2**20
+    print(f"\n== {mb:.1f} MB document, chunk_size={args.chunk_size}, overlap={args.overlap}")
+    print(f"{'chunker':<22} {'MB/s':>8} {'chunks':>8} {'max size':>9} {'mid-word':>9}")
+
+    seconds, chunks = timed(lambda: legacy_chunk_text(text, args.chunk_size, args.overlap))
+    report("legacy (chars)", mb, seconds, [len(c) for c in chunks], mid_word(text, legacy_spans(text, chunks)))
+
+    seconds, spans = timed(lambda: chunk_spans(text, args.chunk_size, args.overlap))
+    report("offsets (chars)", mb, seconds, [end - start for start, end in spans], mid_word(text, spans))
+
+    # Batched: the same text as many page-sized documents
+    pages = [text[i:i + 3000] for i in range(0, len(text), 3000)]
+    seconds, batch = timed(lambda: chunk_spans_batch(pages, args.chunk_size, args.overlap))
+    report(f"batch x{len(pages)} (chars)", mb, seconds, [e - s for spans in batch for s, e in spans],
+           sum(mid_word(page, spans) for page, spans in zip(pages, batch)))
+
+    if tokenizer is not None:
+        seconds, batch = timed(lambda: chunk_spans_batch(pages, args.tokens, args.tokens // 8, tokenizer), repeat=1)
+        sizes = [len(ids) for ids in tokenizer([page[s:e] for page, spans in zip(pages, batch) for s, e in spans],
+                                               add_special_tokens=False)["input_ids"]]
+        report(f"batch (tokens={args.tokens})", mb, seconds, sizes,
+               sum(mid_word(page, spans) for page, spans in zip(pages, batch)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mb", type=float, nargs="+", default=[1, 10])
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--overlap", type=int, default=50)
+    parser.add_argument("--tokenizer", help="fast tokenizer to also time token-sized chunking")
+    parser.add_argument("--tokens", type=int, default=128, help="chunk size in tokens for --tokenizer")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    tokenizer = None
+    if args.tokenizer:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(args.tokenizer, use_fast=True)
+    for mb in args.mb:
+        run(mb, args, tokenizer)
+
+
+if __name__ == "__main__":
+    main()
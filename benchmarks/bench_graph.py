@@ -0,0 +1,120 @@
+"""
+Knowledge-graph benchmark: app.csr_graph.CSRGraph against the networkx path
+GraphBuilder uses by default.
+
+Builds both from the same synthetic entity graph (Zipf-distributed endpoints,
+so a few hub entities have huge degree, as in real corpora) through the
+same count-bumping updates GraphBuilder applies per chunk. Reports build
+time, traced memory, and p50/p99 latency of the k-hop expansion done for
+every GraphRAG query.
+
+    python benchmarks/bench_graph.py --nodes 100000 1000000 --edges-per-node 4 --depth 2
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import networkx as nx
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.csr_graph import CSRGraph, normalize_entity  # noqa: E402
+
+
+def synthetic_edges(n_nodes, n_edges, seed):
+    rng = np.random.default_rng(seed)
+    src = np.minimum(rng.zipf(1.6, size=n_edges) - 1, n_nodes - 1)
+    dst = rng.integers(0, n_nodes, size=n_edges)
+    keep = src != dst
+    return src[keep], dst[keep]
+
+
+def build_networkx(names, src, dst):
+    graph = nx.Graph()
+    for name in names:
+        graph.add_node(name, count=1)
+    for a, b in zip(src.tolist(), dst.tolist()):
+        u, v = names[a], names[b]
+        if graph.has_edge(u, v):
+            graph[u][v]["count"] += 1
+        else:
+            graph.add_edge(u, v, relation="related", count=1)
+    return graph
+
+
+def build_csr(names, src, dst):
+    graph = CSRGraph()
+    for name in names:
+        graph.bump_node(name, 1)
+    for a, b in zip(src.tolist(), dst.tolist()):
+        graph.bump_edge(names[a], names[b], "related", 1)
+    graph.compact()
+    return graph
+
+
+def measure(build, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    graph = build(*args)
+    seconds = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return graph, seconds, memory
+
+
+def networkx_hops(graph, seeds, depth):
+    hops = {}
+    for seed in seeds:
+        for node, d in nx.single_source_shortest_path_length(graph, seed, cutoff=depth).items():
+            node = normalize_entity(node)
+            if d < hops.get(node, depth + 1):
+                hops[node] = d
+    return hops
+
+
+def latencies(fn, queries):
+    times = []
+    for seeds in queries:
+        start = time.perf_counter()
+        fn(seeds)
+        times.append((time.perf_counter() - start) * 1000)
+    return np.percentile(times, 50), np.percentile(times, 99)
+
+
+def run(n_nodes, edges_per_node, depth, n_queries, seed):
+    names = [f"Entity {i}" for i in range(n_nodes)]
+    src, dst = synthetic_edges(n_nodes, n_nodes * edges_per_node, seed)
+    nx_graph, nx_build, nx_mem = measure(build_networkx, names, src, dst)
+    csr_graph, csr_build, csr_mem = measure(build_csr, names, src, dst)
+    assert nx_graph.number_of_edges() == csr_graph.number_of_edges()
+
+    rng = np.random.default_rng(seed + 1)
+    # Queries name 1-3 entities, mostly non-hub ones (uniform over ids)
+    queries = [[names[i] for i in rng.integers(0, n_nodes, size=rng.integers(1, 4))] for _ in range(n_queries)]
+    for seeds in queries[:20]:
+        assert networkx_hops(nx_graph, seeds, depth) == csr_graph.neighborhood(seeds, depth)
+    nx_p50, nx_p99 = latencies(lambda s: networkx_hops(nx_graph, s, depth), queries)
+    csr_p50, csr_p99 = latencies(lambda s: csr_graph.neighborhood(s, depth), queries)
+
+    print(f"\n{n_nodes:,} nodes, {nx_graph.number_of_edges():,} edges, depth {depth}")
+    print(f"{'backend':<10} {'build s':>8} {'memory MiB':>11} {'p50 ms':>8} {'p99 ms':>8}")
+    print(f"{'networkx':<10} {nx_build:>8.2f} {nx_mem / 2**20:>11.1f} {nx_p50:>8.2f} {nx_p99:>8.2f}")
+    print(f"{'csr':<10} {csr_build:>8.2f} {csr_mem / 2**20:>11.1f} {csr_p50:>8.2f} {csr_p99:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--edges-per-node", type=int, default=4)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for n in args.nodes:
+        run(n, args.edges_per_node, args.depth, args.queries, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Compare the CPU inference backends (RAG_INFERENCE_BACKEND) for the embedder,
+reranker and generator: load time, latency, resident memory, and quality
+against the fp32 torch path.
+
+Each backend runs in its own subprocess so memory numbers do not mix:
+
+    python benchmarks/bench_inference.py --backends torch int8 onnx --threads 4
+
+Quality columns compare against the torch run: mean cosine of embeddings,
+Spearman correlation / top-1 agreement of reranker scores, and the share of
+generated answers that are identical.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PASSAGES = [
+    "Berlin is the capital and largest city of Germany.",
+    "İstanbul, Türkiye'nin en kalabalık şehridir ve iki kıtaya yayılır.",
+    "The Rhine flows from the Swiss Alps to the North Sea.",
+    "Photosynthesis converts light energy into chemical energy in plants.",
+    "Ankara wurde 1923 zur Hauptstadt der Türkei erklärt.",
+    "FAISS is a library for efficient similarity search of dense vectors.",
+    "The Treaty of Lausanne was signed in 1923.",
+    "Die Zugspitze ist mit 2962 Metern der höchste Berg Deutschlands.",
+]
+QUESTIONS = [
+    "What is the capital of Germany?",
+    "Which city is the most populous in Turkey?",
+    "Where does the Rhine end?",
+    "When did Ankara become the capital?",
+]
+
+
+def corpus(n):
+    return [f"{PASSAGES[i % len(PASSAGES)]} (passage {i})" for i in range(n)]
+
+
+def run_child(args):
+    os.environ["RAG_INFERENCE_BACKEND"] = args.backend
+    if args.threads:
+        os.environ["RAG_INTRA_OP_THREADS"] = str(args.threads)
+    from app.model_registry import (acquire_embedder, acquire_generator, acquire_reranker,
+                                    current_rss, registry)
+
+    result = {"backend": args.backend}
+    rss_start = current_rss()
+
+    embedder = acquire_embedder()
+    texts = corpus(args.texts)
+    embedder.encode(texts[:8])  # warm-up
+    start = time.perf_counter()
+    embeddings = embedder.encode(texts, batch_size=64, convert_to_numpy=True)
+    result["embed_ms_per_text"] = 1000 * (time.perf_counter() - start) / len(texts)
+    np.save(os.path.join(args.out, f"{args.backend}-embeddings.npy"), embeddings)
+
+    reranker = acquire_reranker()
+    pairs = [(q, p) for q in QUESTIONS for p in corpus(args.rerank_docs)]
+    reranker.predict(pairs[:8])
+    start = time.perf_counter()
+    scores = reranker.predict(pairs, batch_size=32)
+    result["rerank_ms_per_pair"] = 1000 * (time.perf_counter() - start) / len(pairs)
+    np.save(os.path.join(args.out, f"{args.backend}-rerank.npy"), np.asarray(scores, dtype=np.float32))
+
+    generator = acquire_generator()
+    prompts = [f"Answer the question using only the following context.\n\nContext:\n"
+               f"{' '.join(PASSAGES)}\n\nQuestion: {q}\nAnswer:" for q in QUESTIONS]
+    generator(prompts[0], max_new_tokens=8)
+    latencies, answers = [], []
+    for prompt in prompts:
+        start = time.perf_counter()
+        output = generator(prompt, max_new_tokens=args.max_new_tokens, do_sample=False)
+        latencies.append(time.perf_counter() - start)
+        answers.append(output[0]["generated_text"].strip())
+    result["generate_ms_p50"] = 1000 * float(np.percentile(latencies, 50))
+    result["answers"] = answers
+
+    result["rss_mib"] = (current_rss() - rss_start) / 2**20
+    result["load_seconds"] = {key[0]: info["load_seconds"] for key, info in registry.stats().items()}
+    with open(os.path.join(args.out, f"{args.backend}.json"), "w") as f:
+        json.dump(result, f)
+
+
+def spearman(a, b):
+    ranks_a, ranks_b = np.argsort(np.argsort(a)), np.argsort(np.argsort(b))
+    return float(np.corrcoef(ranks_a, ranks_b)[0, 1])
+
+
+def compare(out, backends, n_questions):
+    results = {}
+    for backend in backends:
+        path = os.path.join(out, f"{backend}.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                results[backend] = json.load(f)
+    if "torch" not in results:
+        print("No torch run to compare against; quality columns skipped.")
+    print(f"\n{'backend':<8} {'embed ms/txt':>12} {'rerank ms/pair':>14} {'gen p50 ms':>11} {'RSS MiB':>8} "
+          f"{'emb cos':>8} {'rr spearman':>11} {'rr top1':>8} {'gen same':>9}")
+    for backend, r in results.items():
+        quality = ["", "", "", ""]
+        if "torch" in results and backend != "torch":
+            ref_emb = np.load(os.path.join(out, "torch-embeddings.npy"))
+            emb = np.load(os.path.join(out, f"{backend}-embeddings.npy"))
+            cos = np.sum(ref_emb * emb, axis=1) / (np.linalg.norm(ref_emb, axis=1) * np.linalg.norm(emb, axis=1))
+            ref_rr = np.load(os.path.join(out, "torch-rerank.npy")).reshape(n_questions, -1)
+            rr = np.load(os.path.join(out, f"{backend}-rerank.npy")).reshape(n_questions, -1)
+            rho = np.mean([spearman(a, b) for a, b in zip(ref_rr, rr)])
+            top1 = np.mean(ref_rr.argmax(axis=1) == rr.argmax(axis=1))
+            same = np.mean([a == b for a, b in zip(results["torch"]["answers"], r["answers"])])
+            quality = [f"{cos.mean():.4f}", f"{rho:.3f}", f"{top1:.2f}", f"{same:.2f}"]
+        print(f"{backend:<8} {r['embed_ms_per_text']:>12.2f} {r['rerank_ms_per_pair']:>14.2f} "
+              f"{r['generate_ms_p50']:>11.0f} {r['rss_mib']:>8.0f} {quality[0]:>8} {quality[1]:>11} "
+              f"{quality[2]:>8} {quality[3]:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=["torch", "int8", "onnx"])
+    parser.add_argument("--threads", type=int, default=None, help="RAG_INTRA_OP_THREADS for every run")
+    parser.add_argument("--texts", type=int, default=512)
+    parser.add_argument("--rerank-docs", type=int, default=50)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--backend", help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.backend:
+        run_child(args)
+        return
+
+    out = tempfile.mkdtemp(prefix="bench_inference_")
+    # torch first: it is the reference for the quality columns
+    backends = sorted(args.backends, key=lambda b: b != "torch")
+    for backend in backends:
+        print(f"[bench] {backend} ...", flush=True)
+        cmd = [sys.executable, os.path.abspath(__file__), "--backend", backend, "--out", out,
+               "--texts", str(args.texts), "--rerank-docs", str(args.rerank_docs),
+               "--max-new-tokens", str(args.max_new_tokens)]
+        if args.threads:
+            cmd += ["--threads", str(args.threads)]
+        if subprocess.run(cmd).returncode != 0:
+            print(f"[bench] {backend} failed")
+    compare(out, backends, len(QUESTIONS))
+
+
+if __name__ == "__main__":
+    main()
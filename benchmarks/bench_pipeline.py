@@ -0,0 +1,299 @@
+"""
+End-to-end benchmark / load test of the RAG pipeline without Streamlit.
+
+Builds VectorStore + RAGPipeline directly (same wiring as main.py), fills the
+store, then replays a query set at a given concurrency and reports:
+
+- ingest throughput (chunks/s, plus pages/s and embeddings/s for --files),
+- end-to-end latency p50/p95/p99 and throughput,
+- p50/p95/p99 of each pipeline stage (cache lookup, retrieve, rerank,
+  prompt build, generate), taken from the app.metrics trace of every query,
+- hit rates of the answer, semantic, embedding and rerank caches,
+- peak RSS of the process.
+
+    python benchmarks/bench_pipeline.py                               # synthetic corpus
+    python benchmarks/bench_pipeline.py --store data/user_store --queries questions.txt
+    python benchmarks/bench_pipeline.py --files docs/*.pdf --concurrency 8 --repeat 2
+    python benchmarks/bench_pipeline.py --retrieval-only --bm25 --reranker --json run.json
+
+--queries takes a text file (one question per line) or JSON lines with a
+"query", "question" or "title" field. --store is copied to a temporary
+directory first, so the run never writes to it (e.g. the BM25 index that
+--bm25 saves). Caches start empty in a temporary directory, so --repeat 2
+shows warm-cache behaviour on its second pass. --json writes every number
+for diffing runs ("-" prints it instead of the table).
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SUBJECTS = ["Berlin", "the Rhine", "photosynthesis", "FAISS", "the Treaty of Lausanne", "Ankara",
+            "the Zugspitze", "vector search", "Istanbul", "the North Sea", "transformers", "BM25"]
+FACTS = ["was described in a report published in {year}.", "is discussed at length in chapter {n}.",
+         "has been studied by {n} research groups since {year}.", "appears in {n} of the uploaded documents.",
+         "was first mentioned in {year} and revised in {year2}."]
+QUESTIONS = ["What is the capital of Germany?", "Where does the Rhine end?", "How does photosynthesis work?",
+             "What is FAISS used for?", "When was the Treaty of Lausanne signed?", "When did Ankara become the capital?",
+             "How high is the Zugspitze?", "What is BM25?"]
+STAGES = ("cache_lookup", "retrieve", "rerank", "prompt_build", "generate")
+
+
+def synthetic_chunks(n, seed):
+    """About 400-character chunks, each naming a few subjects so retrieval has something to find."""
+    rng = np.random.default_rng(seed)
+    chunks = []
+    for i in range(n):
+        sentences = []
+        while sum(len(s) for s in sentences) < 400:
+            subject = SUBJECTS[rng.integers(len(SUBJECTS))]
+            fact = FACTS[rng.integers(len(FACTS))].format(year=rng.integers(1900, 2025),
+                                                          year2=rng.integers(1900, 2025), n=rng.integers(2, 40))
+            sentences.append(f"{subject[0].upper()}{subject[1:]} {fact}")
+        chunks.append(f"{' '.join(sentences)} (chunk {i})")
+    return chunks
+
+
+def load_queries(path):
+    if not path:
+        return list(QUESTIONS)
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                record = json.loads(line)
+                line = next((record[k] for k in ("query", "question", "title") if record.get(k)), "")
+            if line:
+                queries.append(line)
+    return queries
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None}
+    ms = np.asarray(values) * 1000
+    return {"p50": round(float(np.percentile(ms, 50)), 3), "p95": round(float(np.percentile(ms, 95)), 3),
+            "p99": round(float(np.percentile(ms, 99)), 3), "mean": round(float(ms.mean()), 3)}
+
+
+def peak_rss_mib():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def build_store(args, workdir, embedding_cache):
+    from app.vectorstore import VectorStore
+
+    if args.store:
+        copy = os.path.join(workdir, "store")
+        shutil.copytree(args.store, copy, ignore=shutil.ignore_patterns(".lock"))
+        store = VectorStore(persist_path=copy, load=True, embedding_cache=embedding_cache)
+        return store, {"source": args.store, "chunks": len(store.texts)}
+
+    store = VectorStore(persist_path=os.path.join(workdir, "store"), embedding_cache=embedding_cache,
+                        index_type=args.index_type)
+    if args.files:
+        from app.ingest import ingest_files
+        streams = [open(path, "rb") for path in args.files]
+        try:
+            report = ingest_files(streams, store, persist=False, workers=args.ingest_workers)
+        finally:
+            for stream in streams:
+                stream.close()
+        seconds = report["total_seconds"]
+        return store, {"source": "files", "files": report["files"], "failed": report["failed"],
+                       "pages": report["pages"], "chunks": report["chunks"], "seconds": round(seconds, 3),
+                       "chunks_per_s": round(report["chunks"] / seconds, 1) if seconds else None,
+                       "pages_per_s": round(report["pages_per_s"], 1),
+                       "embeddings_per_s": round(report["embeddings_per_s"], 1)}
+
+    chunks = synthetic_chunks(args.chunks, args.seed)
+    start = time.perf_counter()
+    for i in range(0, len(chunks), args.embed_batch):
+        batch = chunks[i:i + args.embed_batch]
+        store.add_texts(batch, [{"doc_name": f"synthetic-{(i + j) // 50}.pdf", "page": 1}
+                                for j in range(len(batch))])
+    seconds = time.perf_counter() - start
+    return store, {"source": "synthetic", "chunks": len(chunks), "seconds": round(seconds, 3),
+                   "chunks_per_s": round(len(chunks) / seconds, 1) if seconds else None}
+
+
+def run_query(rag, query, args):
+    """One query; returns (seconds, {stage: seconds}, error)."""
+    from app.metrics import last_trace, span
+
+    start = time.perf_counter()
+    try:
+        if args.retrieval_only:
+            with span("query", method="retrieval"):
+                docs = rag.retrieve(query, rag.candidate_count(args.top_k, ["user"]), ["user"])
+                rag.rerank_docs(query, docs, args.top_k)
+        elif args.method == "hyde":
+            rag.hyde_answer(query, top_k=args.top_k, max_length=args.max_tokens, sources=["user"])
+        else:
+            rag.answer(query, top_k=args.top_k, max_length=args.max_tokens, sources=["user"])
+        error = None
+    except Exception as e:
+        error = repr(e)
+    seconds = time.perf_counter() - start
+    stages = {}
+    trace = last_trace()  # per thread, so concurrent queries do not mix
+    if trace is not None:
+        for depth, s in trace.walk():
+            if depth == 1 and s.name in STAGES:
+                stages[s.name] = stages.get(s.name, 0.0) + (s.duration or 0.0)
+    return seconds, stages, error
+
+
+def cache_rates(counters):
+    rates = {}
+    for cache in ("answer", "semantic", "embedding", "rerank"):
+        hits = counters.get(("rag_cache_lookups_total", (("cache", cache), ("result", "hit"))), 0)
+        misses = counters.get(("rag_cache_lookups_total", (("cache", cache), ("result", "miss"))), 0)
+        if hits or misses:
+            rates[cache] = {"hits": hits, "misses": misses, "hit_rate": round(hits / (hits + misses), 3)}
+    return rates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    corpus = parser.add_mutually_exclusive_group()
+    corpus.add_argument("--store", help="existing VectorStore directory (e.g. data/user_store); a copy is used")
+    corpus.add_argument("--files", nargs="+", help="PDF/DOCX files to ingest with app.ingest")
+    corpus.add_argument("--chunks", type=int, default=2000, help="size of the synthetic corpus (default)")
+    parser.add_argument("--index-type", default="flat", choices=["flat", "ivf_flat", "ivf_pq", "hnsw"])
+    parser.add_argument("--embed-batch", type=int, default=512)
+    parser.add_argument("--ingest-workers", type=int, default=None)
+    parser.add_argument("--queries", help="question file: plain lines or JSON lines (query/question/title)")
+    parser.add_argument("--limit", type=int, default=None, help="use only the first N queries")
+    parser.add_argument("--repeat", type=int, default=1, help="passes over the query set")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--method", choices=["rag", "hyde"], default="rag")
+    parser.add_argument("--retrieval-only", action="store_true", help="retrieve (+ rerank) only; no generator")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--bm25", action="store_true", help="hybrid BM25 + dense retrieval")
+    parser.add_argument("--fusion", choices=["rrf", "weighted"], default="rrf")
+    parser.add_argument("--reranker", action="store_true")
+    parser.add_argument("--no-cache", action="store_true", help="disable the answer and semantic caches")
+    parser.add_argument("--semantic-threshold", type=float, default=0.92)
+    parser.add_argument("--no-warmup", action="store_true", help="count model loading in the first queries")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write results as JSON to this path ('-' for stdout)")
+    args = parser.parse_args()
+
+    from app import metrics
+    from app.answer_cache import AnswerCache
+    from app.embedding_cache import EmbeddingCache
+    from app.model_registry import RERANKER_MODEL
+    from app.rag_pipeline import RAGPipeline
+    from app.semantic_cache import SemanticCache
+
+    queries = load_queries(args.queries)[:args.limit]
+    if not queries:
+        parser.error("no queries to replay")
+    workdir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    embedding_cache = EmbeddingCache(os.path.join(workdir, "embedding_cache.db"))
+
+    store, ingest = build_store(args, workdir, embedding_cache)
+    ingest["embedding_cache"] = embedding_cache.stats()
+
+    scheduler = None
+    if not args.retrieval_only:
+        from app.generation_scheduler import get_generation_scheduler
+        scheduler = get_generation_scheduler()
+    rag = RAGPipeline(
+        store, None, cache_enabled=not args.no_cache, use_bm25=args.bm25, fusion=args.fusion,
+        reranker_model=RERANKER_MODEL if args.reranker else None,
+        cache=AnswerCache(os.path.join(workdir, "answer_cache.db")),
+        semantic_cache=None if args.no_cache else SemanticCache(threshold=args.semantic_threshold),
+        scheduler=scheduler,
+    )
+
+    if not args.no_warmup:
+        from app.warmup import preload
+        components = ["embedder"]
+        if not args.retrieval_only:
+            components += ["tokenizer", "generator"]
+        if args.reranker:
+            rag.reranker.model.predict([("warm-up", "warm-up")], show_progress_bar=False)
+        preload(components)
+    metrics.metrics.reset()
+
+    jobs = [query for _ in range(args.repeat) for query in queries]
+    print(f"[Bench] {len(jobs)} queries ({len(queries)} unique x {args.repeat}) "
+          f"at concurrency {args.concurrency} over {ingest['chunks']} chunks")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda q: run_query(rag, q, args), jobs))
+    wall = time.perf_counter() - start
+
+    latencies = [seconds for seconds, _, error in results if error is None]
+    errors = [error for _, _, error in results if error is not None]
+    counters = dict(metrics.metrics.counters)
+    report = {
+        "revision": git_revision(),
+        "config": vars(args),
+        "ingest": ingest,
+        "queries": {
+            "count": len(jobs), "errors": len(errors), "first_error": errors[0] if errors else None,
+            "wall_seconds": round(wall, 3), "throughput_qps": round(len(latencies) / wall, 2) if wall else None,
+            "latency_ms": percentiles(latencies),
+        },
+        "stages_ms": {stage: percentiles([s[stage] for _, s, _ in results if stage in s])
+                      for stage in STAGES if any(stage in s for _, s, _ in results)},
+        "caches": cache_rates(counters),
+        "generated_tokens": counters.get(("rag_generated_tokens_total", ()), 0),
+        "peak_rss_mib": peak_rss_mib(),
+    }
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        text = json.dumps(report, indent=2)
+        if args.json == "-":
+            print(text)
+            return
+        with open(args.json, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+    print(f"\nIngest ({ingest['source']}): {ingest['chunks']} chunks"
+          + (f" @ {ingest['chunks_per_s']}/s" if ingest.get("chunks_per_s") else ""))
+    q = report["queries"]
+    print(f"Queries: {q['count']} in {q['wall_seconds']}s ({q['throughput_qps']} q/s), {q['errors']} errors")
+    print(f"\n{'stage':<14} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for stage, p in list(report["stages_ms"].items()) + [("end-to-end", q["latency_ms"])]:
+        if p["p50"] is not None:
+            print(f"{stage:<14} {p['p50']:>9.2f} {p['p95']:>9.2f} {p['p99']:>9.2f}")
+    print()
+    for cache, c in report["caches"].items():
+        print(f"{cache} cache: {c['hits']} hits / {c['misses']} misses ({c['hit_rate']:.0%})")
+    print(f"Peak RSS: {report['peak_rss_mib']} MiB")
+    if errors:
+        print(f"First error: {errors[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,29 @@
+import importlib.machinery
 import os
 import shutil
 import streamlit as st
+from concurrent.futures import ThreadPoolExecutor
 
-from app.file_processor import process_file
-from app.vectorstore import VectorStore
-from app.rag_pipeline import RAGPipeline
-from app.graph_pipeline import GraphRAGPipeline
+# Streamlit runs this file as the __main__ module; a spawned worker process
+# (app.ingest) would otherwise re-run all of it as __mp_main__ on start-up.
+# A "__main__" spec tells multiprocessing there is no main module to import.
+__spec__ = importlib.machinery.ModuleSpec("__main__", None)
 
 # ------------------------
 # Streamlit Config
 # ------------------------
 st.set_page_config(page_title="RAG + GraphRAG Chatbot", page_icon="🤖")
 
+# Optionally load every model in the background (once per process) while the login page is shown
+if os.getenv("RAG_PRELOAD", "0") == "1":
+    from app.warmup import start_preload
+    start_preload()
+
+# Prometheus scrape endpoint (once per process); the sidebar also offers the same text as a download
+if os.getenv("RAG_METRICS_PORT"):
+    from app.metrics import start_http_server
+    start_http_server(int(os.getenv("RAG_METRICS_PORT")))
+
 # ------------------------
 # Login Check
 # ------------------------
@@ -40,17 +52,31 @@ if not st.session_state.authenticated:
 # ------------------------
 st.title("📚 RAG + 🧠 GraphRAG Chatbot")
 
+# Imported after login so the login page does not wait for faiss / numpy / the app modules;
+# torch, transformers and spaCy are only imported once a model is actually used
+from app.ingest import ingest_files
+from app.vectorstore import VectorStore
+from app.rag_pipeline import RAGPipeline
+from app.model_registry import registry, GENERATOR_MODEL
+from app.embedding_cache import get_embedding_cache
+from app.semantic_cache import get_semantic_cache
+from app.generation_scheduler import get_generation_scheduler
+
 # ------------------------
 # Vector Stores
 # ------------------------
+embedding_cache = get_embedding_cache("data/embedding_cache.db")
+
 if "user_vectorstore" not in st.session_state:
     st.session_state.user_vectorstore = VectorStore(
-        persist_path="data/user_store", load=True
+        persist_path="data/user_store", load=True, embedding_cache=embedding_cache
     )
 
 if "db_vectorstore" not in st.session_state:
     st.session_state.db_vectorstore = VectorStore(
-        persist_path="data/db_store", load=True
+        persist_path="data/db_store", load=True, embedding_cache=embedding_cache,
+        index_type=os.getenv("DB_INDEX_TYPE", "ivf_flat"),
+        promote_threshold=int(os.getenv("DB_INDEX_PROMOTE_AT", "100000")),
     )
 
 # ------------------------
@@ -70,8 +96,12 @@ if "User PDF" in sources:
 if "Database" in sources:
     pipeline_sources.append("db")
 
-use_bm25 = st.sidebar.checkbox("Use BM25", value=False)
+use_bm25 = st.sidebar.checkbox("Hybrid retrieval (BM25 + dense)", value=False)
+fusion = st.sidebar.selectbox("Fusion", ["rrf", "weighted"], disabled=not use_bm25)
 use_reranker = st.sidebar.checkbox("Use Reranker (MiniLM-6)", value=False)
+use_semantic_cache = st.sidebar.checkbox("Reuse answers for similar questions", value=True)
+semantic_threshold = st.sidebar.slider("Similar question threshold (cosine)", 0.80, 1.00, 0.92, 0.01)
+semantic_cache = get_semantic_cache()  # shared by all sessions; the threshold is per session
 
 # ------------------------
 # HyDE Advanced Settings
@@ -88,6 +118,9 @@ compare_method = st.sidebar.checkbox("Compare RAG vs HyDE", value=False)
 # ------------------------
 # RAG Pipeline
 # ------------------------
+# One generation worker per process; it batches prompts across sessions (GEN_MAX_BATCH, GEN_MAX_WAIT_MS)
+scheduler = get_generation_scheduler()
+
 if "rag" not in st.session_state:
     st.session_state.rag = RAGPipeline(
         user_vectorstore=st.session_state.user_vectorstore,
@@ -95,32 +128,40 @@ if "rag" not in st.session_state:
         chunk_size=400,
         reranker_model="cross-encoder/ms-marco-MiniLM-L-6-v2" if use_reranker else None,
         use_bm25=use_bm25,
+        semantic_cache=semantic_cache if use_semantic_cache else None,
+        semantic_threshold=semantic_threshold,
+        fusion=fusion,
+        scheduler=scheduler,
     )
 else:
     st.session_state.rag.use_bm25 = use_bm25
-    # Update reranker
-    if use_reranker and not st.session_state.rag.reranker:
-        from sentence_transformers import CrossEncoder
-        st.session_state.rag.reranker = CrossEncoder(
-            "cross-encoder/ms-marco-MiniLM-L-6-v2", device="cpu"
-        )
-    elif not use_reranker:
-        st.session_state.rag.reranker = None
+    st.session_state.rag.retriever.fusion = fusion
+    st.session_state.rag.semantic_cache = semantic_cache if use_semantic_cache else None
+    st.session_state.rag.semantic_threshold = semantic_threshold
+    # Unticking only disables the reranker; the model stays loaded for the next toggle
+    st.session_state.rag.set_reranker(
+        "cross-encoder/ms-marco-MiniLM-L-6-v2" if use_reranker else None
+    )
 
 # ------------------------
 # GraphRAG Pipeline
 # ------------------------
-if "graph_rag" not in st.session_state:
-    st.session_state.graph_rag = GraphRAGPipeline(st.session_state.rag)
-
 st.sidebar.subheader("🧠 GraphRAG Options")
 enable_graph_rag = st.sidebar.checkbox("Enable Knowledge Graph (GraphRAG)", value=False)
 
+def update_knowledge_graph():
+    # Only sessions that enabled GraphRAG have a pipeline; it skips graphs not built yet
+    if "graph_rag" in st.session_state:
+        st.session_state.graph_rag.update_knowledge_graph()
+
 if enable_graph_rag:
+    if "graph_rag" not in st.session_state:
+        from app.graph_pipeline import GraphRAGPipeline
+        st.session_state.graph_rag = GraphRAGPipeline(st.session_state.rag)
     if st.sidebar.button("Build Knowledge Graph"):
         with st.spinner("🔄 Building Knowledge Graph..."):
-            st.session_state.graph_rag.build_knowledge_graph()
-        st.sidebar.success("✅ Knowledge Graph built!")
+            added, removed = st.session_state.graph_rag.build_knowledge_graph()
+        st.sidebar.success(f"✅ Knowledge Graph built! (+{added} / -{removed} chunks)")
 
 # ------------------------
 # File Upload Section
@@ -135,31 +176,56 @@ uploaded_files = st.file_uploader(
     key="file_uploader_widget",
 )
 
+# Chunks are sized in characters unless RAG_CHUNK_TOKENS asks for generator tokens
+chunk_tokens = int(os.getenv("RAG_CHUNK_TOKENS", "0"))
+chunking = ({"chunk_size": chunk_tokens, "overlap": chunk_tokens // 8, "tokenizer_name": GENERATOR_MODEL}
+            if chunk_tokens else {})
+
 if uploaded_files:
     st.session_state.uploaded_files.extend(uploaded_files)
-    for file in uploaded_files:
-        process_file(
-            file,
-            st.session_state.user_vectorstore,
-            rag_pipeline=st.session_state.rag,
-            persist=True,
-        )
+    report = ingest_files(
+        uploaded_files,
+        st.session_state.user_vectorstore,
+        rag_pipeline=st.session_state.rag,
+        persist=True,
+        **chunking,
+    )
+    # Parses only the new chunks, once the graph has been built
+    update_knowledge_graph()
+    for name, error in report["errors"].items():
+        st.warning(f"⚠️ {name}: {error}")
     st.success("✅ Files uploaded and processed successfully!")
+    st.caption(report.summary())
 
 # ------------------------
 # Document Management
 # ------------------------
 st.sidebar.subheader("🗑️ Document Management")
 
+stored_docs = st.session_state.user_vectorstore.documents()
+if stored_docs:
+    doc_to_delete = st.sidebar.selectbox("Uploaded documents", stored_docs)
+    if st.sidebar.button("Delete Document"):
+        removed = st.session_state.user_vectorstore.delete_document(doc_to_delete)
+        st.session_state.user_vectorstore.save()
+        st.session_state.rag.refresh_bm25()
+        update_knowledge_graph()
+        st.sidebar.success(f"✅ {doc_to_delete} deleted ({removed} chunks)")
+
 if st.sidebar.button("Clear Uploaded Documents"):
+    st.session_state.user_vectorstore.close()
     st.session_state.user_vectorstore = VectorStore(
-        persist_path="data/user_store", load=False
+        persist_path="data/user_store", load=False, embedding_cache=embedding_cache
     )
     st.session_state.rag.user_vectorstore = st.session_state.user_vectorstore
+    if st.session_state.rag.reranker is not None:
+        # Cached scores are keyed by chunk id, and the new store reuses ids
+        st.session_state.rag.reranker.clear()
     if os.path.exists("data/user_store"):
         shutil.rmtree("data/user_store")
     os.makedirs("data/user_store", exist_ok=True)
     st.session_state.uploaded_files = []
+    update_knowledge_graph()
     st.success("✅ All uploaded documents cleared!")
 
 # ------------------------
@@ -169,6 +235,33 @@ if st.sidebar.button("Clear Cache"):
     st.session_state.rag.clear_cache()
     st.sidebar.success("✅ Cache cleared!")
 
+# ------------------------
+# Loaded Models
+# ------------------------
+with st.sidebar.expander("📦 Loaded Models"):
+    for key, info in registry.stats().items():
+        st.write(f"`{key[1]}` ({key[0]}): {info['load_seconds']}s, "
+                 f"{info['rss_mib']} MiB, refs={info['refcount']}")
+    if os.getenv("RAG_PRELOAD", "0") == "1":
+        from app.warmup import preload_timings
+        warmup = preload_timings()
+        st.write("Warm-up: " + (", ".join(f"{name} {value}s" if isinstance(value, float) else f"{name} {value}"
+                                          for name, value in warmup.items()) or "running..."))
+    gen_stats = scheduler.stats()
+    st.write(f"Generation: {gen_stats['requests']} prompts in {gen_stats['batches']} batches "
+             f"(avg {gen_stats['avg_batch_size']}, max {gen_stats['largest_batch']}), "
+             f"{gen_stats['queued']} queued")
+    cache_stats = embedding_cache.stats()
+    st.write(f"Embedding cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+             f"({cache_stats['hit_rate']:.0%})")
+    answer_stats = st.session_state.rag.cache.stats()
+    st.write(f"Answer cache: {answer_stats['memory_hits']} memory / {answer_stats['disk_hits']} disk hits, "
+             f"{answer_stats['misses']} misses ({answer_stats['hit_rate']:.0%}), "
+             f"{answer_stats['avg_lookup_ms']} ms avg lookup")
+    semantic_stats = semantic_cache.stats()
+    st.write(f"Similar questions: {semantic_stats['saved_generations']} generations saved "
+             f"in {semantic_stats['lookups']} lookups ({semantic_stats['hit_rate']:.0%})")
+
 # ------------------------
 # QA Section
 # ------------------------
@@ -176,50 +269,94 @@ st.subheader("💬 Ask a Question")
 
 user_input = st.text_input("Type your question here:")
 
+def show_generation_stats(stats=None):
+    stats = st.session_state.rag.last_generation_stats if stats is None else stats
+    if stats.get("cached"):
+        st.caption("⚡ Served from cache")
+    elif stats:
+        st.caption(f"⏱️ First token after {stats['ttft_s']:.2f}s, "
+                   f"{stats['tokens']} tokens @ {stats['tokens_per_s']:.1f} tok/s")
+
+
 if user_input:
-    with st.spinner("🤖 Generating answer..."):
-        if enable_graph_rag:
-            # Use GraphRAG pipeline
-            response = st.session_state.graph_rag.query(
-                user_input, top_k=top_k, max_length=max_tokens
-            )
-            st.write("🤖 **GraphRAG Answer:**")
-            st.write(response)
-        elif compare_method:
-            # Compare RAG vs HyDE
-            rag_response = st.session_state.rag.answer(
+    # Answers are rendered token by token as they are generated
+    if enable_graph_rag:
+        # Use GraphRAG pipeline
+        st.write("🤖 **GraphRAG Answer:**")
+        st.write_stream(st.session_state.graph_rag.stream_query(
+            user_input, top_k=top_k, max_length=max_tokens, sources=pipeline_sources
+        ))
+        graph_timings = st.session_state.graph_rag.last_timings
+        if graph_timings:
+            st.caption(f"🧠 Graph retrieval {graph_timings['total'] * 1000:.1f} ms "
+                       f"(entities: {', '.join(st.session_state.graph_rag.last_entities) or '-'})")
+        show_generation_stats()
+    elif compare_method:
+        # Compare RAG vs HyDE: run both at once so their prompts share generation batches.
+        # Each call reports into its own stats dict; the pipeline's last_* attributes are shared.
+        rag_stats, hyde_stats = {}, {}
+        with st.spinner("🤖 Generating answers..."), ThreadPoolExecutor(max_workers=2) as pool:
+            rag_future = pool.submit(
+                st.session_state.rag.answer,
                 user_input,
                 top_k=top_k,
                 max_length=max_tokens,
                 sources=pipeline_sources,
+                stats=rag_stats,
             )
-            hyde_response = st.session_state.rag.hyde_answer(
+            hyde_future = pool.submit(
+                st.session_state.rag.hyde_answer,
                 user_input,
                 top_k=hyde_top_k,
                 max_length=max_tokens,
                 sources=pipeline_sources,
                 pseudo_max_tokens=pseudo_max_tokens,
+                stats=hyde_stats,
             )
-            st.write("🤖 **RAG Answer:**")
-            st.write(rag_response)
-            st.write("🤖 **HyDE Answer:**")
-            st.write(hyde_response)
-        else:
-            # Use selected method (RAG or HyDE)
-            if retrieval_method == "RAG":
-                response = st.session_state.rag.answer(
-                    user_input,
-                    top_k=top_k,
-                    max_length=max_tokens,
-                    sources=pipeline_sources,
-                )
-            else:  # HyDE
-                response = st.session_state.rag.hyde_answer(
-                    user_input,
-                    top_k=hyde_top_k,
-                    max_length=max_tokens,
-                    sources=pipeline_sources,
-                    pseudo_max_tokens=pseudo_max_tokens,
-                )
-            st.write("🤖 **Answer:**")
-            st.write(response)
+            rag_response, hyde_response = rag_future.result(), hyde_future.result()
+        st.write("🤖 **RAG Answer:**")
+        st.write(rag_response)
+        show_generation_stats(rag_stats["generation_stats"])
+        st.write("🤖 **HyDE Answer:**")
+        st.write(hyde_response)
+        show_generation_stats(hyde_stats["generation_stats"])
+    else:
+        # Use selected method (RAG or HyDE)
+        st.write("🤖 **Answer:**")
+        if retrieval_method == "RAG":
+            st.write_stream(st.session_state.rag.stream_answer(
+                user_input,
+                top_k=top_k,
+                max_length=max_tokens,
+                sources=pipeline_sources,
+            ))
+        else:  # HyDE
+            st.write_stream(st.session_state.rag.stream_hyde_answer(
+                user_input,
+                top_k=hyde_top_k,
+                max_length=max_tokens,
+                sources=pipeline_sources,
+                pseudo_max_tokens=pseudo_max_tokens,
+            ))
+        show_generation_stats()
+
+# ------------------------
+# Last Query Breakdown
+# ------------------------
+# Rendered last so it shows the query answered in this run
+from app.metrics import render_prometheus
+
+with st.sidebar.expander("📈 Last query"):
+    traces = [pipeline.last_trace for pipeline in (st.session_state.rag, st.session_state.get("graph_rag"))
+              if pipeline is not None and pipeline.last_trace is not None]
+    if traces:
+        trace = max(traces, key=lambda t: t.wall_start)
+        lines = []
+        for depth, s in trace.walk():
+            attrs = " ".join(f"{k}={v}" for k, v in s.attrs.items())
+            lines.append(f"{'  ' * depth}{s.name:<{max(1, 16 - 2 * depth)}} {(s.duration or 0.0) * 1000:9.1f} ms  {attrs}")
+        st.code("\n".join(lines), language=None)
+    else:
+        st.write("No question answered yet.")
+    st.download_button("Download metrics (Prometheus)", render_prometheus(),
+                       file_name="metrics.prom", mime="text/plain")
@@ -0,0 +1,15 @@
+import hashlib
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def fake_embed(texts, dimension=384):
+    """Deterministic unit vectors, so tests never load the embedding model."""
+    out = np.zeros((len(texts), dimension), dtype=np.float32)
+    for i, text in enumerate(texts):
+        rng = np.random.default_rng(int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little"))
+        out[i] = rng.standard_normal(dimension)
+    return out / np.linalg.norm(out, axis=1, keepdims=True)
@@ -0,0 +1,116 @@
+import os
+import random
+import numpy as np
+from app.bm25 import BM25Index, tokenize
+from app.chunk_store import ChunkStore
+
+WORDS = [f"w{i}" for i in range(300)]
+
+
+def random_docs(rng, n, prefix=""):
+    return [" ".join(rng.choice(WORDS) for _ in range(20)) + prefix for _ in range(n)]
+
+
+def assert_same_ranking(index, reference, queries):
+    for query in queries:
+        ids, scores = index.top_k(query, 10)
+        ref_ids, ref_scores = reference.top_k(query, 10)
+        assert list(ids) == list(ref_ids), query
+        assert np.allclose(scores, ref_scores), query
+
+
+def test_tokenize_folds_case_and_turkish_i():
+    assert tokenize("Straße İstanbul ISTANBUL ıstanbul") == ["strasse", "istanbul", "istanbul", "istanbul"]
+
+
+def test_scores_match_okapi_formula():
+    index = BM25Index(k1=1.5, b=0.75)
+    texts = ["apple banana", "apple apple cherry", "banana"]
+    index.add([0, 1, 2], texts)
+    avgdl = np.mean([len(t.split()) for t in texts])
+    idf = np.log1p((3 - 2 + 0.5) / (2 + 0.5))
+    expected = idf * 2 * 2.5 / (2 + 1.5 * (1 - 0.75 + 0.75 * 3 / avgdl))
+    assert np.isclose(index.get_scores("apple")[1], expected)
+
+
+def test_incremental_updates_match_a_fresh_build():
+    rng = random.Random(0)
+    index = BM25Index(merge_ratio=0.1)
+    ids, texts = list(range(200)), random_docs(rng, 200)
+    index.add(ids, texts)
+    for step in range(20):
+        new = random_docs(rng, 5, f" new{step}")
+        new_ids = list(range(ids[-1] + 1, ids[-1] + 6))
+        index.add(new_ids, new)
+        ids, texts = ids + new_ids, texts + new
+        gone = set(rng.sample(ids, 3))
+        index.delete(sorted(gone))
+        ids, texts = [i for i in ids if i not in gone], [t for i, t in zip(ids, texts) if i not in gone]
+
+    fresh = BM25Index()
+    fresh.add(ids, texts)
+    assert len(index) == len(fresh) == len(ids)
+    assert_same_ranking(index, fresh, ["w1 w2", "new19 w5", "new3", "w299 w0 w150"])
+
+
+def test_sync_with_chunk_store():
+    store = ChunkStore()
+    store.extend(["red apple", "green pear"], [{"doc_name": "a"}] * 2)
+    index = BM25Index()
+    assert index.sync(store)
+    store.delete([0])
+    store.extend(["red cherry"], [{}])
+    assert index.sync(store)
+    assert not index.sync(store)
+    ids, _ = index.top_k("red", 5)
+    assert list(ids) == [2]
+
+
+def test_saves_write_deltas_and_reload(tmp_path):
+    rng = random.Random(1)
+    path = str(tmp_path)
+    index = BM25Index(merge_ratio=0.5)
+    ids, texts = list(range(300)), random_docs(rng, 300)
+    index.add(ids, texts)
+    index.save(path, "f0")
+    base = [name for name in os.listdir(path) if name.startswith("base-")]
+
+    for step in range(3):
+        new = random_docs(rng, 2, f" new{step}")
+        new_ids = [ids[-1] + 1, ids[-1] + 2]
+        index.add(new_ids, new)
+        index.delete([ids[step]])
+        ids, texts = ids + new_ids, texts + new
+        index.save(path, f"f{step + 1}")
+    # Small changes leave the base file alone
+    assert [name for name in os.listdir(path) if name.startswith("base-")] == base
+    assert len([name for name in os.listdir(path) if name.startswith("delta-")]) == 3
+
+    assert BM25Index.load(path, "f0") is None
+    loaded = BM25Index.load(path, "f3")
+    keep = [(i, t) for i, t in zip(ids, texts) if i >= 3]
+    fresh = BM25Index()
+    fresh.add([i for i, _ in keep], [t for _, t in keep])
+    assert_same_ranking(loaded, fresh, ["w1 w7", "new2", "new0 w3"])
+
+    # Once the deltas outgrow merge_ratio of the base it is rewritten
+    loaded.add(list(range(1000, 1300)), random_docs(rng, 300))
+    loaded.save(path, "f4")
+    assert not [name for name in os.listdir(path) if name.startswith("delta-")]
+    assert len(BM25Index.load(path, "f4")) == len(loaded)
+
+
+def test_stale_writer_rewrites_the_base(tmp_path):
+    path = str(tmp_path)
+    first = BM25Index()
+    first.add([0, 1], ["alpha beta", "gamma"])
+    first.save(path, "a")
+    second = BM25Index.load(path, "a")
+    second.add([2], ["delta"])
+    second.save(path, "b")
+    first.add([5], ["epsilon"])
+    first.save(path, "c")
+
+    loaded = BM25Index.load(path, "c")
+    assert sorted(loaded.vocab) == ["alpha", "beta", "epsilon", "gamma"]
+    assert list(loaded.ids) == [0, 1, 5]
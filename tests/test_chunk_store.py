@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+from app.chunk_store import ChunkStore
+
+
+def reopen(store, path):
+    return ChunkStore.open(str(path), store.state())
+
+
+def test_write_and_open(tmp_path):
+    store = ChunkStore()
+    ids = store.extend(["first", "zweite Straße", "third"],
+                       [{"doc_name": "a", "page": 1}, {"doc_name": "a"}, {}])
+    store.set_content_hash("a", "ha")
+    store.write(str(tmp_path))
+
+    loaded = reopen(store, tmp_path)
+    assert ids == [0, 1, 2]
+    assert list(loaded) == [{"id": 0, "text": "first", "meta": {"doc_name": "a", "page": 1}},
+                            {"id": 1, "text": "zweite Straße", "meta": {"doc_name": "a"}},
+                            {"id": 2, "text": "third", "meta": {}}]
+    assert loaded.documents() == ["a"]
+    assert loaded.content_hash("a") == "ha"
+
+
+def test_appends_and_deletes_across_writes(tmp_path):
+    store = ChunkStore()
+    store.extend(["a0", "a1"], [{"doc_name": "a"}] * 2)
+    store.write(str(tmp_path))
+    store.extend(["b0"], [{"doc_name": "b"}])
+    store.delete(store.doc_chunk_ids("a")[:1])
+    store.write(str(tmp_path))
+
+    loaded = reopen(store, tmp_path)
+    assert [d["text"] for d in loaded] == ["a1", "b0"]
+    assert 0 not in loaded and loaded.get(0) is None
+    assert loaded.text(2) == "b0"
+    assert np.array_equal(loaded.ids(), [1, 2])
+    # New ids keep counting past deleted ones
+    assert loaded.append("c0") == 3
+
+
+def test_compact_keeps_ids(tmp_path):
+    store = ChunkStore()
+    store.extend([f"t{i}" for i in range(6)], [{"doc_name": f"d{i % 2}"} for i in range(6)])
+    store.write(str(tmp_path))
+    store.delete(store.doc_chunk_ids("d0"))
+    store.write(str(tmp_path))
+    store.compact(str(tmp_path))
+
+    assert store.num_rows == 3
+    loaded = reopen(store, tmp_path)
+    assert loaded.generation == 1
+    assert [(d["id"], d["text"]) for d in loaded] == [(1, "t1"), (3, "t3"), (5, "t5")]
+    assert loaded.documents() == ["d1"]
+
+
+def test_uncommitted_write_keeps_committed_docs(tmp_path):
+    store = ChunkStore()
+    store.extend(["old"], [{"doc_name": "a"}])
+    store.set_content_hash("a", "v1")
+    store.write(str(tmp_path))
+    committed = store.state()
+
+    store.delete(store.doc_chunk_ids("a"))
+    store.extend(["new"], [{"doc_name": "a"}])
+    store.set_content_hash("a", "v2")
+    store.write(str(tmp_path))  # the caller crashes before committing state()
+
+    loaded = ChunkStore.open(str(tmp_path), committed)
+    assert [d["text"] for d in loaded] == ["old"]
+    assert loaded.content_hash("a") == "v1"
+
+
+def test_ids_must_increase():
+    store = ChunkStore()
+    store.append("x", chunk_id=5)
+    with pytest.raises(ValueError):
+        store.append("y", chunk_id=5)
+
+
+def test_fingerprint_tracks_documents():
+    store = ChunkStore()
+    store.extend(["x"], [{"doc_name": "a"}])
+    before = store.doc_fingerprint()
+    store.set_content_hash("a", "h")
+    assert store.doc_fingerprint() != before
+    before = store.doc_fingerprint()
+    store.delete([0])
+    assert store.doc_fingerprint() != before
+
+
+def test_fingerprint_follows_chunk_contents_not_layout(tmp_path):
+    store = ChunkStore()
+    store.extend(["a0", "a1", "b0"], [{"doc_name": "a"}, {"doc_name": "a"}, {"doc_name": "b"}])
+    store.write(str(tmp_path))
+    store.delete([1])
+    before = store.doc_fingerprint()
+
+    store.write(str(tmp_path))
+    assert store.doc_fingerprint() == before
+    assert reopen(store, tmp_path).doc_fingerprint() == before
+    store.compact(str(tmp_path))
+    assert store.doc_fingerprint() == before
+    assert reopen(store, tmp_path).doc_fingerprint() == before
+
+    same = ChunkStore.from_records([{"id": 0, "text": "a0", "meta": {"doc_name": "a"}},
+                                    {"id": 2, "text": "b0", "meta": {"doc_name": "b"}}])
+    assert same.doc_fingerprint() == before
+    edited = ChunkStore.from_records([{"id": 0, "text": "a0 edited", "meta": {"doc_name": "a"}},
+                                      {"id": 2, "text": "b0", "meta": {"doc_name": "b"}}])
+    assert edited.doc_fingerprint() != before
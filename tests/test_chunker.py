@@ -0,0 +1,98 @@
+import io
+import random
+import re
+import numpy as np
+import pytest
+from app.utils import chunk_spans, chunk_spans_batch, sentence_bounds
+
+WORDS = ["alpha", "beta", "gamma", "delta.", "epsilon!", "zeta", "eta?", "theta", "ünïcödé", "日本語。",
+         "tab\tsep", "nb\xa0sp"]
+
+
+class CharTokenizer:
+    """Fast-tokenizer stand-in: every non-space run of up to 3 characters is a token."""
+
+    def __call__(self, texts, add_special_tokens=False, return_offsets_mapping=False, verbose=False):
+        return {"offset_mapping": [[(m.start(), m.end()) for m in re.finditer(r"\S{1,3}", text)]
+                                   for text in texts]}
+
+
+def check_spans(text, spans, size, overlap, token_starts=None):
+    word_ends = {m.end() for m in re.finditer(r"\S+", text)}
+    has_long_word = any(len(m.group()) > size for m in re.finditer(r"\S+", text))
+    covered = np.zeros(len(text), dtype=bool)
+    for k, (start, end) in enumerate(spans):
+        assert 0 <= start < end <= len(text)
+        if token_starts is None:
+            assert end - start <= size
+        else:
+            assert np.count_nonzero((token_starts >= start) & (token_starts < end)) <= size
+        if k:
+            prev_start, prev_end = spans[k - 1]
+            assert start > prev_start and end > prev_end
+            if token_starts is None:
+                assert prev_end - start <= overlap
+        if end not in word_ends:
+            assert has_long_word  # only a too long word is cut
+        covered[start:end] = True
+    assert all(covered[i] for i in range(len(text)) if not text[i].isspace())
+
+
+def test_sentence_bounds():
+    text = "  Der Motor läuft. Die Motoren　sind laut!  Ist das so? Ja"
+    starts, ends = sentence_bounds(text)
+    assert [text[s:e] for s, e in zip(starts, ends)] == [
+        "Der Motor läuft.", "Die Motoren　sind laut!", "Ist das so?", "Ja"]
+    assert sentence_bounds("   ") == ([], [])
+
+
+def test_prefers_sentence_boundaries():
+    text = "First sentence here. Second one is here. Third."
+    spans = chunk_spans(text, chunk_size=25, overlap=0)
+    assert [text[s:e] for s, e in spans] == ["First sentence here.", "Second one is here.", "Third."]
+
+
+def test_rejects_overlap_not_smaller_than_size():
+    with pytest.raises(ValueError):
+        chunk_spans("some text", chunk_size=10, overlap=10)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_character_chunks_cover_text_within_limits(seed):
+    rng = random.Random(seed)
+    words = WORDS + (["x" * 700] if seed % 3 == 0 else [])
+    text = " ".join(rng.choice(words) for _ in range(rng.randint(1, 400)))
+    size = rng.choice([8, 20, 50, 100, 300, 500])
+    overlap = rng.choice([0, 5, 20, 49]) if size > 50 else rng.choice([0, 5])
+    check_spans(text, chunk_spans(text, size, overlap), size, overlap)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_token_chunks_stay_within_token_budget(seed):
+    rng = random.Random(seed)
+    texts = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 200))) for _ in range(3)]
+    size, overlap = rng.choice([(10, 2), (40, 8), (64, 0)])
+    tokenizer = CharTokenizer()
+    starts = [np.array([s for s, _ in offsets], dtype=np.int64)
+              for offsets in tokenizer(texts)["offset_mapping"]]
+    for text, spans, token_starts in zip(texts, chunk_spans_batch(texts, size, overlap, tokenizer), starts):
+        check_spans(text, spans, size, overlap, token_starts)
+
+
+def test_iter_chunks_records_page_offsets():
+    docx = pytest.importorskip("docx")
+    file_processor = pytest.importorskip("app.file_processor")
+    document = docx.Document()
+    for i in range(40):
+        document.add_paragraph(f"Paragraph {i} talks about topic {i}. " * 5)
+    buffer = io.BytesIO()
+    document.save(buffer)
+
+    chunks = list(file_processor.iter_chunks("report.docx", buffer.getvalue(), chunk_size=200, overlap=20))
+    assert chunks and {meta["doc_name"] for _, meta in chunks} == {"report.docx"}
+    assert len({meta["page"] for _, meta in chunks}) > 1
+    pages = dict(file_processor.iter_pages("report.docx", buffer.getvalue()))
+    for text, meta in chunks:
+        page = " ".join(pages[meta["page"]].split())
+        assert page[meta["char_start"]:meta["char_end"]] == text
+        assert len(text) <= 200
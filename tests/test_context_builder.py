@@ -0,0 +1,86 @@
+from app.context_builder import ContextBuilder, format_doc
+
+
+class WordTokenizer:
+    """One token per whitespace-separated word."""
+
+    def __init__(self):
+        self.vocab = {}
+        self.words = []
+        self.calls = 0
+
+    def _encode(self, text):
+        ids = []
+        for word in text.split():
+            if word not in self.vocab:
+                self.vocab[word] = len(self.words)
+                self.words.append(word)
+            ids.append(self.vocab[word])
+        return ids
+
+    def __call__(self, texts, add_special_tokens=True):
+        self.calls += 1
+        if isinstance(texts, str):
+            return {"input_ids": self._encode(texts)}
+        return {"input_ids": [self._encode(text) for text in texts]}
+
+    def decode(self, ids, skip_special_tokens=True):
+        return " ".join(self.words[i] for i in ids)
+
+
+def prompt(context, query):
+    return f"Context: {context} Question: {query}"
+
+
+def chunk(chunk_id, text, doc="a", **meta):
+    return {"id": chunk_id, "text": text, "meta": {"doc_name": doc, **meta}}
+
+
+def test_merges_overlapping_neighbours_by_offsets():
+    page = "one two three four five six seven"
+    docs = [chunk(2, page[8:23], char_start=8, char_end=23),   # "three four five"
+            chunk(1, page[0:13], char_start=0, char_end=13),   # "one two three"
+            chunk(3, page[19:], char_start=19, char_end=len(page))]
+    merged = ContextBuilder(WordTokenizer()).merge_adjacent(docs)
+    assert len(merged) == 1
+    assert merged[0]["text"] == page
+    assert merged[0]["merged_ids"] == [1, 2, 3]
+
+
+def test_merges_by_text_overlap_and_keeps_other_documents_apart():
+    docs = [chunk(1, "alpha beta gamma"), chunk(2, "gamma delta"),
+            chunk(3, "gamma delta", doc="b"), chunk(5, "unrelated")]
+    merged = ContextBuilder(WordTokenizer()).merge_adjacent(docs)
+    assert [d["text"] for d in merged] == ["alpha beta gamma delta", "gamma delta", "unrelated"]
+
+
+def test_packs_in_rank_order_within_budget():
+    tokenizer = WordTokenizer()
+    template = len(prompt("", "q").split())
+    builder = ContextBuilder(tokenizer, max_tokens=template + 8)
+    docs = [chunk(1, "w1 w2 w3"), chunk(10, "x1 x2 x3 x4 x5 x6"), chunk(20, "y1 y2")]
+    context, stats = builder.build(docs, prompt, "q")
+    # "[a] w1 w2 w3" is 4 tokens, the 7-token chunk does not fit next to it, "[a] y1 y2" does
+    assert context == "[a] w1 w2 w3\n\n[a] y1 y2"
+    assert stats["chunks"] == 2 and stats["dropped"] == 1
+    assert stats["tokens"] <= builder.max_tokens
+
+
+def test_truncates_the_best_chunk_when_nothing_fits():
+    template = len(prompt("", "q").split())
+    builder = ContextBuilder(WordTokenizer(), max_tokens=template + 3)
+    context, stats = builder.build([chunk(1, "w1 w2 w3 w4 w5")], prompt, "q")
+    assert context == "[a] w1 w2"
+    assert stats["truncated"] and stats["context_tokens"] == 3
+
+
+def test_token_counts_are_cached():
+    tokenizer = WordTokenizer()
+    builder = ContextBuilder(tokenizer, cache_size=2)
+    texts = [format_doc(chunk(1, "a b")), "c d e"]
+    assert builder.count_tokens(texts) == [3, 3]
+    calls = tokenizer.calls
+    assert builder.count_tokens(texts) == [3, 3]
+    assert tokenizer.calls == calls
+    builder.count_tokens(["f"])
+    assert len(builder._counts) == 2
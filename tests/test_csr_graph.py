@@ -0,0 +1,87 @@
+import random
+import networkx as nx
+import pytest
+from app.csr_graph import CSRGraph
+from app.graph_builder import GraphBuilder
+
+
+def random_edges(rng, nodes, n):
+    """`n` distinct undirected edges without self-loops."""
+    edges = set()
+    while len(edges) < n:
+        a, b = sorted(rng.sample(range(nodes), 2))
+        edges.add((f"e{a}", f"e{b}"))
+    return sorted(edges)
+
+
+def test_k_hop_matches_networkx():
+    rng = random.Random(0)
+    csr, reference = CSRGraph(), nx.Graph()
+    edges = random_edges(rng, 200, 300)
+    for u, v in edges:
+        for name in (u, v):
+            csr.bump_node(name, 1)
+            reference.add_node(name)
+        csr.bump_edge(u, v, "rel", 1)
+        reference.add_edge(u, v)
+    # Remove some edges once they are in the arrays, and add more that stay pending
+    csr.compact()
+    for u, v in edges[:40]:
+        csr.bump_edge(v, u, "rel", -1)
+        reference.remove_edge(u, v)
+    for u, v in random_edges(rng, 220, 20):
+        csr.bump_node(u, 1)
+        csr.bump_node(v, 1)
+        csr.bump_edge(u, v, "rel", 1)
+        reference.add_edge(u, v)
+
+    assert csr.number_of_edges() == reference.number_of_edges()
+    for seed in ("e0", "e17", "e123"):
+        expected = nx.single_source_shortest_path_length(reference, seed, cutoff=2)
+        assert csr.neighborhood([seed], 2) == expected
+
+
+def test_names_are_normalized_and_nodes_counted():
+    graph = CSRGraph()
+    graph.bump_node("New  York", 1)
+    graph.bump_node("new york", 1)
+    graph.bump_edge("New York", "Hudson", "on", 1)
+    assert len(graph) == 1 and "NEW YORK" in graph
+    graph.bump_node("new york", -2)
+    assert "New York" not in graph and len(graph) == 0
+
+
+def test_round_trip_through_data():
+    graph = CSRGraph()
+    for name in ("Paris", "France", "Seine"):
+        graph.bump_node(name, 1)
+    graph.bump_edge("Paris", "France", "in", 2)
+    graph.bump_edge("Seine", "Paris", "through", 1)
+
+    loaded = CSRGraph.from_data(graph.to_data())
+    assert loaded.to_data() == graph.to_data()
+    assert loaded.neighborhood(["seine"], 2) == {"seine": 0, "paris": 1, "france": 2}
+
+
+class EntryGraphBuilder(GraphBuilder):
+    """Chunks given as (key, entities, relations), so no spaCy model is needed."""
+
+    def add(self, key, entities, relations=()):
+        with self.lock:
+            self._remove_entry(key)
+            self._add_entry(key, {"h": "", "entities": list(entities), "relations": [list(r) for r in relations]})
+
+
+@pytest.mark.parametrize("backend", ["networkx", "csr"])
+def test_neighbourhood_cache_follows_graph_version(tmp_path, backend):
+    builder = EntryGraphBuilder(path=str(tmp_path), backend=backend)
+    builder.add("user:0", ["Paris", "France"], [("Paris", "in", "France")])
+    builder.add("user:1", ["France", "Europe"], [("France", "in", "Europe")])
+
+    assert [key for key, _ in builder.rank_chunks({"paris"}, depth=2)] == ["user:0", "user:1"]
+    builder.rank_chunks({"paris"}, depth=2)
+    assert (builder.cache_hits, builder.cache_misses) == (1, 1)
+
+    builder.remove_chunks(["user:1"])
+    assert [key for key, _ in builder.rank_chunks({"paris"}, depth=2)] == ["user:0"]
+    assert builder.cache_misses == 2
@@ -0,0 +1,35 @@
+import pytest
+from app.generation_scheduler import _Request
+
+
+class CharTokenizer:
+    eos_token_id = 0
+
+    def decode(self, ids, skip_special_tokens=True):
+        return "".join(chr(i) for i in ids)
+
+
+def test_finished_request_stats():
+    request = _Request("prompt", max_new_tokens=3, temperature=0.0, do_sample=False, stream=False)
+    for token in b"ab":
+        request.add_token(token, CharTokenizer())
+    request.add_token(CharTokenizer.eos_token_id, CharTokenizer())
+
+    assert request.future.result() == "ab"
+    stats = request.stats()
+    assert stats["tokens"] == 2
+    assert stats["total_s"] >= stats["ttft_s"] >= 0
+
+
+def test_failed_request_is_finished():
+    request = _Request("prompt", max_new_tokens=3, temperature=0.0, do_sample=False, stream=True)
+    request.add_token(ord("a"), CharTokenizer())
+    error = RuntimeError("out of memory")
+    request.fail(error)
+
+    assert request.finished is not None
+    with pytest.raises(RuntimeError):
+        request.future.result()
+    stats = request.stats()
+    assert stats["tokens"] == 1
+    assert stats["total_s"] >= stats["ttft_s"] >= 0
@@ -0,0 +1,58 @@
+from types import SimpleNamespace
+
+import pytest
+from app.chunk_store import ChunkStore
+from app.graph_builder import GraphBuilder, text_hash
+from app.graph_pipeline import GraphRAGPipeline
+
+
+class CapitalizedGraphBuilder(GraphBuilder):
+    """Capitalized words as entities, so no spaCy model is needed."""
+
+    def extract_entities(self, text):
+        return [word.strip(".,?") for word in text.split() if word[:1].isupper()]
+
+    def add_chunks(self, items):
+        added = 0
+        for key, text in items:
+            with self.lock:
+                self._remove_entry(key)
+                self._add_entry(key, {"h": text_hash(text), "entities": self.extract_entities(text),
+                                      "relations": []})
+            added += 1
+        return added
+
+
+def store(texts):
+    chunks = ChunkStore()
+    chunks.extend(texts, [{"doc_name": "a"}] * len(texts))
+    return SimpleNamespace(texts=chunks)
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    rag = SimpleNamespace(user_vectorstore=store(["Paris is in France.", "Rome is in Italy."]),
+                          db_vectorstore=store(["Paris hosts the Louvre."]))
+    graph = GraphRAGPipeline(rag, graph_builder=CapitalizedGraphBuilder(path=str(tmp_path)))
+    graph.build_knowledge_graph()
+    return graph
+
+
+def sources_of(docs):
+    return sorted((doc["source"], doc["text"]) for doc in docs)
+
+
+def test_retrieve_defaults_to_both_stores(pipeline):
+    assert sources_of(pipeline.retrieve("Where is Paris?", top_k=5)) == [
+        ("db", "Paris hosts the Louvre."), ("user", "Paris is in France.")]
+
+
+def test_retrieve_only_from_the_given_sources(pipeline):
+    assert sources_of(pipeline.retrieve("Where is Paris?", top_k=5, sources=["db"])) == [
+        ("db", "Paris hosts the Louvre.")]
+    assert sources_of(pipeline.retrieve("Where is Paris?", top_k=5, sources=["user"])) == [
+        ("user", "Paris is in France.")]
+
+
+def test_retrieve_with_no_sources_returns_nothing(pipeline):
+    assert pipeline.retrieve("Where is Paris?", top_k=5, sources=[]) == []
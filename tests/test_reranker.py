@@ -0,0 +1,71 @@
+from app.reranker import Reranker, lexical_score
+
+
+class CountingCrossEncoder:
+    """Scores a pair by the number of query words in the text."""
+
+    def __init__(self):
+        self.pairs = []
+
+    def predict(self, pairs, batch_size=32, show_progress_bar=False):
+        self.pairs.extend(pairs)
+        return [len(set(query.split()) & set(text.split())) for query, text in pairs]
+
+
+def reranker(**kwargs):
+    reranker = Reranker(**kwargs)
+    reranker._model = CountingCrossEncoder()
+    return reranker
+
+
+def doc(chunk_id, text, score=None, source="user"):
+    d = {"id": chunk_id, "text": text, "meta": {}, "source": source}
+    if score is not None:
+        d["score"] = score
+    return d
+
+
+DOCS = [doc(0, "red"), doc(1, "red green blue"), doc(2, "blue"), doc(3, "red green")]
+
+
+def test_orders_by_cross_encoder_score():
+    ranked = reranker().rerank("red green blue", DOCS, top_k=3)
+    assert [d["id"] for d in ranked] == [1, 3, 0]
+    assert [d["rerank_score"] for d in ranked] == [3.0, 2.0, 1.0]
+
+
+def test_scores_are_cached_per_query_and_chunk():
+    r = reranker()
+    r.rerank("red green blue", DOCS, top_k=2)
+    timings = {}
+    r.rerank("red green blue", DOCS + [doc(4, "green")], top_k=2, timings=timings)
+    assert timings["cache_hits"] == 4 and timings["pairs_scored"] == 1
+    assert len(r._model.pairs) == 5
+    # Same id in another store, or another query, is scored again
+    r.rerank("red green blue", [doc(0, "red green blue", source="db")], top_k=1)
+    r.rerank("blue", DOCS[:1], top_k=1)
+    assert len(r._model.pairs) == 7
+
+
+def test_cascade_scores_only_the_top_m():
+    r = reranker(cascade_top_m=2)
+    docs = [doc(0, "red", 0.9), doc(1, "red green blue", 0.1), doc(2, "blue", 0.5), doc(3, "red green", 0.2)]
+    ranked = r.rerank("red green blue", docs, top_k=4)
+    assert [text for _, text in r._model.pairs] == ["red", "blue"]
+    # The rest follow in their cheap-score order, without a rerank score
+    assert [d["id"] for d in ranked] == [0, 2, 3, 1]
+    assert "rerank_score" not in ranked[2]
+
+
+def test_cascade_falls_back_to_lexical_overlap():
+    r = reranker(cascade_top_m=1)
+    r.rerank("red green blue", DOCS, top_k=1)
+    assert r._model.pairs == [("red green blue", "red green blue")]
+    assert lexical_score("Red, green!", "green red") == 1.0
+
+
+def test_max_candidates_and_cache_size():
+    r = reranker(max_candidates=2, cache_size=3)
+    assert [d["id"] for d in r.rerank("red green blue", DOCS, top_k=4)] == [1, 0]
+    r.rerank("blue", DOCS[:2], top_k=2)
+    assert len(r._cache) == 3
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from app.bm25 import BM25Index
+from app.retriever import HybridRetriever
+from app.vectorstore import VectorStore
+from conftest import fake_embed
+
+
+def ranked(name, kind, ids, scores):
+    return name, kind, np.array(ids, dtype=np.int64), np.array(scores, dtype=np.float32)
+
+
+def order(fused):
+    return [key for key, _ in fused]
+
+
+def test_rrf_sums_reciprocal_ranks():
+    retriever = HybridRetriever(fusion="rrf", rrf_k=60)
+    fused = retriever._fuse([ranked("user", "dense", [1, 2, 3], [0.9, 0.5, 0.1]),
+                             ranked("user", "bm25", [3, 1], [10.0, 2.0])])
+    assert order(fused) == [("user", 1), ("user", 3), ("user", 2)]
+    assert dict(fused)[("user", 1)] == pytest.approx(1 / 61 + 1 / 62)
+    assert dict(fused)[("user", 2)] == pytest.approx(1 / 62)
+
+
+def test_weighted_fusion_normalizes_and_weights_scores():
+    lists = [ranked("user", "dense", [1, 2, 3], [0.9, 0.5, 0.1]), ranked("user", "bm25", [3, 1], [10.0, 2.0])]
+    fused = HybridRetriever(fusion="weighted", dense_weight=0.3, bm25_weight=0.7)._fuse(lists)
+    assert order(fused) == [("user", 3), ("user", 1), ("user", 2)]
+    assert [score for _, score in fused] == pytest.approx([0.7, 0.3, 0.15])
+    # Equal scores fall back to (source, id) order
+    fused = HybridRetriever(fusion="weighted")._fuse(lists)
+    assert order(fused) == [("user", 1), ("user", 3), ("user", 2)]
+
+
+def test_same_id_in_two_sources_stays_separate():
+    fused = HybridRetriever()._fuse([ranked("user", "dense", [7], [0.5]), ranked("db", "dense", [7], [0.5])])
+    assert order(fused) == [("db", 7), ("user", 7)]
+
+
+def test_unknown_fusion():
+    with pytest.raises(ValueError):
+        HybridRetriever(fusion="max")
+
+
+def source(texts):
+    store = VectorStore()
+    store.add_texts(texts, [{"doc_name": "a"}] * len(texts), embeddings=fake_embed(texts))
+    bm25 = BM25Index()
+    bm25.sync(store.texts)
+    return store, bm25
+
+
+def test_retrieve_drops_near_duplicates_across_stores():
+    user, user_bm25 = source(["Paris is the capital of France", "Berlin is the capital of Germany"])
+    db, db_bm25 = source(["Paris is the capital of France.", "Madrid is in Spain"])
+    query = "capital of France"
+    docs, timings = HybridRetriever().retrieve(query, 3, [("user", user, user_bm25), ("db", db, db_bm25)],
+                                                query_embedding=fake_embed([query]))
+
+    texts = [doc["text"] for doc in docs]
+    assert len(texts) == 3
+    assert sum(text.startswith("Paris") for text in texts) == 1
+    assert texts[0].startswith("Paris")
+    assert [doc["score"] for doc in docs] == sorted((doc["score"] for doc in docs), reverse=True)
+    assert {"dense:user", "bm25:user", "dense:db", "bm25:db", "fuse", "dedup"} <= set(timings)
+
+
+def test_retrieve_bm25_only():
+    user, user_bm25 = source(["Paris is the capital of France", "Berlin is the capital of Germany"])
+    docs, timings = HybridRetriever().retrieve("Germany", 1, [("user", user, user_bm25)], dense=False)
+    assert [doc["text"] for doc in docs] == ["Berlin is the capital of Germany"]
+    assert "embed" not in timings and "dense:user" not in timings
@@ -0,0 +1,144 @@
+import json
+import os
+import threading
+import numpy as np
+from app.vectorstore import VectorStore
+from app.segment_store import MANIFEST
+from conftest import fake_embed
+
+
+def upsert(store, name, texts, content_hash=None):
+    return store.upsert_document(name, texts, content_hash=content_hash, embeddings=fake_embed(texts))
+
+
+def best(store, text):
+    ids, _ = store.search_ids(None, top_k=1, query_embedding=fake_embed([text]))
+    return store.texts[int(ids[0])]["text"]
+
+
+def test_save_load_round_trip(tmp_path):
+    store = VectorStore(str(tmp_path))
+    upsert(store, "a", ["a one", "a two"], "ha")
+    store.save()
+    upsert(store, "b", ["b one"], "hb")
+    store.save()
+
+    loaded = VectorStore(str(tmp_path), load=True)
+    assert sorted(loaded.documents()) == ["a", "b"]
+    assert loaded.texts.content_hash("b") == "hb"
+    assert loaded.index.ntotal == 3
+    for text in ("a one", "a two", "b one"):
+        assert best(loaded, text) == text
+
+
+def test_upsert_and_compaction(tmp_path):
+    store = VectorStore(str(tmp_path))
+    for round_ in range(5):
+        upsert(store, "doc", [f"v{round_} {i}" for i in range(4)], f"h{round_}")
+        store.save()
+    assert len(store.texts) == 4
+
+    loaded = VectorStore(str(tmp_path), load=True)
+    assert [d["text"] for d in loaded.texts] == [f"v4 {i}" for i in range(4)]
+    assert best(loaded, "v4 2") == "v4 2"
+    with open(tmp_path / MANIFEST) as f:
+        manifest = json.load(f)
+    # Deleted rows are compacted away once they pass max_deleted_ratio
+    assert manifest["count"] < 20
+
+
+def test_interrupted_save_is_ignored(tmp_path):
+    store = VectorStore(str(tmp_path))
+    upsert(store, "a", ["a one"])
+    store.save()
+    upsert(store, "b", ["b one"])
+    store.texts.write(str(tmp_path))  # rows on disk, manifest never committed
+
+    loaded = VectorStore(str(tmp_path), load=True)
+    assert loaded.documents() == ["a"]
+    upsert(loaded, "c", ["c one"])
+    loaded.save()
+    again = VectorStore(str(tmp_path), load=True)
+    assert sorted(again.documents()) == ["a", "c"]
+    assert best(again, "c one") == "c one"
+
+
+def test_two_writers_on_one_path(tmp_path):
+    base = VectorStore(str(tmp_path))
+    upsert(base, "a", ["a one", "a two"])
+    base.save()
+
+    first = VectorStore(str(tmp_path), load=True)
+    second = VectorStore(str(tmp_path), load=True)
+    upsert(first, "b", ["b chunk 1", "b chunk 2"], "hb")
+    upsert(second, "e", ["e one"], "he")
+    second.delete_document("a")
+    first.save()
+    second.save()
+
+    loaded = VectorStore(str(tmp_path), load=True)
+    assert sorted(loaded.documents()) == ["b", "e"]
+    assert loaded.texts.content_hash("b") == "hb"
+    for text in ("b chunk 1", "b chunk 2", "e one"):
+        assert best(loaded, text) == text
+
+
+def test_concurrent_sessions(tmp_path):
+    VectorStore(str(tmp_path)).save()
+
+    def session(k):
+        for j in range(5):
+            store = VectorStore(str(tmp_path), load=True)
+            upsert(store, f"doc{k}-{j}", [f"doc{k}-{j} chunk {i}" for i in range(3)])
+            store.save()
+
+    threads = [threading.Thread(target=session, args=(k,)) for k in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    loaded = VectorStore(str(tmp_path), load=True)
+    assert len(loaded.documents()) == 20
+    assert len(loaded.texts) == loaded.index.ntotal == 60
+    assert best(loaded, "doc3-4 chunk 1") == "doc3-4 chunk 1"
+
+
+def test_legacy_index_is_migrated(tmp_path):
+    import faiss
+    texts = [{"text": "old one", "meta": {"doc_name": "old"}}, {"text": "old two", "meta": {"doc_name": "old"}}]
+    index = faiss.IndexFlatIP(384)
+    index.add(fake_embed([t["text"] for t in texts]))
+    faiss.write_index(index, str(tmp_path / "index.faiss"))
+    with open(tmp_path / "texts.json", "w") as f:
+        json.dump(texts, f)
+
+    store = VectorStore(str(tmp_path), load=True)
+    assert best(store, "old two") == "old two"
+    store.save()
+    assert not os.path.exists(tmp_path / "index.faiss")
+    loaded = VectorStore(str(tmp_path), load=True)
+    assert loaded.documents() == ["old"]
+    assert np.array_equal(loaded.texts.ids(), [0, 1])
+
+
+def test_deletes_after_ivf_promotion(tmp_path):
+    store = VectorStore(str(tmp_path), index_type="ivf_flat", promote_threshold=400, train_size=400)
+    for d in range(5):
+        upsert(store, f"doc{d}", [f"doc{d} chunk {i}" for i in range(120)])
+    assert store.active_index_type == "ivf_flat"
+
+    store.delete_document("doc1")
+    assert best(store, "doc2 chunk 5") == "doc2 chunk 5"
+    assert best(store, "doc4 chunk 7") == "doc4 chunk 7"
+    upsert(store, "doc3", ["doc3 replaced"])
+    assert best(store, "doc3 replaced") == "doc3 replaced"
+    assert best(store, "doc0 chunk 9") == "doc0 chunk 9"
+    assert store.index.ntotal == len(store.texts) == 361
+
+    store.save()
+    loaded = VectorStore(str(tmp_path), load=True, index_type="ivf_flat", promote_threshold=400, train_size=400)
+    assert loaded.active_index_type == "ivf_flat"
+    loaded.delete_document("doc4")
+    assert best(loaded, "doc2 chunk 5") == "doc2 chunk 5"
+    assert loaded.index.ntotal == len(loaded.texts) == 241
@@ -0,0 +1,65 @@
+import numpy as np
+from conftest import fake_embed
+from app.semantic_cache import SemanticCache
+
+SCOPE = {"sources": ["user", "db"], "top_k": 3, "corpus": "v1"}
+
+
+def near(text, other, cosine):
+    """A unit vector at exactly `cosine` to the embedding of `text`."""
+    base, noise = fake_embed([text, other])
+    noise -= noise.dot(base) * base
+    noise /= np.linalg.norm(noise)
+    return cosine * base + np.sqrt(1 - cosine ** 2) * noise
+
+
+def test_hit_for_near_duplicate_question():
+    cache = SemanticCache(threshold=0.9)
+    cache.add(fake_embed(["What is RAG?"])[0], SCOPE, "What is RAG?", "Retrieval-augmented generation.")
+
+    answer, similarity, query = cache.get(near("What is RAG?", "noise", 0.95), SCOPE)
+    assert (answer, query) == ("Retrieval-augmented generation.", "What is RAG?")
+    assert abs(similarity - 0.95) < 1e-4
+    assert cache.stats()["saved_generations"] == 1
+
+
+def test_threshold():
+    cache = SemanticCache(threshold=0.9)
+    cache.add(fake_embed(["What is RAG?"])[0], SCOPE, "What is RAG?", "answer")
+
+    assert cache.get(near("What is RAG?", "noise", 0.85), SCOPE) is None
+    assert cache.get(fake_embed(["Who wrote Faust?"])[0], SCOPE) is None
+    # A per-lookup threshold does not change the shared default
+    assert cache.get(near("What is RAG?", "noise", 0.85), SCOPE, threshold=0.8) is not None
+    assert cache.threshold == 0.9
+    assert cache.get(near("What is RAG?", "noise", 0.85), SCOPE) is None
+
+
+def test_scopes_are_isolated():
+    cache = SemanticCache(threshold=0.9)
+    embedding = fake_embed(["What is RAG?"])[0]
+    cache.add(embedding, SCOPE, "What is RAG?", "from both stores")
+
+    assert cache.get(embedding, {**SCOPE, "sources": ["user"]}) is None
+    assert cache.get(embedding, {**SCOPE, "corpus": "v2"}) is None
+    # Key order does not matter
+    assert cache.get(embedding, dict(reversed(list(SCOPE.items()))))[0] == "from both stores"
+
+    cache.add(embedding, {**SCOPE, "sources": ["user"]}, "What is RAG?", "from user uploads")
+    assert cache.get(embedding, {**SCOPE, "sources": ["user"]})[0] == "from user uploads"
+    assert cache.get(embedding, SCOPE)[0] == "from both stores"
+
+
+def test_evicts_oldest_entries_and_scopes():
+    cache = SemanticCache(threshold=0.99, max_entries=4, max_scopes=2)
+    questions = [f"question {i}" for i in range(5)]
+    for question, embedding in zip(questions, fake_embed(questions)):
+        cache.add(embedding, SCOPE, question, question.upper())
+
+    assert cache.get(fake_embed(["question 0"])[0], SCOPE) is None
+    assert cache.get(fake_embed(["question 4"])[0], SCOPE)[0] == "QUESTION 4"
+    assert cache.stats()["entries"] == 3
+
+    cache.add(fake_embed(["a"])[0], {"scope": 2}, "a", "A")
+    cache.add(fake_embed(["b"])[0], {"scope": 3}, "b", "B")
+    assert cache.get(fake_embed(["question 4"])[0], SCOPE) is None